@@ -5,12 +5,14 @@ Home of main classes for TIMBER.
 """
 
 from TIMBER.CollectionOrganizer import CollectionOrganizer
-from TIMBER.Tools.Common import GenerateHash, GetHistBinningTuple, CompileCpp, ConcatCols, GetStandardFlags, ExecuteCmd, LoadColumnNames
+from TIMBER.Tools.Common import GenerateHash, GetHistBinningTuple, CompileCpp, ConcatCols, GetStandardFlags, ExecuteCmd, LoadColumnNames, ContentHash, GetCacheDir, OpenJSON, WriteJSON, RegisterLazyHeaders, DeclareHeader, DeclareHeadersFor, HeaderReport, ReadSourceFiles, GetCompiledCodeFor, GetSourcesFor, LoopMonitor, WatchLoops, Cutflow, CutflowTree
 from clang import cindex
 from collections import OrderedDict
 
+from multiprocessing.pool import ThreadPool
+
 import ROOT
-import pprint, copy, os, subprocess, textwrap, re, glob
+import pprint, copy, os, subprocess, textwrap, re, glob, time
 pp = pprint.PrettyPrinter(indent=4)
 
 # For parsing c++ modules
@@ -21,6 +23,267 @@ cpp_args = cpp_args.split(' ')
 
 TIMBERPATH = os.environ["TIMBERPATH"]
 
+def _releaseGIL(method):
+    '''Let a PyROOT method release the python GIL while it runs so that
+    calls from several threads can overlap (ex. opening files over xrootd).
+
+    @param method: PyROOT method (ex. `ROOT.TFile.Open`).
+    '''
+    try:
+        method.__release_gil__ = True # cppyy-based PyROOT (ROOT >= 6.22)
+    except AttributeError:
+        pass
+    try:
+        method._threaded = True # legacy PyROOT
+    except AttributeError:
+        pass
+
+def _strArgs(args):
+    '''Convert the strings in a list of arguments read from JSON (unicode in python 2) to str.
+
+    @param args (list): Arguments.
+
+    Returns:
+        list: Arguments with strings as str.
+    '''
+    return [a if isinstance(a,(bool,int,float)) or a == None else str(a) for a in args]
+
+def _portablePath(path):
+    '''Make a path inside TIMBERPATH relative to it (see analyzer.SaveGraph()).
+
+    @param path (str): Path.
+
+    Returns:
+        str: Path relative to TIMBERPATH or the input if outside of it.
+    '''
+    timberpath = os.environ['TIMBERPATH']
+    return path[len(timberpath):] if path.startswith(timberpath) else path
+
+def _localPath(path):
+    '''Undo _portablePath() for the local TIMBERPATH (relative paths which do not
+    exist from the working directory are taken to be inside TIMBERPATH).
+
+    @param path (str): Path.
+
+    Returns:
+        str: Path.
+    '''
+    if os.path.isabs(path) or os.path.exists(path): return path
+    return os.environ['TIMBERPATH']+path if os.path.exists(os.environ['TIMBERPATH']+path) else path
+
+def _nodeHash(parent,op,name,nodetype,action):
+    '''Hash identifying a Node made from its parent. Two Nodes with the same
+    hash hold the same content so one can be used in place of the other.
+
+    @param parent (Node): Parent Node.
+    @param op (str): RDataFrame operation ("Define", "Filter", or "Range").
+    @param name (str): Name of the new Node.
+    @param nodetype (str): Type of the new Node.
+    @param action (str): Action performed (the C++ line).
+
+    Returns:
+        str: Hash.
+    '''
+    return ContentHash([parent.hash,op,name,nodetype,action])
+
+def _calibKernel(name,inputs,types,factors):
+    '''Generate the C++ used by analyzer.CalibrateVars() to calibrate several variables
+    of a collection at once. The struct `<name>Calib_<hash>` holds one RVec per calibrated column
+    and the function `<name>Calib_<hash>_Calibrate(variables..., calibrations...)` sizes them once
+    and fills all of them in one loop over the collection.
+
+    @param name (str): Name of the calibrated collection.
+    @param inputs ([str]): Variables followed by the calibration columns (`<calib>__vec`, indexed as [item][{nominal, up, down}]).
+    @param types ([str]): Types of the inputs.
+    @param factors (OrderedDict): Calibrated column name mapped to a tuple of the variable and a list of
+            (calibration name, index of the variation) to multiply it by.
+
+    Returns:
+        tuple(str,str): Name of the struct and the C++ code.
+    '''
+    structName = '%sCalib_%s'%(name,ContentHash(inputs+types+['%s=%s'%(c,factors[c]) for c in factors],8))
+    code = 'struct %s {\n'%structName
+    code += ''.join(['    ROOT::VecOps::RVec<float> %s;\n'%c for c in factors])
+    code += '};\n'
+    code += '%s %s_Calibrate(%s) {\n'%(structName,structName,', '.join(['const %s& %s'%(t,i) for t,i in zip(types,inputs)]))
+    code += '    %s out;\n'%structName
+    code += '    std::size_t n = %s.size();\n'%inputs[0]
+    code += ''.join(['    out.%s.resize(n);\n'%c for c in factors])
+    code += '    for (std::size_t i = 0; i < n; i++) {\n'
+    for c in factors:
+        var, calibs = factors[c]
+        code += '        out.%s[i] = %s[i]%s;\n'%(c,var,''.join(['*%s__vec[i][%s]'%(calib,j) for calib,j in calibs]))
+    code += '    }\n'
+    code += '    return out;\n'
+    code += '}\n'
+    return structName, code
+
+def _weightKernelInputs(nominal,variations):
+    '''Arguments (after the extra nominal factor) of the function made by _weightKernel().
+
+    @param nominal ([str]): Columns multiplied together for the nominal weight.
+    @param variations (OrderedDict): See _weightKernel().
+
+    Returns:
+        [str]: Column names without duplicates.
+    '''
+    inputs = []
+    for c in nominal + [c for v in variations for r in variations[v][0] for c in r] + [c for v in variations for c in variations[v][1]]:
+        if c not in inputs: inputs.append(c)
+    return inputs
+
+def _weightKernel(name,nominal,variations):
+    '''Generate the C++ used by analyzer.MakeWeightCols() to calculate all of the weights at once.
+    The function `<name>_<hash>(extra, factors...)` returns an RVec with the nominal weight first
+    followed by each of the variations. The nominal product is only calculated once and every variation
+    divides out the factors it replaces. Factors which are zero are counted instead of multiplied in so
+    that they can also be divided out.
+
+    @param name (str): Name of the weight array column.
+    @param nominal ([str]): Columns multiplied together for the nominal weight.
+    @param variations (OrderedDict): Variation name mapped to a tuple of the list of (nominal column, replacement column)
+            and the list of extra columns to multiply the nominal weight by.
+
+    Returns:
+        tuple(str,str): Name of the function and the C++ code.
+    '''
+    inputs = _weightKernelInputs(nominal,variations)
+    funcName = '%s_%s'%(name,ContentHash(nominal+['%s=%s'%(v,variations[v]) for v in variations],8))
+    code = 'ROOT::VecOps::RVec<float> %s(%s) {\n'%(funcName,', '.join(['double extra']+['double %s'%i for i in inputs]))
+    code += '    ROOT::VecOps::RVec<float> w(%s);\n'%(len(variations)+1)
+    code += '    double nom = 1.;\n'
+    code += '    int nZero = 0;\n'
+    code += ''.join(['    if (%s == 0) nZero++; else nom *= %s;\n'%(c,c) for c in nominal])
+    code += '    w[0] = nZero > 0 ? 0. : extra*nom;\n'
+    code += '    double p;\n'
+    code += '    int z;\n'
+    for i,v in enumerate(variations):
+        replaced, extras = variations[v]
+        code += '    p = nom;\n'
+        code += '    z = nZero;\n'
+        code += ''.join(['    if (%s == 0) z--; else p /= %s;\n'%(old,old) for old,new in replaced])
+        code += '    w[%s] = z > 0 ? 0. : extra*p%s;\n'%(i+1,''.join(['*%s'%new for old,new in replaced]+['*%s'%e for e in extras]))
+    code += '    return w;\n'
+    code += '}\n'
+    return funcName, code
+
+def _multiHistBooker(dimension,types):
+    '''Generate the C++ used by analyzer.MakeTemplateHistos() to book a MultiHist action
+    (see MultiHist.h) on an RNode. The function `MultiHist<dimension>D_<hash>(df, model, names, titles, columns)`
+    books the action with the column types filled in and returns the pointer to the vector of histograms.
+
+    @param dimension (int): 1, 2, or 3.
+    @param types ([str]): Types of the variables.
+
+    Returns:
+        tuple(str,str): Name of the function and the C++ code.
+    '''
+    funcName = 'MultiHist%sD_%s'%(dimension,ContentHash(types,8))
+    code = 'ROOT::RDF::RResultPtr<std::vector<TH%sD>> %s(ROOT::RDF::RNode df, const ROOT::RDF::TH%sDModel& model, '%(dimension,funcName,dimension)
+    code += 'const std::vector<std::string>& names, const std::vector<std::string>& titles, const std::vector<std::string>& columns) {\n'
+    code += '    return df.Book<%s, ROOT::VecOps::RVec<double>>(MultiHist<TH%sD, %s>(*model.GetHistogram(), names, titles, df.GetNSlots()), columns);\n'%(', '.join(types),dimension,', '.join(types))
+    code += '}\n'
+    return funcName, code
+
+def _stringVector(strings):
+    '''Convert a list of python strings to a `std::vector<std::string>`.
+
+    @param strings ([str]): Strings.
+
+    Returns:
+        std.vector(std.string)
+    '''
+    out = ROOT.std.vector('std::string')()
+    for s in strings:
+        out.push_back(str(s))
+    return out
+
+def _columnTypeFunc(node,column):
+    '''Function returning the type of a column of a Node so that it is only
+    looked up once needed (see CollectionOrganizer.AddBranch()).
+
+    @param node (Node): Node.
+    @param column (str): Column name.
+
+    Returns:
+        function
+    '''
+    return lambda: str(node.DataFrame.GetColumnType(column))
+
+def _sliceKernel(basecoll,branches,types):
+    '''Generate the C++ used by analyzer.SubCollection() to slice several array branches
+    of a collection at once. The struct `<basecoll>Slice_<hash>` holds one RVec per attribute
+    and the function `<basecoll>Slice_<hash>_Take(indices, branches...)` fills all of them
+    in one loop over the indices to keep.
+
+    @param basecoll (str): Name of the collection.
+    @param branches ([str]): Array branches of the collection.
+    @param types ([str]): Types of the branches.
+
+    Returns:
+        tuple(str,str): Name of the struct and the C++ code.
+    '''
+    structName = '%sSlice_%s'%(basecoll,ContentHash([basecoll]+branches+types,8))
+    attrs = [b[len(basecoll)+1:] for b in branches]
+    code = 'struct %s {\n'%structName
+    code += ''.join(['    %s %s;\n'%(t,a) for t,a in zip(types,attrs)])
+    code += '};\n'
+    code += 'template <class Tidx>\n'
+    code += '%s %s_Take(const Tidx& idx, %s) {\n'%(structName,structName,', '.join(['const %s& %s'%(t,b) for t,b in zip(types,branches)]))
+    code += '    %s out;\n'%structName
+    code += ''.join(['    out.%s.resize(idx.size());\n'%a for a in attrs])
+    code += '    for (std::size_t i = 0; i < idx.size(); i++) {\n'
+    code += ''.join(['        out.%s[i] = %s[idx[i]];\n'%(a,b) for a,b in zip(attrs,branches)])
+    code += '    }\n'
+    code += '    return out;\n'
+    code += '}\n'
+    return structName, code
+
+def _mergeKernel(name,collections,variables,types,sizes,originTag):
+    '''Generate the C++ used by analyzer.MergeCollections() to merge several collections
+    at once. The struct `<name>Merge_<hash>` holds one RVec per variable (plus `collIdx` and
+    `origin` with `originTag`) and the function `<name>Merge_<hash>_Merge(branches...)`
+    sizes them once and fills all of them in one loop over each collection.
+
+    @param name (str): Name of the new collection.
+    @param collections ([str]): Names of the collections to merge.
+    @param variables ([str]): Variables to merge.
+    @param types ([str]): Types of the variables.
+    @param sizes ([str]): C++ expressions for the size of each collection. If there are no
+            variables, these are the names of the arguments instead.
+    @param originTag (bool): Also fill `collIdx` and `origin`.
+
+    Returns:
+        tuple(str,str): Name of the struct and the C++ code.
+    '''
+    structName = '%sMerge_%s'%(name,ContentHash(collections+variables+types+sizes+[originTag],8))
+    members = list(zip(types,variables))
+    if originTag:
+        members += [('ROOT::VecOps::RVec<int>','collIdx'),('ROOT::VecOps::RVec<int>','origin')]
+    if len(variables) == 0:
+        args = ['std::size_t %s'%s for s in sizes]
+    else:
+        args = ['const %s& %s_%s'%(t,c,v) for c in collections for t,v in zip(types,variables)]
+
+    code = 'struct %s {\n'%structName
+    code += ''.join(['    %s %s;\n'%(t,m) for t,m in members])
+    code += '};\n'
+    code += '%s %s_Merge(%s) {\n'%(structName,structName,', '.join(args))
+    code += '    %s out;\n'%structName
+    code += '    std::size_t n = %s;\n'%(' + '.join(sizes))
+    code += ''.join(['    out.%s.resize(n);\n'%m for t,m in members])
+    code += '    std::size_t j = 0;\n'
+    for ic,(c,size) in enumerate(zip(collections,sizes)):
+        code += '    for (std::size_t i = 0; i < %s; i++, j++) {\n'%size
+        code += ''.join(['        out.%s[j] = %s_%s[i];\n'%(v,c,v) for v in variables])
+        if originTag:
+            code += '        out.collIdx[j] = i;\n'
+            code += '        out.origin[j] = %s;\n'%ic
+        code += '    }\n'
+    code += '    return out;\n'
+    code += '}\n'
+    return structName, code
+
 class analyzer(object):
     """Main class for TIMBER. 
 
@@ -30,7 +293,7 @@ class analyzer(object):
 
     When using class functions to perform actions, an active node will always be tracked so that the next action uses 
     the active node and assigns the output node as the new #ActiveNode"""
-    def __init__(self,fileName,eventsTreeName="Events",runTreeName="Runs",multiSampleStr=''):
+    def __init__(self,fileName,eventsTreeName="Events",runTreeName="Runs",multiSampleStr='',openThreads=8,cacheMetadata=True,lazyHeaders=True,strictLoops=False,batchJit=False,pruneCollections=False):
         """Constructor.
         
         Sets up the tracking of actions on an RDataFrame as nodes. Also
@@ -46,6 +309,25 @@ class analyzer(object):
         @param multiSampleStr (str, optional): If a sample was generated with multiple mass points,
                 define the mass which you'd like to analyze in this string. If you're unsure of your options, check the Runs TTree
                 for a branch `genEventSumw_YMass_<mass>`. Defaults to '' which will load `genEventSumw_`.
+        @param openThreads (int, optional): Maximum number of threads used to open and validate the input
+                files concurrently. Use 1 to open the files one at a time. Defaults to 8.
+        @param cacheMetadata (bool, optional): Store the per-file entry counts, sums of the `genEventSumw`/`genEventCount`
+                branches, and `LHEPdfWeight` branch title in a cache on disk (see GetCacheDir()) keyed by the
+                file path, size, modification time, and UUID. Files found in the cache with no changes are not re-read. Defaults to True.
+        @param lazyHeaders (bool, optional): Only declare a header in `TIMBER/Framework/include/` to the interpreter once
+                a Define, Cut, Correction, or Calibration (or any code compiled with CompileCpp()) references one of its
+                namespaces, classes, or functions. Use PrintHeaderReport() to see what was deferred. If False, all
+                headers are declared when the analyzer is constructed. Defaults to True.
+        @param strictLoops (bool, optional): Raise an error (before it starts) if an action would run a second event loop
+                over the dataset. Every loop is counted, timed, and attributed to the line of python that triggered it regardless
+                (see PrintLoopReport()). Defaults to False.
+        @param batchJit (bool, optional): Compile the C++ strings of new Defines and Cuts together (as one block of code)
+                once the RDataFrame of one of them is needed instead of one at a time as they are made (see JitBatch).
+                The compilation time per type of Node is recorded regardless (see PrintJitReport()). Defaults to False.
+        @param pruneCollections (bool, optional): Only include the attributes used by the code known when it is built
+                in the C++ struct of a collection (`<collection>s`) so that the other branches of the collection are not read.
+                C++ compiled afterwards (ex. a Correction) cannot use the attributes left out so list those with
+                KeepCollectionAttributes(). Defaults to False and the structs include every attribute.
         """
 
         ## @var fileName
@@ -91,11 +373,20 @@ class analyzer(object):
         # ROOT.TChain
         #
         # The TChain of the `<runTreeName>` TTree.
+        ## @var Loops
+        # LoopMonitor
+        #
+        # Counts, times, and attributes the event loops run over the dataset.
+        ## @var Jit
+        # JitBatch
+        #
+        # Compiles the C++ of new Defines and Cuts and records how long it takes.
 
         super(analyzer, self).__init__()
         self.fileName = fileName 
         self._eventsTreeName = eventsTreeName
         self._runTreeName = runTreeName
+        self._cacheMetadata = cacheMetadata
         self.silent = False
         if multiSampleStr != '':
             multiSampleStr = 'YMass_%s'%multiSampleStr
@@ -105,12 +396,25 @@ class analyzer(object):
         # Setup TChains for multiple or single file
         self._eventsChain = ROOT.TChain(self._eventsTreeName) 
         self.RunChain = ROOT.TChain(runTreeName) 
+        skipHeaders = []
+        if 'CMSSW_BASE' not in os.environ.keys():
+            skipHeaders = ['JME_common.h','JetSmearer.h','JetRecalibrator.h','JES_weight.h','JER_weight.h','JMS_weight.h','JMR_weight.h']
+        headers = [f for f in sorted(glob.glob(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/*.h')) if f.split('/')[-1] not in skipHeaders]
+        RegisterLazyHeaders(headers)
+        if not lazyHeaders:
+            for f in headers:
+                DeclareHeader(f)
+        # Needed by _checkFile to sum the branches of the Runs TTree
+        DeclareHeader(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/common.h')
+
         print ('Opening files...')
+        self._fileList = []
         if isinstance(self.fileName,list):
             for f in self.fileName:
                 self._addFile(f)
         else:
             self._addFile(self.fileName)
+        self._openFiles(openThreads)
         
         # Make base RDataFrame
         BaseDataFrame = ROOT.RDataFrame(self._eventsChain) 
@@ -118,6 +422,12 @@ class analyzer(object):
         self.BaseNode.children = [] # protect against memory issue when running over multiple sets in one script
         self.AllNodes = [self.BaseNode] 
         self.Corrections = {} 
+        self._bookings = []
+        self._prunedBranches = None
+        self.Loops = LoopMonitor(BaseDataFrame,strictLoops)
+        self.BaseNode.loops = self.Loops
+        self.Jit = JitBatch(batchJit)
+        self.BaseNode.jit = self.Jit
 
         # Check if dealing with data
         if hasattr(self._eventsChain,'genWeight'):
@@ -129,23 +439,23 @@ class analyzer(object):
         self.genEventSumw = 0.0
         self.genEventCount = 0
         if not self.isData: 
-            for i in range(self.RunChain.GetEntries()): 
-                self.RunChain.GetEntry(i)
-                if hasattr(self.RunChain,'genEventSumw'):
-                    self.genEventSumw+= self.RunChain.genEventSumw
-                    self.genEventCount+= self.RunChain.genEventCount
-                elif hasattr(self.RunChain,genEventSumw_str):
-                    self.genEventSumw+= getattr(self.RunChain,genEventSumw_str)
-                    self.genEventCount+= getattr(self.RunChain,genEventCount_str)
+            for info in self._fileInfo:
+                if not info['hasRuns']: continue
+                sums = info['runsSums']
+                if 'genEventSumw' in sums:
+                    self.genEventSumw+= sums['genEventSumw']
+                    self.genEventCount+= sums['genEventCount']
+                elif genEventSumw_str in sums:
+                    self.genEventSumw+= sums[genEventSumw_str]
+                    self.genEventCount+= sums[genEventCount_str]
                 else:
                     raise NameError('In attempt to deduce sum of event weights, could not access branch genEventSumw or %s in TTree %s.'%(genEventSumw_str,self._runTreeName))
 
         # Get LHAID from LHEPdfWeights branch
         self.lhaid = "-1"
         if not self.isData:
-            pdfbranch = self._eventsChain.GetBranch("LHEPdfWeight")
-            if pdfbranch != None:
-                branch_title = pdfbranch.GetTitle()
+            branch_title = self._fileInfo[0]['pdfTitle']
+            if branch_title != None:
                 if branch_title != '': 
                     self.lhaid = ''
                     for c in branch_title:
@@ -162,17 +472,11 @@ class analyzer(object):
         self.ActiveNode = self.BaseNode
         # Auto create collections
         self._collectionOrg = CollectionOrganizer(BaseDataFrame)
-
-        skipHeaders = []
-        if 'CMSSW_BASE' not in os.environ.keys():
-            skipHeaders = ['JME_common.h','JetSmearer.h','JetRecalibrator.h','JES_weight.h','JER_weight.h','JMS_weight.h','JMR_weight.h']
-
-        for f in glob.glob(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/*.h'):
-            if f.split('/')[-1] in skipHeaders: continue
-            CompileCpp('#include "%s"\n'%f)
+        self._collectionOrg.pruneAttributes = pruneCollections
  
     def _addFile(self,f):
-        '''Add file to TChains being tracked.
+        '''Add file to the list of files to be opened and chained together.
+        A .txt file is expanded into the .root files it lists.
 
         Args:
             f (str): File to add.
@@ -180,13 +484,7 @@ class analyzer(object):
         if f.endswith(".root"): 
             if 'root://' not in f and f.startswith('/store/'):
                 f='root://cms-xrd-global.cern.ch/'+f
-            self._eventsChain.Add(f)
-            if ROOT.TFile.Open(f,'READ') == None:
-                raise ReferenceError('File %s does not exist'%f)
-            tempF = ROOT.TFile.Open(f,'READ')
-            if tempF.Get(self._runTreeName) != None:
-                self.RunChain.Add(f)
-            tempF.Close()
+            self._fileList.append(f)
         elif f.endswith(".txt"): 
             txt_file = open(f,"r")
             for l in txt_file.readlines():
@@ -195,6 +493,243 @@ class analyzer(object):
         else:
             raise Exception("File name extension not supported. Please provide a single or list of .root files or a .txt file with a line-separated list of .root files to chain together.")
 
+    def _openFiles(self,nThreads):
+        '''Open and validate all of the files in #_fileList, using up to `nThreads`
+        concurrent threads, and then add them (in the original order) to the TChains being tracked.
+
+        @param nThreads (int): Maximum number of threads to use.
+
+        Raises:
+            ValueError: If there are no files to open (an empty list or .txt file was given).
+            ReferenceError: If a file does not exist or cannot be opened.
+        '''
+        if len(self._fileList) == 0:
+            raise ValueError('No input files found in %s.'%(self.fileName,))
+        start = time.time()
+        nThreads = max(1,min(nThreads,len(self._fileList)))
+        if nThreads > 1:
+            ROOT.ROOT.EnableThreadSafety()
+            _releaseGIL(ROOT.TFile.Open)
+            pool = ThreadPool(nThreads)
+            try:
+                infos = pool.map(self._checkFile,self._fileList)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            infos = [self._checkFile(f) for f in self._fileList]
+
+        self._fileInfo = []
+        for info in infos:
+            if not info['exists']:
+                raise ReferenceError('File %s does not exist'%info['name'])
+            # Providing the number of entries means the TChain does not need to open the file again
+            if info['nEvents'] > 0: self._eventsChain.Add(info['name'],info['nEvents'])
+            else: self._eventsChain.Add(info['name'])
+            if info['hasRuns']:
+                if info['nRuns'] > 0: self.RunChain.Add(info['name'],info['nRuns'])
+                else: self.RunChain.Add(info['name'])
+            self._fileInfo.append(info)
+            if self._cacheMetadata and not info['cached']:
+                self._saveFileMeta(info)
+        self._openTime = time.time()-start
+        print ('Opened %s files in %.2f s (%s threads, %s found in metadata cache)'%(len(self._fileList),self._openTime,nThreads,len([i for i in infos if i['cached']])))
+
+    def _checkFile(self,f):
+        '''Open a file to check that it exists, whether it has the `<runTreeName>` TTree,
+        and how many entries are in the `<eventsTreeName>` and `<runTreeName>` TTrees.
+        Also sums the `genEventSumw*`/`genEventCount*` branches of the `<runTreeName>` TTree
+        and gets the title of the `LHEPdfWeight` branch. If the file is in the metadata cache
+        and unchanged, the cached values are used instead and the TTrees are not read.
+        Safe to call from several threads at once.
+
+        @param f (str): File to check.
+
+        Returns:
+            dict: File information with keys "name", "exists", "hasRuns", "nEvents", "nRuns", "runsSums",
+                "pdfTitle", "size", "mtime", "uuid", "cached", and "time" (seconds spent opening and checking the file).
+        '''
+        start = time.time()
+        info = {'name':f,'exists':False,'hasRuns':False,'nEvents':0,'nRuns':0,
+                'runsSums':{},'pdfTitle':None,'size':-1,'mtime':-1,'uuid':'','cached':False}
+        tempF = ROOT.TFile.Open(f,'READ')
+        if tempF != None and not tempF.IsZombie():
+            info['exists'] = True
+            info['size'] = int(tempF.GetSize())
+            info['uuid'] = str(tempF.GetUUID().AsString())
+            if os.path.exists(f): info['mtime'] = os.path.getmtime(f)
+
+            cached = self._loadFileMeta(info) if self._cacheMetadata else None
+            if cached != None:
+                for k in ['hasRuns','nEvents','nRuns','runsSums','pdfTitle']:
+                    info[k] = cached[k]
+                info['cached'] = True
+            else:
+                eventsTree = tempF.Get(self._eventsTreeName)
+                if eventsTree != None:
+                    info['nEvents'] = int(eventsTree.GetEntries())
+                    pdfbranch = eventsTree.GetBranch("LHEPdfWeight")
+                    if pdfbranch != None:
+                        info['pdfTitle'] = str(pdfbranch.GetTitle())
+                runsTree = tempF.Get(self._runTreeName)
+                if runsTree != None:
+                    info['hasRuns'] = True
+                    info['nRuns'] = int(runsTree.GetEntries())
+                    info['runsSums'] = self._sumRunsBranches(runsTree)
+            tempF.Close()
+        info['time'] = time.time()-start
+        return info
+
+    def _sumRunsBranches(self,runsTree):
+        '''Sum all of the `genEventSumw*` and `genEventCount*` branches of a `<runTreeName>` TTree
+        (including every `genEventSumw_YMass_<mass>` branch of a multi-sample file) in one
+        compiled pass over the TTree (see hardware::SumBranches). Only these branches are read.
+
+        @param runsTree (TTree): TTree to sum over.
+
+        Returns:
+            dict: Sum of each branch keyed by the branch name.
+        '''
+        branches = [str(b.GetName()) for b in runsTree.GetListOfBranches() if re.match('genEvent(Sumw|Count)',str(b.GetName()))]
+        if len(branches) == 0:
+            return {}
+        branch_vec = ROOT.std.vector('std::string')()
+        for b in branches:
+            branch_vec.push_back(b)
+        vals = ROOT.hardware.SumBranches(runsTree,branch_vec)
+        sums = {}
+        for i,b in enumerate(branches):
+            sums[b] = int(round(vals[i])) if b.startswith('genEventCount') else float(vals[i])
+        return sums
+
+    def _fileMetaName(self,f):
+        '''Name of the metadata cache file for an input file.
+
+        @param f (str): Input file name.
+
+        Returns:
+            str: Path to the JSON cache file.
+        '''
+        return GetCacheDir('filemeta')+ContentHash([f,self._eventsTreeName,self._runTreeName])+'.json'
+
+    def _loadFileMeta(self,info):
+        '''Load the cached metadata for a file if it exists and matches the size,
+        modification time, and UUID of the file that was just opened.
+
+        @param info (dict): File information from #_checkFile().
+
+        Returns:
+            dict: Cached information or None if there is no valid cache.
+        '''
+        cachename = self._fileMetaName(info['name'])
+        if not os.path.exists(cachename): return None
+        try:
+            cached = OpenJSON(cachename)
+        except ValueError: # corrupted - will be overwritten
+            return None
+        for k in ['name','size','mtime','uuid']:
+            if cached.get(k) != info[k]: return None
+        return cached
+
+    def _saveFileMeta(self,info):
+        '''Store the metadata for a file in the cache.
+
+        @param info (dict): File information from #_checkFile().
+        '''
+        tocache = dict((k,info[k]) for k in ['name','size','mtime','uuid','hasRuns','nEvents','nRuns','runsSums','pdfTitle'])
+        WriteJSON(tocache,self._fileMetaName(info['name']))
+
+    def PrintFileReport(self,nSlowest=10):
+        '''Print how long it took to open and validate the input files
+        along with the number of entries found in each.
+
+        @param nSlowest (int, optional): Number of files to list, slowest first.
+                Use None to list all files. Defaults to 10.
+
+        Returns:
+            None
+        '''
+        infos = sorted(self._fileInfo, key=lambda info: info['time'], reverse=True)
+        if nSlowest != None: infos = infos[:nSlowest]
+        print ('Opened %s files in %.2f s (summed per-file time %.2f s)'%(len(self._fileInfo),self._openTime,sum([info['time'] for info in self._fileInfo])))
+        print ('{:>10s} {:>12s} {:>8s} {:>7s}  {}'.format('time [s]','nEvents','nRuns','cached','file'))
+        for info in infos:
+            print ('{:>10.3f} {:>12d} {:>8d} {:>7s}  {}'.format(info['time'],info['nEvents'],info['nRuns'],str(info['cached']),info['name']))
+
+    def PrintLoopReport(self):
+        '''Print how many event loops have run over the dataset along with
+        how long each took and the line of python that triggered it.
+
+        Returns:
+            None
+        '''
+        self.Loops.Report()
+
+    def PrintJitReport(self):
+        '''Print how many Nodes of each type (ex. "Define", "Cut", "SubCollDefine", "Correction") have been made
+        and how long the just-in-time compilation of their C++ took when they were booked. RDataFrame
+        compiles most of the C++ of the graph only once the event loop starts so the time taken to start
+        each event loop watched so far (see PrintLoopReport()) is reported separately as "Loop start".
+
+        Returns:
+            None
+        '''
+        self.Jit.Report()
+        starts = [l['jit'] for l in self.Loops.loops if 'jit' in l]
+        if len(starts) > 0:
+            print ('{:>16s} {:>6d} {:>10s}'.format('Loop start',len(starts),'%.2f s'%sum(starts)))
+
+    def PrintHeaderReport(self):
+        '''Print which headers in `TIMBER/Framework/include/` have been declared to the interpreter
+        (and how long each took) and which were deferred because nothing has needed them yet.
+        The start-up time saved is estimated from how long the deferred headers took to declare
+        in previous runs.
+
+        Returns:
+            None
+        '''
+        report = HeaderReport()
+        print ('Declared %s headers in %.2f s'%(len(report['declared']),sum([t for t in report['declared'].values() if t != None])))
+        for h,t in report['declared'].items():
+            print ('{:>10s}  {}'.format('included' if t == None else '%.3f'%t,h.split('/')[-1]))
+        print ('Deferred %s headers: %s'%(len(report['deferred']),', '.join([h.split('/')[-1] for h in report['deferred']])))
+        if report['saved'] != None:
+            print ('Estimated start-up time saved: %.2f s'%report['saved'])
+
+    def GetRunsSums(self):
+        '''Get the sums of all of the `genEventSumw*` and `genEventCount*` branches
+        of the `<runTreeName>` TTree over all of the input files. These are calculated
+        once when the files are opened so no additional loop over the TChain is needed.
+
+        Returns:
+            dict: Sum of each branch keyed by the branch name.
+        '''
+        totals = {}
+        for info in self._fileInfo:
+            for b in info['runsSums']:
+                if b not in totals: totals[b] = 0
+                totals[b]+= info['runsSums'][b]
+        return totals
+
+    def GetMultiSampleSums(self):
+        '''Get the sum of weights and number of generated events for each mass point
+        of a multi-sample file (branches `genEventSumw_YMass_<mass>` and `genEventCount_YMass_<mass>`).
+        Useful to normalize every mass point of a signal sample without opening the
+        files again.
+
+        Returns:
+            dict: Tuple of (genEventSumw, genEventCount) keyed by the mass (str).
+        '''
+        totals = self.GetRunsSums()
+        out = {}
+        for b in totals:
+            m = re.match('genEventSumw_YMass_(.+)$',b)
+            if m == None: continue
+            mass = m.group(1)
+            count_str = 'genEventCount_YMass_'+mass
+            out[mass] = (totals[b], totals[count_str] if count_str in totals else 0)
+        return out
+
     def Close(self):
         '''Safely deletes analyzer instance.
         
@@ -244,12 +779,175 @@ class analyzer(object):
         Returns:
             None
         '''
+        if columns == 'all' and self._prunedBranches != None:
+            columns = self._prunedBranches+self._definedColumns(self.ActiveNode)
+            print ('Snapshot of "all" narrowed to the %s columns kept by PruneBranches()'%len(columns))
         if saveRunChain:
             if openOption != 'RECREATE':
                 raise ValueError('Cannot %s file while also saving Runs TTree. Change openOption to RECREATE.'%openOption)
             self.SaveRunChain(outfilename,merge=False)
             openOption = 'UPDATE' # switch option so snapshot can be saved with RunChain file
-        self.ActiveNode.Snapshot(columns,outfilename,treename,lazy,openOption)
+        ptr = self.ActiveNode.Snapshot(columns,outfilename,treename,lazy,openOption)
+        self._bookings.append({'kind':'Snapshot','node':self.ActiveNode,'columns':columns,
+                               'outfilename':outfilename,'treename':treename,'openOption':openOption,'ptr':ptr})
+
+    def BookCutflow(self,weight=None,node=None,name='cutflow'):
+        '''Book a Cutflow (lazily) so that it is filled in the same event loop as the
+        histograms and snapshots. Unlike CutflowDict(), no loop is run here.
+
+        @param weight (str, optional): Weight column to sum for each cut. Only summed on the cuts where the column
+            exists (the number of events is used before it). Defaults to None in which case only the number of events is counted.
+        @param node (Node, optional): Node to get the cutflow for. Defaults to None and the #ActiveNode is used.
+        @param name (str, optional): Name of the cutflow. Defaults to 'cutflow'.
+
+        Returns:
+            Cutflow: Booked cutflow. Filled when accessed (or by RunAll()).
+
+        Raises:
+            ValueError: If the weight column does not exist on any of the cuts.
+        '''
+        node = self.ActiveNode if node == None else node
+        cutflow = Cutflow(node,weight,name)
+        cutflow.loops = self.Loops
+        self._bookings.append({'kind':'Cutflow','node':node,'weight':weight,'name':name,'ptr':None,'cutflow':cutflow})
+        return cutflow
+
+    def PruneBranches(self,extra=[],narrowSnapshots=False):
+        '''Find the input branches that are needed by the booked results (histograms, cutflows,
+        and snapshots) and by the #ActiveNode by tracing the columns they use back through
+        the cuts and definitions of the Nodes leading to them.
+
+        RDataFrame only reads the branches that the graph uses so the saving comes from narrowing
+        what the graph uses: "all" (or regex) snapshots write every branch and the C++ struct of a collection
+        (`<collection>s`) reads every attribute of the collection unless built with `pruneCollections=True`
+        (see the analyzer constructor). The branches needed once these are narrowed are the "used" branches.
+        An estimate of the compressed bytes read by the booked graph as it is ("before") and once narrowed ("after") is printed.
+
+        Call this after booking everything else and before the event loop runs. Snapshots and structs already booked or built
+        are not changed, so the saving is only made by the ones booked later. With `narrowSnapshots`, later calls to Snapshot() with "all" only write
+        the used branches plus the columns defined on the way to the #ActiveNode.
+
+        @param extra ([str], optional): Other columns that will be needed (ex. used directly on the RDataFrame). Defaults to [].
+        @param narrowSnapshots (bool, optional): Narrow later "all" snapshots to the used branches. Defaults to False.
+
+        Returns:
+            dict: Dictionary with keys "used" (list of input branches needed), "read" (list of input branches read by the booked graph),
+                "nBranches" (number of input branches), "before" and "after" (estimated compressed bytes read by the booked graph
+                and by the narrowed one).
+        '''
+        branches = [str(b) for b in self.BaseNode.DataFrame.GetColumnNames()]
+        branchSet = set(branches)
+
+        # Nodes whose cuts are applied and the expressions of every column defined on the way to them
+        nodes, seen = [], set()
+        for n in [self.ActiveNode]+[b['node'] for b in self._bookings]+[c for b in self._bookings if b['kind'] == 'CutflowTree' for c in b['cutflow'].GetNodes()]:
+            while n != None and n.hash not in seen:
+                seen.add(n.hash)
+                nodes.append(n)
+                n = n.parent
+        definitions = {}
+        for n in nodes:
+            if n.op == 'Define':
+                definitions.setdefault(n.opArgs[0],[]).append(n.opArgs[1])
+
+        # Starting expressions: cuts, booked columns, and weights (and snapshots which are traced separately)
+        toTrace = [n.action for n in nodes if n.op == 'Filter']+list(extra)
+        snapshots = []
+        for b in self._bookings:
+            if b['kind'] == 'Histo':
+                toTrace.extend(b['columns']+([b['weight']] if b['weight'] != None else []))
+            elif b['kind'] == 'MultiHisto':
+                toTrace.extend(b['columns']+b['weights'])
+            elif b['kind'] in ['Cutflow','CutflowTree'] and b['weight'] != None:
+                toTrace.append(b['weight'])
+            elif b['kind'] == 'Snapshot':
+                if b['columns'] == 'all':
+                    snapshots.extend(branches)
+                elif isinstance(b['columns'],str):
+                    snapshots.extend([c for c in branches+list(definitions.keys()) if re.match(b['columns'],c)])
+                else:
+                    toTrace.extend(b['columns'])
+
+        def _trace(expressions,members=None):
+            # With `members`, collection structs only read the attributes accessed as members
+            used, traced, code = set(), set(), []
+            expressions = list(expressions)
+            while len(expressions) > 0:
+                expr = expressions.pop()
+                code.append(expr)
+                for token in re.findall(r'[A-Za-z_]\w*',expr):
+                    if token in traced: continue
+                    traced.add(token)
+                    if members != None and token in self._collectionOrg._builtCollections:
+                        collection = token[:-1]
+                        expressions.extend(['n'+collection]+[collection+'_'+m for m in members if collection+'_'+m in branchSet])
+                    elif token in definitions:
+                        expressions.extend(definitions[token])
+                    if token in branchSet:
+                        used.add(token)
+            # Arrays need their size branch
+            for b in list(used):
+                leaf = self._eventsChain.GetLeaf(b)
+                if leaf and leaf.GetLeafCount():
+                    used.add(leaf.GetLeafCount().GetName())
+            return [b for b in branches if b in used], code
+
+        readList, code = _trace(toTrace+snapshots)
+        # Struct members accessed by the graph or by the C++ it calls
+        members = set(re.findall(r'(?:\.|->)\s*([A-Za-z_]\w*)','\n'.join(GetSourcesFor(code))))
+        usedList, code = _trace(toTrace,members)
+
+        # Estimate from the first file scaled to the full chain
+        self._eventsChain.LoadTree(0)
+        tree = self._eventsChain.GetTree()
+        scale = float(self._eventsChain.GetEntries())/tree.GetEntries() if tree.GetEntries() > 0 else 0.0
+        zipBytes = dict([(b.GetName(),b.GetZipBytes('*')) for b in tree.GetListOfBranches()])
+        before = scale*sum([zipBytes[b] for b in readList if b in zipBytes])
+        after = scale*sum([zipBytes[b] for b in usedList if b in zipBytes])
+        print ('PruneBranches: %s of %s branches read, %s once snapshots and structs are narrowed. Estimated bytes read: %.1f MB -> %.1f MB (%.1f%%)'%(
+                len(readList),len(branches),len(usedList),before/1e6,after/1e6,100.*after/before if before > 0 else 0.0))
+
+        if narrowSnapshots:
+            self._prunedBranches = usedList
+        return {'used':usedList,'read':readList,'nBranches':len(branches),'before':before,'after':after}
+
+    def _definedColumns(self,node):
+        '''Names of the columns defined on the way to a Node (in order), skipping internal ones (starting with "__")
+        and the C++ structs of collections.
+
+        @param node (Node): Last Node.
+
+        Returns:
+            [str]: Column names.
+        '''
+        columns = []
+        while node != None:
+            if node.op == 'Define' and not node.opArgs[0].startswith('__') and node.opArgs[0] not in self._collectionOrg._builtCollections:
+                columns.insert(0,node.opArgs[0])
+            node = node.parent
+        return columns
+
+    def BookCutflowTree(self,weight=None,nodes=None,name='cutflow_tree'):
+        '''Book (lazily) the cutflows of every leaf of the tracked processing tree
+        (the Nodes in #AllNodes without tracked children) in one CutflowTree. Cuts shared by several
+        leaves (ex. before a Discriminate()) are only counted once and everything is filled in one event loop.
+        The result can be drawn on the graph with `PrintNodeTree(..., cutflow=<CutflowTree>)`.
+
+        @param weight (str, optional): Weight column to sum for each cut. Only summed on the cuts where the column
+            exists (the number of events is used before it). Defaults to None in which case only the number of events is counted.
+        @param nodes ([Node], optional): Leaves to use instead. Defaults to None.
+        @param name (str, optional): Name of the tree. Defaults to 'cutflow_tree'.
+
+        Returns:
+            CutflowTree: Booked tree. Filled when accessed (or by RunAll()).
+        '''
+        if nodes == None:
+            tracked = self._getTrackedNodeHashes()
+            nodes = [n for n in self.AllNodes if not any([c.hash in tracked for c in n.children])]
+        tree = CutflowTree(nodes,weight,name)
+        tree.loops = self.Loops
+        self._bookings.append({'kind':'CutflowTree','node':self.BaseNode,'weight':weight,'name':name,'ptr':None,'cutflow':tree})
+        return tree
 
     def SaveRunChain(self,filename,merge=True):
         '''Save the Run tree (chain of all input files) to filename.
@@ -284,6 +982,21 @@ class analyzer(object):
         '''
         return self._collectionOrg.GetCollectionNames()
 
+    def KeepCollectionAttributes(self,collection,attributes=None):
+        '''Always include attributes in the C++ struct of a collection (`<collection>s`).
+        With `pruneCollections=True` (see the constructor), the struct only includes the attributes used by the action that needs it
+        and the C++ compiled or declared before then. Call this before the struct is built if, for example,
+        C++ compiled afterwards uses other attributes.
+
+        @param collection (str): Collection name (ex. "FatJet").
+        @param attributes ([str], optional): Attribute names (ex. `["pt","eta"]`). Defaults to None in which case
+            all attributes of the collection are included.
+
+        Returns:
+            None
+        '''
+        self._collectionOrg.KeepAttributes(collection,attributes)
+
     def GetColumnNames(self,node=None):
         '''Return a list of all column names that currently exist.
 
@@ -335,17 +1048,17 @@ class analyzer(object):
 
         @param node (Node): Node to start tracking.
 
+        A Node that is already tracked (ex. returned again by Node.Define() for an identical action) is skipped.
+
         Raises:
-            NameError: If attempting to track nodes of the same name.
             TypeError: If argument type is not Node.
 
         Returns:
             None
         '''        
         if isinstance(node,Node):
-            if node.hash in self._getTrackedNodeHashes():
-                print ('WARNING: Attempting to track a node with the same hash as one that is already being tracked (%s, %s).'%(node.hash, node.name))
-            self.AllNodes.append(node)
+            if node.hash not in self._getTrackedNodeHashes():
+                self.AllNodes.append(node)
         else:
             raise TypeError('TrackNode() does not support arguments of type %s. Please provide a Node.'%(type(node)))
 
@@ -441,7 +1154,7 @@ class analyzer(object):
         @param cuts (str, CutGroup): A one-line C++ string that evaluates as a bool or a CutGroup object which contains multiple actions that evaluate as bools.
         @param node (Node, optional): Node on which to apply the cut/filter. Defaults to #ActiveNode.
         @param nodetype (str, optional): Defaults to None in which case the new Node will
-            be type "Define".
+            be type "Cut".
 
         Raises:
             TypeError: If argument type is not Node.
@@ -500,7 +1213,7 @@ class analyzer(object):
         elif isinstance(variables,str):
             newNode = self._collectionOrg.CollectionDefCheck(variables, newNode)
             newNode = newNode.Define(name,variables,nodetype=nodetype,silent=self.silent)
-            self._collectionOrg.AddBranch(name, str(newNode.DataFrame.GetColumnType(name)))
+            self._collectionOrg.AddBranch(name, _columnTypeFunc(newNode,name))
             self.TrackNode(newNode)
         else:
             raise TypeError("Second argument to Define method must be a string of a single var or of type VarGroup (which provides an OrderedDict).")
@@ -563,15 +1276,23 @@ class analyzer(object):
 
         return newNodes
 
-    def SubCollection(self,name,basecoll,condition,useTake=False,skip=[]):
+    def SubCollection(self,name,basecoll,condition,useTake=False,skip=[],fused=False):
         '''Creates a collection of a current collection (from a NanoAOD-like format)
         where the array-type branch is slimmed based on some selection.
 
+        By default, each attribute is sliced by its own Define so only the attributes that are
+        used are read (and PruneBranches() can trace them). With `fused`, the indices to keep are found
+        once per event and a generated C++ function fills all of the array attributes of the new collection
+        in one loop. The new columns are views of that result so no further copies are made.
+        The function reads every attribute of `basecoll` that is not skipped so only use it if most
+        of the attributes will be used (or `skip` the rest).
+
         @param name (str): Name of new collection.
         @param basecoll (str): Name of derivative collection.
         @param condition (str): C++ condition that determines which items to keep or a list of indexes to keep (must useTake for latter).
         @param useTake (bool): If `condition` is list of indexes, use VecOps::Take to build subcollection.
         @param skip ([str]): List of variable names in the collection to skip. Note that these do not include the collection name (ex. "pt" not "Jet_pt").
+        @param fused (bool, optional): Slice all of the array attributes in one generated C++ function. Defaults to False.
 
         Returns:
             Node: New #ActiveNode.
@@ -588,6 +1309,7 @@ class analyzer(object):
         if condition != '' and not useTake:
             self.Define(name+'_idx','%s'%(condition))
 
+        toSlice = []
         for b in collBranches:
             replacementName = b.replace(basecoll,name)
             if b == 'n'+basecoll:
@@ -604,16 +1326,43 @@ class analyzer(object):
                 self.Define(replacementName,b,nodetype='SubCollDefine')
             else:
                 if condition != '':
-                    if not useTake:
+                    if fused:
+                        toSlice.append(b)
+                    elif not useTake:
                         self.Define(replacementName,'%s[%s]'%(b,name+'_idx'),nodetype='SubCollDefine')
                     elif useTake:
                         self.Define(replacementName,'ROOT::VecOps::Take(%s,%s)'%(b,condition))
                 else:
                     self.Define(replacementName,b,nodetype='SubCollDefine')
 
+        if len(toSlice) > 0:
+            self._sliceCollection(name,basecoll,toSlice,condition if useTake else 'ROOT::VecOps::Nonzero(%s_idx)'%name)
+
+        return self.ActiveNode
+
+    def _sliceCollection(self,name,basecoll,branches,indices):
+        '''Define the array attributes of a new collection with one generated C++ function
+        which takes the items at `indices` from all of `branches` (see SubCollection()).
+        The result is stored in the (untracked) column `__<name>_slice` and each attribute
+        is defined as a view of its member.
+
+        @param name (str): Name of new collection.
+        @param basecoll (str): Name of derivative collection.
+        @param branches ([str]): Array branches of `basecoll` to slice.
+        @param indices (str): C++ expression for the indices to keep.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        structName, code = _sliceKernel(basecoll,branches,[str(self.DataFrame.GetColumnType(b)) for b in branches])
+        CompileCpp(code)
+        sliceCol = '__%s_slice'%name
+        self.SetActiveNode(self.ActiveNode.Define(sliceCol,'%s_Take(%s,%s)'%(structName,indices,','.join(branches)),nodetype='SubCollDefine',silent=self.silent))
+        for b in branches:
+            self.Define(b.replace(basecoll,name),'hardware::View(%s.%s)'%(sliceCol,b[len(basecoll)+1:]),nodetype='SubCollDefine')
         return self.ActiveNode
 
-    def ReorderCollection(self, name, basecoll, newOrderCol, skip=[]):
+    def ReorderCollection(self, name, basecoll, newOrderCol, skip=[], fused=False):
         '''Reorders a collection (from a NanoAOD-like format) where the 
         new order is another column of vectors with the new indices specified.
 
@@ -621,6 +1370,7 @@ class analyzer(object):
         @param basecoll (str): Name of derivative collection.
         @param newOrderCol (str): Order for the new collection (stored as column in RDataFrame).
         @param skip ([str]): List of variable names in the collection to skip.
+        @param fused (bool, optional): Reorder all of the array attributes in one generated C++ function (see SubCollection()). Defaults to False.
 
         Returns:
             Node: New #ActiveNode.
@@ -630,7 +1380,7 @@ class analyzer(object):
             a.Define('NewFatJetIdxs','ReorderJets(...)')
             a.ReorderCollection('ReorderedFatJets','FatJet','NewFatJetIdxs')
         '''
-        return self.SubCollection(name, basecoll, newOrderCol, skip)
+        return self.SubCollection(name, basecoll, newOrderCol, useTake=True, skip=skip, fused=fused)
 
     def ObjectFromCollection(self,name,basecoll,index,skip=[]):
         '''Similar to creating a SubCollection except the newly defined columns
@@ -660,21 +1410,38 @@ class analyzer(object):
             
         return self.ActiveNode
 
-    def MergeCollections(self,name,collectionNames):
+    def MergeCollections(self,name,collectionNames,fused=True,originTag=False):
         '''Merge collections (provided by list of names in `collectionNames`) into
         one called `name`. Only common variables are taken and stored in the new 
         collection.
 
+        With `fused`, a generated C++ function sizes the new collection once and fills all
+        of the common variables in one loop over each input collection. The new columns
+        are views of that result so no further copies are made. Variables whose type differs between
+        the collections are merged with `Concatenate()` instead.
+
         @param name (str): Name of new collection
         @param collectionNames ([str]): List of names of collections to merge.
+        @param fused (bool, optional): Merge all of the variables in one generated C++ function. Defaults to True.
+        @param originTag (bool, optional): Also make `<name>_collIdx` (index of each item in its original collection)
+                and `<name>_origin` (index in `collectionNames` of its original collection). Requires `fused`. Defaults to False.
+
+        Raises:
+            ValueError: If `originTag` is requested without `fused`.
 
         Example:
             a = analyzer(<...>)
             a.MergeCollections("Lepton",["Electron","Muon"])
         '''
+        if originTag and not fused:
+            raise ValueError('MergeCollections() can only make the origin tags with fused=True.')
         vars_to_make = self.CommonVars(collectionNames)
+        toMerge = []
         for var in vars_to_make:
             if 'RVec' in self.DataFrame.GetColumnType(collectionNames[0]+'_'+var):
+                if fused and len(set([str(self.DataFrame.GetColumnType(c+'_'+var)) for c in collectionNames])) == 1:
+                    toMerge.append(var)
+                    continue
                 concat_str = collectionNames[0]+'_'+var
                 for collName in collectionNames:
                     if collName != collectionNames[0]:
@@ -682,8 +1449,39 @@ class analyzer(object):
 
                 self.Define(name+'_'+var,concat_str,nodetype='MergeDefine')
 
+        if len(toMerge) > 0 or originTag:
+            self._mergeCollections(name,collectionNames,sorted(toMerge),originTag)
+
         self.Define('n'+name,'+'.join(['n'+n for n in collectionNames]),nodetype='MergeDefine')
 
+    def _mergeCollections(self,name,collectionNames,variables,originTag):
+        '''Define the variables of a merged collection with one generated C++ function
+        (see MergeCollections()). The result is stored in the (untracked) column
+        `__<name>_merge` and each variable is defined as a view of its member.
+
+        @param name (str): Name of new collection.
+        @param collectionNames ([str]): Names of the collections to merge.
+        @param variables ([str]): Array variables to merge (with the same type in every collection).
+        @param originTag (bool): Also define `<name>_collIdx` and `<name>_origin`.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        if len(variables) == 0: # only the tags so the sizes come from the counters
+            sizes = ['n'+c for c in collectionNames]
+        else:
+            sizes = ['%s_%s.size()'%(c,variables[0]) for c in collectionNames]
+        types = [str(self.DataFrame.GetColumnType(collectionNames[0]+'_'+v)) for v in variables]
+        structName, code = _mergeKernel(name,collectionNames,variables,types,sizes,originTag)
+        CompileCpp(code)
+        mergeCol = '__%s_merge'%name
+        args = [c+'_'+v for c in collectionNames for v in variables]
+        if len(variables) == 0: args = sizes
+        self.SetActiveNode(self.ActiveNode.Define(mergeCol,'%s_Merge(%s)'%(structName,','.join(args)),nodetype='MergeDefine',silent=self.silent))
+        for v in variables+(['collIdx','origin'] if originTag else []):
+            self.Define(name+'_'+v,'hardware::View(%s.%s)'%(mergeCol,v),nodetype='MergeDefine')
+        return self.ActiveNode
+
     def CommonVars(self,collections):
         '''Find the common variables between collections.
 
@@ -693,9 +1491,9 @@ class analyzer(object):
             [str]: List of variables shared among the collections.
         '''
         commonVars = []
+        colNames = sorted([str(b) for b in self.DataFrame.GetColumnNames()])
         for c in collections:
             out = []
-            colNames = sorted([str(b) for b in self.DataFrame.GetColumnNames()])
             for bname in colNames:
                 if c+'_' in str(bname):
                     out.append(str(bname).replace(c+'_',''))
@@ -838,7 +1636,7 @@ class analyzer(object):
 
         return correctionsToApply
 
-    def MakeWeightCols(self,name='',node=None,correctionNames=None,dropList=[],correlations=[],extraNominal=''):
+    def MakeWeightCols(self,name='',node=None,correctionNames=None,dropList=[],correlations=[],extraNominal='',compact=False):
         '''Makes columns/variables to store total weights based on the Corrections that have been added.
 
         This function automates the calculation of the columns that store the nominal weight and the 
@@ -852,6 +1650,13 @@ class analyzer(object):
         A list of correction names can be provided if only a subset of the corrections being tracked are 
         desired. A drop list can also be supplied to remove a subset of corrections.
 
+        By default, each weight is its own product of the correction columns so every event recalculates
+        the product of all other corrections for each variation. With `compact=True`, all weights are instead
+        calculated together in the column `weightArray<_name>` (nominal first and then the variations in the
+        order the named columns are defined). The nominal product is calculated once and each variation divides out
+        the corrections it replaces. The named columns (ex. `weight__nominal`) still exist and just read from the array
+        so #GetWeightName() and #MakeTemplateHistos() work the same way.
+
         @param name (str): Name for group of weights so as not to duplicate weight columns if running method
                 multiple times. Output columns will have suffix `weight_<name>__`. Defaults to '' with suffix `weight__`.
         @param node (Node): Node to calculate weights on top of. Must be of type Node (not RDataFrame). Defaults to #ActiveNode.
@@ -863,6 +1668,7 @@ class analyzer(object):
                 to correlate syst1 and syst2, provide [("syst1","syst2")]. To anti-correlate, add a "!" infront of the correction name. Ex. [("syst1","!syst2")]
         @param extraNominal (str): String to prepend to all weight calculations. Will be multiplied by the rest of the pieces
                 put together automatically. Defaults to ''.
+        @param compact (bool): Calculate all of the weights at once in the column `weightArray<_name>`. Defaults to False.
 
         Returns:
             Node: New #ActiveNode.
@@ -875,11 +1681,14 @@ class analyzer(object):
         correctionsToApply = self._checkCorrections(node,correctionNames,dropList)
         
         # Build nominal weight first (only "weight", no "uncert")
-        weights = {'nominal':'' if extraNominal == '' else extraNominal+' *'}
+        weights = OrderedDict([('nominal','' if extraNominal == '' else extraNominal+' *')])
+        nominalFactors = [] # for compact
+        variations = OrderedDict() # for compact, (replaced factors, extra factors) for each variation
         for corrname in correctionsToApply:
             corr = self.Corrections[corrname] 
             if corr.GetType() in ['weight','corr']:
                 weights['nominal']+=' '+corrname+'__nom *'
+                nominalFactors.append(corrname+'__nom')
         weights['nominal'] = weights['nominal'][:-2]
 
         if weights['nominal'] == '':  weights['nominal'] = '1'
@@ -902,23 +1711,32 @@ class analyzer(object):
             if corr.GetType() == 'corr': continue
             weights[corrname+'_up'] = weights['nominal']
             weights[corrname+'_down'] = weights['nominal']
+            variations[corrname+'_up'] = ([],[])
+            variations[corrname+'_down'] = ([],[])
 
             for correctionName in correlatedWithOthers:
                 if corr.GetType() == 'weight':
                     if correctionName.startswith('!'): #anti-correlated
                         weights[corrname+'_up'] = weights[corrname+'_up'].replace(' '+correctionName[1:]+'__nom',' '+correctionName[1:]+'__down') #extra space at beginning of replace to avoid substrings
                         weights[corrname+'_down'] = weights[corrname+'_down'].replace(' '+correctionName[1:]+'__nom',' '+correctionName[1:]+'__up')
+                        upVar, downVar = correctionName[1:]+'__down', correctionName[1:]+'__up'
                     else:
                         weights[corrname+'_up'] = weights[corrname+'_up'].replace(' '+correctionName+'__nom',' '+correctionName+'__up')
                         weights[corrname+'_down'] = weights[corrname+'_down'].replace(' '+correctionName+'__nom',' '+correctionName+'__down')
+                        upVar, downVar = correctionName+'__up', correctionName+'__down'
+                    if correctionName.lstrip('!')+'__nom' in nominalFactors:
+                        variations[corrname+'_up'][0].append((correctionName.lstrip('!')+'__nom',upVar))
+                        variations[corrname+'_down'][0].append((correctionName.lstrip('!')+'__nom',downVar))
             
                 elif corr.GetType() == 'uncert':
                     if correctionName.startswith('!'): #anti-correlated
-                        weights[corrname+'_up'] += ' * '+correctionName+'__down'
-                        weights[corrname+'_down'] += ' * '+correctionName+'__up'
+                        upVar, downVar = correctionName[1:]+'__down', correctionName[1:]+'__up'
                     else:
-                        weights[corrname+'_up'] += ' * '+correctionName+'__up'
-                        weights[corrname+'_down'] += ' * '+correctionName+'__down'
+                        upVar, downVar = correctionName+'__up', correctionName+'__down'
+                    weights[corrname+'_up'] += ' * '+upVar
+                    weights[corrname+'_down'] += ' * '+downVar
+                    variations[corrname+'_up'][1].append(upVar)
+                    variations[corrname+'_down'][1].append(downVar)
 
                 elif corr.GetType() == 'corr':
                     continue
@@ -928,8 +1746,17 @@ class analyzer(object):
 
         # Make a node with all weights calculated
         returnNode = node
-        for weight in weights.keys():
-            returnNode = self.Define('weight%s__'%(namemod)+weight,weights[weight],returnNode,nodetype='Weight')
+        if compact:
+            funcName, code = _weightKernel('weightArray'+namemod,nominalFactors,variations)
+            CompileCpp(code)
+            returnNode = self.Define('weightArray%s'%(namemod),'%s(%s)'%(funcName,', '.join(
+                                        ['1.' if extraNominal == '' else '('+extraNominal+')'] + _weightKernelInputs(nominalFactors,variations))),
+                                     returnNode,nodetype='Weight')
+            for i,weight in enumerate(weights.keys()):
+                returnNode = self.Define('weight%s__'%(namemod)+weight,'weightArray%s[%s]'%(namemod,i),returnNode,nodetype='Weight')
+        else:
+            for weight in weights.keys():
+                returnNode = self.Define('weight%s__'%(namemod)+weight,weights[weight],returnNode,nodetype='Weight')
         
         # self.TrackNode(returnNode)
         return self.SetActiveNode(returnNode)
@@ -957,9 +1784,13 @@ class analyzer(object):
             raise NameError("The weight name `%s` does not exist in the current columns. Are you sure the correction has been made and MakeWeightCols has been called?"%weightname)
         return weightname
 
-    def MakeTemplateHistos(self,templateHist,variables,node=None,lazy=True):
+    def MakeTemplateHistos(self,templateHist,variables,node=None,lazy=True,fused=True):
         '''Generates the uncertainty template histograms based on the weights created by #MakeWeightCols(). 
 
+        By default, all of the histograms are filled by one MultiHist action (see MultiHist.h) which finds
+        the bin of each event once and then fills every weight's histogram. With `fused=False` (or if the
+        variables are arrays or `ROOT.RDF.AsRNode` is not available), a separate `Histo1D/2D/3D` is booked for each weight.
+
         @param templateHist (TH1,TH2,TH3,tuple): A TH1, TH2, TH3, or a tuple describing the TH* options.
             Used as a template to create the histograms.
         @param variables ([str]): A list of the columns/variables to plot (ex. ["x","y","z"]).
@@ -967,6 +1798,7 @@ class analyzer(object):
         @param lazy (bool): Make the action lazy which, in this case, means skipping the axis title
             naming. The axis names will be saved in meta data of the returned group (Group.item_meta).
             If using HistGroup.Do(), the axis titles will later be applied automatically.
+        @param fused (bool): Fill all of the histograms with one action. Defaults to True.
 
         Returns:
             HistGroup: Uncertainty template histograms.
@@ -978,26 +1810,29 @@ class analyzer(object):
         baseTitle = templateHist.GetTitle()
         binningTuple,dimension = GetHistBinningTuple(templateHist)
         out = HistGroup(baseName+'_templates')
+        out.loops = self.Loops
 
         if isinstance(variables,str): variables = [variables]
 
-        for cname in weight_cols:
-            histname = '%s__%s'%(baseName,cname.replace('weight__',''))
-            histtitle = '%s__%s'%(baseTitle,cname.replace('weight__','').replace('__nominal',''))
-
-            # Build the tuple to give as argument for template
-            template_attr = (histname,histtitle) + binningTuple
-
-            if dimension == 1: 
-                thishist = node.DataFrame.Histo1D(template_attr,variables[0],cname)
-                meta_data = {"xtitle":variables[0]}
-            elif dimension == 2: 
-                thishist = node.DataFrame.Histo2D(template_attr,variables[0],variables[1],cname)
-                meta_data = {"xtitle":variables[0], "ytitle":variables[1]}
-            elif dimension == 3: 
-                thishist = node.DataFrame.Histo3D(template_attr,variables[0],variables[1],variables[2],cname)
-                meta_data = {"xtitle":variables[0], "ytitle":variables[1], "ztitle":variables[2]}
+        if dimension == 1: 
+            meta_data = {"xtitle":variables[0]}
+        elif dimension == 2: 
+            meta_data = {"xtitle":variables[0], "ytitle":variables[1]}
+        elif dimension == 3: 
+            meta_data = {"xtitle":variables[0], "ytitle":variables[1], "ztitle":variables[2]}
+        histnames = ['%s__%s'%(baseName,cname.replace('weight__','')) for cname in weight_cols]
+        histtitles = ['%s__%s'%(baseTitle,cname.replace('weight__','').replace('__nominal','')) for cname in weight_cols]
+
+        # Array variables fill each element (only supported by Histo1D/2D/3D)
+        if fused and len(weight_cols) > 0 and hasattr(ROOT.RDF,'AsRNode') and \
+           not any(['vec' in str(node.DataFrame.GetColumnType(v)).lower() for v in variables[:dimension]]):
+            hists = self._bookMultiHisto(node,(baseName,baseTitle)+binningTuple,variables[:dimension],weight_cols,
+                                         histnames,histtitles,out.name,[meta_data if lazy else {}]*len(weight_cols))
+        else:
+            hists = [self._bookHisto(node,(histname,histtitle)+binningTuple,variables[:dimension],cname,out.name,histname,meta_data if lazy else {})
+                     for cname,histname,histtitle in zip(weight_cols,histnames,histtitles)]
 
+        for histname,thishist in zip(histnames,hists):
             if lazy:
                 out.Add(histname,thishist,meta_data)
             else:
@@ -1080,7 +1915,7 @@ class analyzer(object):
     #---------------------#
     # Handle calibrations #
     #---------------------#
-    def CalibrateVars(self,varCalibDict,evalArgs,newCollectionName,variationsFlag=True,node=None):
+    def CalibrateVars(self,varCalibDict,evalArgs,newCollectionName,variationsFlag=True,node=None,fused=True):
         '''Calibrate variables (all of the same collection - ex. "FatJet") with the Calibrations provided in varCalibDict and
         arguments provided in evalArgs. Create a new collection
         with the calibrations applied and any re-ordering of the collection applied. As an example...
@@ -1114,6 +1949,10 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
         (ie. "up" and "down" are not relative to "nominal"). If you'd just like the weights and do not want them applied to any variable, you can provide
         an empty dictionary (`{}`) for the varCalibDict argument.
         
+        With `fused`, all of the calibrated array variables (nominal and variations) are calculated by one
+        generated C++ function in one loop over the collection and stored in the (untracked) column
+        `__<newCollectionName>_calib`. The new columns are views of its members so no further copies are made.
+
         This method will set the new active node to the one with the new collection defined.
 
         @param varCalibDict (dict): Dictionary mapping variable to calibrate to calibrations to apply.
@@ -1123,6 +1962,7 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
         @param newCollectionName (str): Output collection name.
         @param variationsFlag (bool): If True, calculate systematic variations. If False, do not calculate variations. Defaults to True.
         @param node (Node, optional): Node to add correction on top of. Defaults to #ActiveNode.
+        @param fused (bool, optional): Calculate all of the calibrated array variables in one generated C++ function. Defaults to True.
 
         Raises:
             TypeError: If argument types are not Node and Correction.
@@ -1137,9 +1977,12 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
         
         # Create the product of weights
         new_columns =  OrderedDict()
-        if len(varCalibDict.keys()) > 0: baseCollectionName = varCalibDict.keys()[0].split('_')[0]
+        toFuse = []
         for var in varCalibDict.keys():
             isRVec = "RVec" in self.DataFrame.GetColumnType(var)
+            if isRVec and fused:
+                toFuse.append(var)
+                continue
             # nominal first
             new_var_name = var+'_nom'#.replace(baseCollectionName,newCollectionName)
             if not isRVec: 
@@ -1154,16 +1997,54 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
                 if variationsFlag == True:
                     for i,v in enumerate(['up','down']):
                         if not isRVec:
-                            new_columns[var+'_'+calib.name+'__'+v] = new_columns[new_var_name].replace(calib.name+'__vec[0]',calib.name+'__vec[%s]'%i+1)
+                            new_columns[var+'_'+calib.name+'__'+v] = new_columns[new_var_name].replace(calib.name+'__vec[0]',calib.name+'__vec[%s]'%(i+1))
                         else:
                             nom_minus_calib = new_columns[new_var_name].replace(calib.name+'__vec,','').replace(calib.name+'__vec','')
                             new_columns[var+'_'+calib.name+'__'+v] = 'hardware::HadamardProduct({0},{1},{2})'.format(nom_minus_calib, calib.name+'__vec',i+1)
+        if len(toFuse) > 0:
+            newNode = self._calibrateCollection(newCollectionName,varCalibDict,toFuse,variationsFlag,newNode)
         # Actually define the columns 
         for c in new_columns.keys():
             newNode = self.Define(c, new_columns[c], newNode, nodetype='Calibration')
         
         return self.SetActiveNode(newNode)
 
+    def _calibrateCollection(self,name,varCalibDict,variables,variationsFlag,node):
+        '''Define the calibrated array variables of a collection (see CalibrateVars())
+        with one generated C++ function. The result is stored in the (untracked) column
+        `__<name>_calib` and each calibrated variable is defined as a view of its member.
+
+        @param name (str): Name of the calibrated collection.
+        @param varCalibDict (dict): Dictionary mapping variable to calibrate to calibrations to apply.
+        @param variables ([str]): Array variables to calibrate.
+        @param variationsFlag (bool): If True, calculate systematic variations.
+        @param node (Node): Node to add the calibrations on top of.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        calibs = []
+        for var in variables:
+            calibs.extend([c.name for c in varCalibDict[var] if c.name not in calibs])
+        # Column name -> (variable, [(calibration, index of {nominal, up, down})])
+        factors = OrderedDict()
+        for var in variables:
+            nominal = [(c.name,0) for c in varCalibDict[var]]
+            factors[var+'_nom'] = (var,nominal)
+            if variationsFlag:
+                for calib in varCalibDict[var]:
+                    for i,v in enumerate(['up','down']):
+                        factors[var+'_'+calib.name+'__'+v] = (var,[(c,i+1) if c == calib.name else (c,j) for c,j in nominal])
+
+        inputs = variables+[c+'__vec' for c in calibs]
+        structName, code = _calibKernel(name,inputs,[str(node.DataFrame.GetColumnType(i)) for i in inputs],factors)
+        CompileCpp(code)
+        calibCol = '__%s_calib'%name
+        newNode = node.Define(calibCol,'%s_Calibrate(%s)'%(structName,','.join(inputs)),nodetype='Calibration',silent=self.silent)
+        for c in factors:
+            newNode = self.Define(c,'hardware::View(%s.%s)'%(calibCol,c),newNode,nodetype='Calibration')
+        return self.SetActiveNode(newNode)
+
     def _checkCalibrations(self,node,varCalibDict,evalArgs):
         newNode = node
         # Type checking
@@ -1184,12 +2065,8 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
                 print ('Adding Calibration %s'%calib.name)
                 newNode = self._addModule(calib, evalArgs[calib], 'Calibration', newNode)
                 # Does not currently account for un-nested calibration (ie. only RVec<RVec<T>> assumed)
-                transpose_name = calib.name+'__vecT'
-                newNode = self.Define(transpose_name,'hardware::Transpose(%s)'%(calib.name+'__vec'))
                 for i,variation in enumerate(['nom','up','down']):
-                    this_element = transpose_name+'[%s]'%i
-                    # Return element if there are actually jets. Else return an empty vector.
-                    newNode = self.Define(calib.name+'_'+variation,'%s.size() > 0 ? %s : RVec<float> (0);'%(transpose_name,this_element))
+                    newNode = self.Define(calib.name+'_'+variation,'hardware::Column(%s,%s)'%(calib.name+'__vec',i),newNode)
         return self.SetActiveNode(newNode)            
     #----------------------------------------------#
     # Build N-1 "tree" and outputs the final nodes #
@@ -1243,7 +2120,7 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
 
         return nminusones
 
-    def PrintNodeTree(self,outfilename,verbose=False,toSkip=['SubCollDefine']):
+    def PrintNodeTree(self,outfilename,verbose=False,toSkip=['SubCollDefine'],cutflow=None):
         '''Print a PDF image of the node structure of the analysis.
         Requires python graphviz package which should be an installed dependency.
 
@@ -1253,11 +2130,14 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
             so providing "Define" will cut out *all* definitions). Possible options
             are "Define", "Cut", "Correction", "MergeDefine", and "SubCollDefine".
             Defaults to ["SubCollDefine"].
+        @param cutflow (CutflowTree, optional): Label the edges leading to each cut with its yield
+            and efficiency (see BookCutflowTree()). Defaults to None.
 
         Returns:
             None
         '''
         import networkx as nx
+        labels = cutflow.GetAnnotations(byNode=True) if cutflow != None else {}
         graph = nx.DiGraph(comment='Node processing tree')
         # Build graph with all nodes
         for node in self.AllNodes:
@@ -1267,7 +2147,10 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
 
             graph.add_node(this_node_hash, label=this_node_label, type=node.type)
             for child in node.children:
-                graph.add_edge(this_node_hash,child.hash)
+                if child.hash in labels:
+                    graph.add_edge(this_node_hash,child.hash,label='"%s"'%labels[child.hash])
+                else:
+                    graph.add_edge(this_node_hash,child.hash)
         # Contract egdes where we want nodes dropped
         for skip in toSkip:
             for node in graph.nodes:
@@ -1306,6 +2189,7 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
                 new histograms evaluated on the #ActiveNode as the values.
         '''
         out = HistGroup(name if name != '' else self.ActiveNode.name)
+        out.loops = self.Loops
         
         for varnames in histDict.keys():
             # Modify hist name
@@ -1317,26 +2201,281 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
                 varnames = [varnames]
             # Get name for histgroup entry
             entry_name = '_vs_'.join(varnames)+'_'+out.name
-            # Add weight to args if specified
-            if len(varnames) == 1:
-                if weight == None: 
-                    h = self.DataFrame.Histo1D(this_tuple,varnames[0])
-                else:
-                    h = self.DataFrame.Histo1D(this_tuple,varnames[0],weight)
-            elif len(varnames) == 2:
-                if weight == None: 
-                    h = self.DataFrame.Histo2D(this_tuple,varnames[0],varnames[1])
-                else:
-                    h = self.DataFrame.Histo2D(this_tuple,varnames[0],varnames[1],weight)
-            elif len(varnames) == 3:
-                if weight == None:
-                    h = self.DataFrame.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2])
-                else:
-                    h = self.DataFrame.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2],weight)
+            h = self._bookHisto(self.ActiveNode,this_tuple,varnames,weight,out.name,entry_name)
             out.Add(entry_name, h)
            
         return out
 
+    def _bookHisto(self,node,histTuple,columns,weight=None,group='',key='',meta={}):
+        '''Books a 1D, 2D, or 3D histogram (based on the number of columns) on a node
+        and records it so that it is included in SaveGraph().
+
+        @param node (Node): Node to book the histogram on.
+        @param histTuple (tuple): Arguments that would normally be passed to `TH1`.
+        @param columns ([str]): Columns to plot in [x,y,z] order.
+        @param weight (str, optional): Weight column. Defaults to None.
+        @param group (str, optional): Name of the HistGroup the histogram is stored in. Defaults to ''.
+        @param key (str, optional): Key of the histogram in the HistGroup. Defaults to ''.
+        @param meta (dict, optional): Meta information stored with the histogram in the HistGroup. Defaults to {}.
+
+        Raises:
+            ValueError: If there are not 1, 2, or 3 columns.
+
+        Returns:
+            RResultPtr: Pointer to the histogram.
+        '''
+        if len(columns) not in [1,2,3]:
+            raise ValueError('Can only book histograms of 1, 2, or 3 columns (not %s).'%len(columns))
+        args = [histTuple]+list(columns)+([weight] if weight != None else [])
+        h = getattr(node.DataFrame,'Histo%sD'%len(columns))(*args)
+        self._bookings.append({'kind':'Histo','node':node,'tuple':list(histTuple),'columns':list(columns),
+                               'weight':weight,'group':group,'key':key,'meta':meta,'ptr':h})
+        return h
+
+    def _bookMultiHisto(self,node,histTuple,columns,weights,names,titles,group='',meta=[]):
+        '''Books one histogram per weight column with a single MultiHist action (see MultiHist.h)
+        which finds the bin once per event and fills all of the histograms. The weights are put
+        together in one column first. The booking is recorded so that it is included in SaveGraph().
+
+        @param node (Node): Node to book the histograms on.
+        @param histTuple (tuple): Arguments that would normally be passed to `TH1` (the name and title are replaced by `names` and `titles`).
+        @param columns ([str]): Columns to plot in [x,y,z] order.
+        @param weights ([str]): Weight columns (one per histogram).
+        @param names ([str]): Histogram names (also the keys in the HistGroup).
+        @param titles ([str]): Histogram titles.
+        @param group (str, optional): Name of the HistGroup the histograms are stored in. Defaults to ''.
+        @param meta ([dict], optional): Meta information stored with each histogram in the HistGroup. Defaults to [].
+
+        Raises:
+            ValueError: If there are not 1, 2, or 3 columns.
+
+        Returns:
+            [MultiHistPtr]: Pointers to each histogram.
+        '''
+        if len(columns) not in [1,2,3]:
+            raise ValueError('Can only book histograms of 1, 2, or 3 columns (not %s).'%len(columns))
+        DeclareHeader(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/MultiHist.h')
+        funcName, code = _multiHistBooker(len(columns),[str(node.DataFrame.GetColumnType(c)) for c in columns])
+        CompileCpp(code)
+
+        weightCol = '__weights_'+ContentHash(weights,8)
+        weightNode = node.Define(weightCol,'ROOT::VecOps::RVec<double>{%s}'%(', '.join(['double(%s)'%w for w in weights])),nodetype='Weight',silent=True)
+        model = getattr(ROOT.RDF,'TH%sDModel'%len(columns))(*histTuple)
+        ptr = getattr(ROOT,funcName)(ROOT.RDF.AsRNode(weightNode.DataFrame),model,_stringVector(names),_stringVector(titles),_stringVector(list(columns)+[weightCol]))
+        self._bookings.append({'kind':'MultiHisto','node':node,'tuple':list(histTuple),'columns':list(columns),
+                               'weights':list(weights),'names':list(names),'titles':list(titles),'group':group,'meta':list(meta),'ptr':ptr})
+        return [MultiHistPtr(ptr,i) for i in range(len(names))]
+
+    def SaveGraph(self,filename=None):
+        '''Describe the tracked graph of Nodes so that it can be rebuilt on another
+        analyzer (possibly in another process or over other files) with ReplayGraph().
+        The description includes the action, type, and parent of each Node (plus any untracked Nodes
+        between them like those made for collection structs), the C++ given to CompileCpp() that
+        the Nodes use (see GetCompiledCodeFor()), the Corrections being tracked, and the histograms
+        and snapshots booked with MakeHistsWithBinning(), MakeTemplateHistos(), and Snapshot().
+        Paths inside TIMBERPATH are stored relative to it so the description can be replayed with
+        another installation.
+
+        Histograms booked directly on the RDataFrame (ex. `a.DataFrame.Histo1D()`) are not included.
+
+        @param filename (str, optional): JSON file to write the description to. Defaults to None and nothing is written.
+
+        Raises:
+            ValueError: If a Node cannot be described because it was not made from its parent with Define, Filter, or Range.
+
+        Returns:
+            dict: Description of the graph.
+        '''
+        # Order nodes so parents always come before their children
+        nodes, index = [], {}
+        for n in self.AllNodes+[self.ActiveNode]+[b['node'] for b in self._bookings]:
+            chain = []
+            while n != None and n.hash not in index:
+                chain.insert(0,n)
+                n = n.parent
+            for c in chain:
+                if c.parent == None and c is not self.BaseNode:
+                    raise ValueError('Node %s has no parent and is not the base Node so it cannot be described.'%c.name)
+                index[c.hash] = len(nodes)
+                nodes.append(c)
+
+        tracked = self._getTrackedNodeHashes()
+        graph = OrderedDict()
+        graph['eventsTreeName'] = self._eventsTreeName
+        graph['runTreeName'] = self._runTreeName
+        graph['cpp'] = GetCompiledCodeFor([n.action for n in nodes if n.op in ['Define','Filter']])
+        graph['corrections'] = []
+        for name in self.Corrections:
+            c = self.Corrections[name]
+            desc = {'name':name,'class':c.__class__.__name__,'corrtype':c.GetType(),'existing':c.existing}
+            if not c.existing:
+                desc.update({'script':_portablePath(c._script),'constructor':c._constructor,
+                             'mainFunc':c._mainFunc.split('::')[-1],'objectName':c._objectName})
+            graph['corrections'].append(desc)
+        graph['nodes'] = []
+        for n in nodes:
+            graph['nodes'].append({'name':n.name,'type':n.type,'action':n.action,'op':n.op,'opArgs':n.opArgs,
+                                   'parent':None if n.parent == None else index[n.parent.hash],
+                                   'tracked':n.hash in tracked})
+        graph['active'] = index[self.ActiveNode.hash]
+        graph['bookings'] = []
+        for b in self._bookings:
+            desc = dict([(k,v) for k,v in b.items() if k not in ['ptr','cutflow']])
+            desc['node'] = index[b['node'].hash]
+            graph['bookings'].append(desc)
+
+        if filename != None:
+            WriteJSON(graph,filename)
+        return graph
+
+    def ReplayGraph(self,graph,bookSnapshots=True):
+        '''Rebuild a graph described by SaveGraph() on top of the #BaseNode of this analyzer.
+        The C++ is compiled again (repeated code is skipped by CompileCpp()), the Corrections
+        are recreated and tracked, the Nodes are recreated (and tracked if they were before),
+        and the histograms and snapshots are booked again. The #ActiveNode is set to the
+        Node that was active when the graph was saved.
+
+        @param graph (dict, str): Description from SaveGraph() or the JSON file it was saved to.
+        @param bookSnapshots (bool, optional): Book the snapshots (lazily). If False, the snapshots are
+            only returned so that the caller can decide where to write them. Defaults to True.
+
+        Raises:
+            ValueError: If an unknown operation is found in the description.
+
+        Returns:
+            OrderedDict: The booked histograms as HistGroups keyed by their group name, the Cutflows and CutflowTrees keyed by their name, and the snapshots
+                as dicts (with keys "node", "columns", "outfilename", "treename", and "openOption") keyed by their output file name.
+        '''
+        if isinstance(graph,str):
+            graph = OpenJSON(graph)
+
+        for c in graph['cpp']:
+            if 'library' in c: CompileCpp(_localPath(str(c['library'])),library=True)
+            else: CompileCpp(str(c['code']))
+
+        for desc in graph['corrections']:
+            CorrClass = Calibration if desc['class'] == 'Calibration' else Correction
+            if desc['existing']:
+                corr = Correction(str(desc['name']),corrtype=str(desc['corrtype']))
+            elif desc['objectName'] != desc['name']: # clone of another object
+                base = CorrClass(str(desc['objectName']),_localPath(str(desc['script'])),_strArgs(desc['constructor']),str(desc['mainFunc']),corrtype=str(desc['corrtype']))
+                corr = base.Clone(str(desc['name']),str(desc['mainFunc']),str(desc['corrtype']))
+            else:
+                corr = CorrClass(str(desc['name']),_localPath(str(desc['script'])),_strArgs(desc['constructor']),str(desc['mainFunc']),corrtype=str(desc['corrtype']))
+            self.Corrections[corr.name] = corr
+
+        nodes = []
+        for desc in graph['nodes']:
+            if desc['parent'] == None:
+                nodes.append(self.BaseNode)
+                continue
+            parent = nodes[desc['parent']]
+            args = _strArgs(desc['opArgs'])
+            if desc['op'] == 'Define':
+                node = parent.Define(args[0],args[1],nodetype=str(desc['type']),silent=True)
+                if desc['tracked']: self._collectionOrg.AddBranch(args[0],_columnTypeFunc(node,args[0]))
+            elif desc['op'] == 'Filter':
+                node = parent.Cut(args[1],args[0],nodetype=str(desc['type']),silent=True)
+            elif desc['op'] == 'Range':
+                node = parent.Range(*args)
+            else:
+                raise ValueError('Unknown operation %s for node %s'%(desc['op'],desc['name']))
+            node.name = str(desc['name'])
+            node.type = str(desc['type'])
+            if desc['tracked']: self.TrackNode(node)
+            nodes.append(node)
+        self.SetActiveNode(nodes[graph['active']])
+
+        out = OrderedDict()
+        for b in graph['bookings']:
+            node = nodes[b['node']]
+            if b['kind'] == 'Histo':
+                group = str(b['group'])
+                if group not in out:
+                    out[group] = HistGroup(group)
+                    out[group].loops = self.Loops
+                h = self._bookHisto(node,tuple(_strArgs(b['tuple'])),
+                                    _strArgs(b['columns']),_strArgs([b['weight']])[0],
+                                    group,str(b['key']),b['meta'])
+                out[group].Add(str(b['key']),h,b['meta'])
+            elif b['kind'] == 'MultiHisto':
+                group = str(b['group'])
+                if group not in out:
+                    out[group] = HistGroup(group)
+                    out[group].loops = self.Loops
+                hists = self._bookMultiHisto(node,tuple(_strArgs(b['tuple'])),_strArgs(b['columns']),_strArgs(b['weights']),
+                                             _strArgs(b['names']),_strArgs(b['titles']),group,b['meta'])
+                for name,h,meta in zip(_strArgs(b['names']),hists,b['meta']):
+                    out[group].Add(name,h,meta)
+            elif b['kind'] == 'Snapshot':
+                snap = {'node':node,'columns':b['columns'],'outfilename':str(b['outfilename']),
+                        'treename':str(b['treename']),'openOption':str(b['openOption'])}
+                if bookSnapshots:
+                    ptr = node.Snapshot(snap['columns'],snap['outfilename'],snap['treename'],True,snap['openOption'])
+                    self._bookings.append(dict(snap,kind='Snapshot',ptr=ptr))
+                out[snap['outfilename']] = snap
+            elif b['kind'] == 'Cutflow':
+                out[str(b['name'])] = self.BookCutflow(_strArgs([b['weight']])[0],node,str(b['name']))
+            elif b['kind'] == 'CutflowTree':
+                out[str(b['name'])] = self.BookCutflowTree(_strArgs([b['weight']])[0],name=str(b['name']))
+        return out
+
+def RunAll(analyzers,results=[]):
+    '''Run the event loops of several analyzers at once. All histograms and snapshots
+    booked (lazily) with MakeHistsWithBinning(), MakeTemplateHistos(), BookCutflow(), BookCutflowTree(), and Snapshot() on each
+    analyzer (plus any extra `results`) are filled in one scheduling pass using
+    [ROOT.RDF.RunGraphs](https://root.cern/doc/master/namespaceROOT_1_1RDF.html) (ROOT >= 6.24)
+    which runs the loops concurrently when `ROOT.EnableImplicitMT()` is on.
+    With older ROOT versions, the loops are run one after the other.
+    Accessing the results afterwards (ex. through a HistGroup) does not run the loops again.
+
+    The time of each analyzer is measured from the start of the loops to its first event (which includes
+    the just-in-time compilation of its graph) and to its last event (see LoopMonitor) and is reported
+    along with the number of events processed per second. Without `ROOT.RDF.AsRNode` (ROOT < 6.22),
+    only the total time is known.
+
+    @param analyzers ([analyzer]): Analyzers to run.
+    @param results ([RResultPtr], optional): Extra lazy results (ex. from `a.DataFrame.Count()`) to fill in the same pass. Defaults to [].
+
+    Returns:
+        list(dict): For each analyzer, a dictionary with keys "nEvents", "first" and "time" (seconds from the start
+            of the loops to the first and last event), and "rate" (events per second over "time").
+    '''
+    start = time.time()
+    ptrs = list(results)
+    for a in analyzers:
+        ptrs.extend([b['ptr'] for b in a._bookings if b['ptr'] is not None and not b['ptr'].IsReady()])
+        for b in a._bookings:
+            if 'cutflow' in b: ptrs.extend(b['cutflow'].GetPointers())
+
+    # The loop monitors book a LoopClock on each dataset which times its loop (and makes sure it runs)
+    tokens = [a.Loops.Start('RunAll') for a in analyzers]
+    counts = []
+    for a,token in zip(analyzers,tokens):
+        counts.append(a.BaseNode.DataFrame.Count() if token['clock'] == None else None)
+        ptrs.append(token['clock'] if token['clock'] != None else counts[-1])
+    if hasattr(ROOT.RDF,'RunGraphs'):
+        ROOT.RDF.RunGraphs(ptrs)
+    else:
+        for ptr in ptrs:
+            ptr.GetValue()
+    for a,token in zip(analyzers,tokens):
+        a.Loops.Stop(token)
+
+    report = []
+    print ('Ran %s analyzers in %.2f s'%(len(analyzers),time.time()-start))
+    print ('{:>10s} {:>10s} {:>12s} {:>14s}  {}'.format('first [s]','last [s]','nEvents','events/s','analyzer'))
+    for a,count in zip(analyzers,counts):
+        loop = a.Loops.loops[-1]
+        if count == None:
+            nEvents, first, elapsed = loop['nEvents'], loop['first'], loop['last']
+        else:
+            nEvents, first, elapsed = int(count.GetValue()), None, loop['time']
+        rate = nEvents/elapsed if elapsed > 0 else 0.0
+        report.append({'nEvents':nEvents,'first':first,'time':elapsed,'rate':rate})
+        print ('{:>10s} {:>10.2f} {:>12d} {:>14.1f}  {}'.format('%.2f'%first if first != None else '?',elapsed,nEvents,rate,a.fileName))
+    return report
+
 ##############
 # Node Class #
 ##############
@@ -1344,7 +2483,7 @@ class Node(object):
     '''Class to represent nodes in the DataFrame processing graph. 
     Can make new nodes via Define, Cut, and Discriminate and setup
     relations between nodes (done automatically via Define, Cut, Discriminate)'''
-    def __init__(self, name, DataFrame, action='', nodetype='', children=[], parent=None):
+    def __init__(self, name, DataFrame, action='', nodetype='', children=[], parent=None, op='', opArgs=[]):
         '''Constructor. Holds the RDataFrame and other associated information
         for tracking in the {@link analyzer}.
 
@@ -1357,6 +2496,9 @@ class Node(object):
         @param parent (Node, optional): Parent node if it exists. Defaults to None.
         @param nodetype (str, optional): The type of the Node. Useful for organizing and grouping Nodes. Defaults to ''.
         @param action (str, optional): Action performed (the C++ line). Default is '' but should only be used for a base RDataFrame.
+        @param op (str, optional): RDataFrame operation used to create the Node from its parent ("Define", "Filter", or "Range").
+            Default is '' but should only be used for a base RDataFrame.
+        @param opArgs (list, optional): Arguments given to the RDataFrame operation. Defaults to [].
         '''
         ## @var DataFrame
         # ROOT.RDataFrame
@@ -1382,17 +2524,51 @@ class Node(object):
         # "Define", "Cut", "MergeDefine", "SubCollDefine", or "Correction".
         ## @var hash
         # str
-        # Unique hash to identify the node.
+        # Hash to identify the node. Derived from the parent hash, operation, name, type, and action
+        # so that identical Nodes made from the same parent share the hash (random for a Node without a parent).
+        ## @var op
+        # str
+        # RDataFrame operation ("Define", "Filter", or "Range") used to create the Node from its parent.
+        ## @var opArgs
+        # list
+        # Arguments given to the RDataFrame operation (ex. `[column name, C++ expression]` for "Define").
+        ## @var loops
+        # LoopMonitor
+        # Monitor of the event loops over the dataset. Only set for the base Node (None otherwise).
+        ## @var jit
+        # JitBatch
+        # Compiles the C++ of new Define and Cut Nodes and records how long it takes. Shared with the parent Node.
 
         super(Node, self).__init__()
+        self._df = None
         self.DataFrame = DataFrame
         self.name = name
         self.action = action
         self.children = children
         self.parent = parent
         self.type = nodetype
-        self.hash = GenerateHash()
-        
+        self.hash = GenerateHash() if parent == None else _nodeHash(parent,op,name,nodetype,action)
+        self.op = op
+        self.opArgs = list(opArgs)
+        self.loops = None
+        self.jit = parent.jit if parent != None else None
+
+    @property
+    def DataFrame(self):
+        '''RDataFrame of the Node. If the Node is waiting on its C++ to be compiled
+        in a batch (see JitBatch), the batch is compiled first.
+
+        Returns:
+            RNode: RDataFrame of the Node.
+        '''
+        if self._df is None and self.jit != None:
+            self.jit.Flush()
+        return self._df
+
+    @DataFrame.setter
+    def DataFrame(self,df):
+        self._df = df
+
     def Close(self):
         '''Safely deletes Node instance and all descendants.
         
@@ -1433,6 +2609,23 @@ class Node(object):
         if name == '':return Node(self.name,self.DataFrame,children=[],action=self.action)
         else: return Node(name,self.DataFrame,children=[],action=self.action)
 
+    def _getChild(self,name,op,nodetype,action):
+        '''Get the child that would be made by an operation if it already exists.
+
+        @param name (str): Name of the new Node.
+        @param op (str): RDataFrame operation.
+        @param nodetype (str): Type of the new Node.
+        @param action (str): Action performed (the C++ line).
+
+        Returns:
+            Node: Existing child or None.
+        '''
+        h = _nodeHash(self,op,name,nodetype,action)
+        for c in self.children:
+            if c.hash == h:
+                return c
+        return None
+
     def SetChild(self,child,overwrite=False):
         '''Set one of child for the node.
 
@@ -1493,7 +2686,15 @@ class Node(object):
         '''
         if not silent: print('Defining %s: %s' %(name,var))
         newNodeType = 'Define' if nodetype == None else nodetype
-        newNode = Node(name,self.DataFrame.Define(name,var),children=[],parent=self,action=var,nodetype=newNodeType)
+        existing = self._getChild(name,'Define',newNodeType,var)
+        if existing != None: return existing
+        DeclareHeadersFor(var)
+        if self.jit != None and self.jit.batch:
+            newNode = self.jit.Add(Node(name,None,children=[],parent=self,action=var,nodetype=newNodeType,op='Define',opArgs=[name,var]))
+        else:
+            start = time.time()
+            newNode = Node(name,self.DataFrame.Define(name,var),children=[],parent=self,action=var,nodetype=newNodeType,op='Define',opArgs=[name,var])
+            if self.jit != None: self.jit.Record(newNodeType,time.time()-start)
         self.SetChild(newNode)
         return newNode
 
@@ -1510,8 +2711,16 @@ class Node(object):
             Node: New Node object with cut applied.
         '''
         if not silent: print('Filtering %s: %s' %(name,cut))
-        newNodeType = 'Define' if nodetype == None else nodetype
-        newNode = Node(name,self.DataFrame.Filter(cut,name),children=[],parent=self,action=cut,nodetype=newNodeType)
+        newNodeType = 'Cut' if nodetype == None else nodetype
+        existing = self._getChild(name,'Filter',newNodeType,cut)
+        if existing != None: return existing
+        DeclareHeadersFor(cut)
+        if self.jit != None and self.jit.batch:
+            newNode = self.jit.Add(Node(name,None,children=[],parent=self,action=cut,nodetype=newNodeType,op='Filter',opArgs=[cut,name]))
+        else:
+            start = time.time()
+            newNode = Node(name,self.DataFrame.Filter(cut,name),children=[],parent=self,action=cut,nodetype=newNodeType,op='Filter',opArgs=[cut,name])
+            if self.jit != None: self.jit.Record(newNodeType,time.time()-start)
         self.SetChild(newNode)
         return newNode
 
@@ -1524,10 +2733,18 @@ class Node(object):
         Returns:
             dict: Dictionary with keys "pass" and "fail" corresponding to the passing and failing Nodes stored as values.
         '''
+        existing = {'pass':self._getChild(name+"_pass",'Filter','Cut',discriminator),
+                    'fail':self._getChild(name+"_fail",'Filter','Cut',"!("+discriminator+")")}
+        if existing['pass'] != None and existing['fail'] != None: return existing
+        DeclareHeadersFor(discriminator)
+        start = time.time()
         passfail = {
-            "pass":Node(name+"_pass",self.DataFrame.Filter(discriminator,name+"_pass"),children=[],parent=self,action=discriminator,nodetype='Cut'),
-            "fail":Node(name+"_fail",self.DataFrame.Filter("!("+discriminator+")",name+"_fail"),children=[],parent=self,action="!("+discriminator+")",nodetype='Cut')
+            "pass":Node(name+"_pass",self.DataFrame.Filter(discriminator,name+"_pass"),children=[],parent=self,action=discriminator,nodetype='Cut',
+                        op='Filter',opArgs=[discriminator,name+"_pass"]),
+            "fail":Node(name+"_fail",self.DataFrame.Filter("!("+discriminator+")",name+"_fail"),children=[],parent=self,action="!("+discriminator+")",nodetype='Cut',
+                        op='Filter',opArgs=["!("+discriminator+")",name+"_fail"])
         }
+        if self.jit != None: self.jit.Record('Cut',time.time()-start,2)
         self.SetChildren(passfail)
         return passfail
             
@@ -1568,8 +2785,13 @@ class Node(object):
             Node: New node with specified range of entries selected.
         '''
         action_name = 'Range(%s)'%(', '.join([str(a) for a in argv]))
-        return Node(self.name+'_range', self.DataFrame.Range(*argv),
-                    action=action_name, nodetype='range', children=[], parent=self)
+        existing = self._getChild(self.name+'_range','Range','range',action_name)
+        if existing != None: return existing
+        newNode = Node(self.name+'_range', self.DataFrame.Range(*argv),
+                    action=action_name, nodetype='range', children=[], parent=self,
+                    op='Range', opArgs=list(argv))
+        self.children.append(newNode) # not SetChild() since several ranges of one Node share the name
+        return newNode
 
     def Snapshot(self,columns,outfilename,treename,lazy=False,openOption='RECREATE'): # columns can be a list or a regular expression or 'all'
         '''Takes a snapshot of the RDataFrame corresponding to this Node.
@@ -1578,7 +2800,8 @@ class Node(object):
         IMPORTANT: When writing a variable size array through Snapshot, it is required
         that the column indicating its size is also written out and it appears before
         the array in the columns list. The `columns` argument should be `"all"` if you'd like
-        to keep everything.
+        to keep everything. Internal columns (starting with "__", ex. the sliced structs of
+        SubCollections) are not included in "all".
 
         @param columns ([str] or str): List of columns to keep (str) with regex matching.
                 Provide single string 'all' to include all columns.
@@ -1588,7 +2811,7 @@ class Node(object):
         @param openOption (str, optional): TFile opening options. Defaults to 'RECREATE'.
 
         Returns:
-            None
+            RResultPtr: Pointer to the snapshot result (already run if not lazy).
         '''
         opts = ROOT.RDF.RSnapshotOptions()
         opts.fLazy = lazy
@@ -1598,16 +2821,20 @@ class Node(object):
         print("Snapshotting columns: %s"%columns)
         print("Saving tree %s to file %s"%(treename,outfilename))
         if columns == 'all':
-            self.DataFrame.Snapshot(treename,outfilename,'',opts)
+            column_vec = '^(?!__).*$'
         elif type(columns) == str:
-            self.DataFrame.Snapshot(treename,outfilename,columns,opts)
+            column_vec = columns
         else:
             column_vec = ''
             for c in columns:
                 if c == '': continue
                 column_vec += c+'|'
             column_vec = column_vec[:-1]
-            self.DataFrame.Snapshot(treename,outfilename,column_vec,opts)
+
+        if lazy:
+            return self.DataFrame.Snapshot(treename,outfilename,column_vec,opts)
+        with WatchLoops(self.GetBaseNode().loops,'Snapshot'):
+            return self.DataFrame.Snapshot(treename,outfilename,column_vec,opts)
 
     def GetBaseNode(self):
         '''Returns the top-most parent Node by climbing node tree until a Node with no parent is reached.
@@ -1623,6 +2850,169 @@ class Node(object):
 ##############################
 # Group class and subclasses #
 ##############################
+class JitBatch(object):
+    '''Compiles the C++ strings of new Define and Cut Nodes and records how long
+    that takes for each type of Node (ex. "Define", "Cut", "SubCollDefine", "Correction").
+    This is the time spent when the Nodes are booked. RDataFrame compiles the rest of the
+    graph when the event loop starts, which is timed by the LoopMonitor.
+
+    Without batching, each string is given to RDataFrame when the Node is made and
+    RDataFrame just-in-time compiles it right away. With batching, new Nodes wait until
+    the RDataFrame of one of them is needed (ex. to book a histogram, check a column type,
+    or run the event loop). Then the string of every waiting Node is wrapped in a C++ function
+    which takes the columns it uses as arguments (typed from the column types or,
+    for columns defined in the same batch, from the return type of the function defining them)
+    and all of the functions are compiled at once. RDataFrame is only given the calls to these functions.
+    If the batch fails to compile, the Nodes are made from their original strings so that RDataFrame
+    reports the error for the string at fault.
+
+    The time to compile a batch is shared between the types of Node according to
+    the amount of code each contributed.
+    '''
+    _specialColumns = {'rdfentry_':'ULong64_t','rdfslot_':'unsigned int','tdfentry_':'ULong64_t','tdfslot_':'unsigned int'}
+
+    def __init__(self,batch=False):
+        '''Constructor
+
+        @param batch (bool, optional): Compile the C++ of new Nodes in batches. Defaults to False.
+        '''
+        ## @var batch
+        # bool
+        # Compile the C++ of new Nodes in batches.
+        ## @var times
+        # OrderedDict
+        # Number of Nodes ("n") and compilation time in seconds ("time") per type of Node.
+        ## @var batches
+        # list(dict)
+        # Number of Nodes ("n") and functions ("functions") and compilation time ("time") of each batch.
+        self.batch = batch
+        self.times = OrderedDict()
+        self.batches = []
+        self._pending = []
+        self._declared = set()
+
+    def Record(self,nodetype,seconds,n=1):
+        '''Add compilation time for a type of Node.
+
+        @param nodetype (str): Type of the Node(s).
+        @param seconds (float): Time in seconds.
+        @param n (int, optional): Number of Nodes made. Defaults to 1.
+        '''
+        if nodetype not in self.times:
+            self.times[nodetype] = {'n':0,'time':0.0}
+        self.times[nodetype]['n'] += n
+        self.times[nodetype]['time'] += seconds
+
+    def Add(self,node):
+        '''Hold a new Define or Cut Node (with no RDataFrame yet) until the next Flush().
+
+        @param node (Node): New Node.
+
+        Returns:
+            Node: Same Node.
+        '''
+        self._pending.append(node)
+        return node
+
+    def Flush(self):
+        '''Compile the C++ of all waiting Nodes at once and make their RDataFrames.'''
+        pending, self._pending = self._pending, []
+        if len(pending) == 0: return
+
+        functions, calls, scopes = OrderedDict(), [], {}
+        for node in pending:
+            scope = self._scope(node.parent,scopes)
+            expr = node.opArgs[1] if node.op == 'Define' else node.opArgs[0]
+            args = self._usedColumns(expr,scope)
+            types = [self._columnType(scope,a) for a in args]
+            fname = '__timber_jit_'+ContentHash([expr]+types)
+            if fname not in self._declared and fname not in functions:
+                body = expr+';' if 'return' in re.findall(r'\w+',expr) else 'return %s;'%expr
+                functions[fname] = (node.type,'auto %s(%s) {\n    %s\n}\n'%(fname,', '.join(['%s& %s'%(t,a) for t,a in zip(types,args)]),body))
+            calls.append('%s(%s)'%(fname,','.join(args)))
+            if node.op == 'Define':
+                scope = (scope[0],scope[1],dict(scope[2]))
+                scope[2][node.opArgs[0]] = 'decltype(%s(%s))'%(fname,', '.join(['std::declval<%s&>()'%t for t in types]))
+            scopes[node.hash] = scope
+
+        start = time.time()
+        compiled = CompileCpp(''.join([f[1] for f in functions.values()])) if len(functions) > 0 else True
+        seconds = time.time()-start
+        if compiled:
+            self._declared.update(functions.keys())
+            nChars = sum([len(f[1]) for f in functions.values()])
+            for nodetype, code in functions.values():
+                self.Record(nodetype,seconds*len(code)/nChars,0)
+        else:
+            print ('WARNING: Failed to compile a batch of %s Node(s). Making them one at a time.'%len(pending))
+            calls = [n.opArgs[1] if n.op == 'Define' else n.opArgs[0] for n in pending]
+        self.batches.append({'n':len(pending),'functions':len(functions),'time':seconds})
+
+        for node,call in zip(pending,calls):
+            start = time.time()
+            if node.op == 'Define':
+                node.DataFrame = node.parent.DataFrame.Define(node.opArgs[0],call)
+            else:
+                node.DataFrame = node.parent.DataFrame.Filter(call,node.opArgs[1])
+            self.Record(node.type,time.time()-start)
+
+    def _scope(self,node,scopes):
+        '''Columns available on a Node as a tuple of its RDataFrame (or that of the
+        first ancestor which has one), the names of the columns of that RDataFrame, and the
+        types of the columns defined by the waiting Nodes in between.
+
+        @param node (Node): Node.
+        @param scopes (dict): Scopes of the waiting Nodes already seen, by hash.
+
+        Returns:
+            tuple(RNode,set(str),dict)
+        '''
+        if node.hash not in scopes:
+            scopes[node.hash] = (node.DataFrame,set([str(c) for c in node.DataFrame.GetColumnNames()]),{})
+        return scopes[node.hash]
+
+    def _usedColumns(self,expr,scope):
+        '''Find the columns used in a C++ string (in order of first use). Members
+        (`.x`, `->x`) and names in a namespace or class (`::x`) and string literals are ignored.
+
+        @param expr (str): C++ string.
+        @param scope (tuple): Columns available (see _scope()).
+
+        Returns:
+            list(str): Column names.
+        '''
+        code = re.sub(r'"(?:\\.|[^"\\])*"','""',expr)
+        used = []
+        for token in re.findall(r'(?<![\w.])(?<!->)(?<!::)[A-Za-z_]\w*',code):
+            if token in used: continue
+            if token in scope[2] or token in scope[1] or token in self._specialColumns:
+                used.append(token)
+        return used
+
+    def _columnType(self,scope,column):
+        '''C++ type of a column.
+
+        @param scope (tuple): Columns available (see _scope()).
+        @param column (str): Column name.
+
+        Returns:
+            str: Type (or a `decltype()` of the function defining it).
+        '''
+        if column in scope[2]: return scope[2][column]
+        if column in self._specialColumns and column not in scope[1]: return self._specialColumns[column]
+        return str(scope[0].GetColumnType(column))
+
+    def Report(self):
+        '''Print the number of Nodes and the compilation time for each type of Node.
+
+        Returns:
+            None
+        '''
+        print ('JIT compilation when booking %s Node(s)%s'%(sum([t['n'] for t in self.times.values()]),
+                ' in %s batch(es) taking %.2f s'%(len(self.batches),sum([b['time'] for b in self.batches])) if len(self.batches) > 0 else ''))
+        for nodetype in self.times:
+            print ('{:>16s} {:>6d} {:>10s}'.format(nodetype,self.times[nodetype]['n'],'%.2f s'%self.times[nodetype]['time']))
+
 class Group(object):
     '''Organizes objects in OrderedDict with basic functionality to add and
     drop items, add Groups together, get keys, and access items.'''
@@ -1811,6 +3201,10 @@ class HistGroup(Group):
         # str
         # Set to 'hist' so group is treated as histograms.
         self.type = 'hist'
+        ## @var loops
+        # LoopMonitor
+        # Monitor of the event loops of the analyzer that booked the histograms (can be None).
+        self.loops = None
         self._ptrs = {}
 
     def Do(self,THmethod,argsTuple=()):
@@ -1827,6 +3221,8 @@ class HistGroup(Group):
                 myHistGroup.Do("Scale",(0.5))
 
         '''
+        # Fill all of the histograms at once
+        self.Materialize()
         # Book new group in case THmethod returns something
         newGroup = HistGroup(self.name+'_%s%s'%(THmethod,argsTuple))
         # Initialize check for None return type
@@ -1834,12 +3230,13 @@ class HistGroup(Group):
         # Loop over hists
         for name,hist in self.items.items():
             # Handle lazy axis naming
-            if 'xtitle' in self.item_meta.keys():
-                hist.GetXaxis().SetTitle(self.item_meta['xtitle'])
-            if 'ytitle' in self.item_meta.keys():
-                hist.GetYaxis().SetTitle(self.item_meta['ytitle'])
-            if 'ztitle' in self.item_meta.keys():
-                hist.GetZaxis().SetTitle(self.item_meta['ztitle'])
+            meta = self.item_meta[name] if name in self.item_meta else {}
+            if 'xtitle' in meta.keys():
+                hist.GetXaxis().SetTitle(meta['xtitle'])
+            if 'ytitle' in meta.keys():
+                hist.GetYaxis().SetTitle(meta['ytitle'])
+            if 'ztitle' in meta.keys():
+                hist.GetZaxis().SetTitle(meta['ztitle'])
             
             out = getattr(hist,THmethod)(*argsTuple)
             
@@ -1858,6 +3255,7 @@ class HistGroup(Group):
         Returns:
             TH1: Merged histogram.
         '''
+        self.Materialize()
         for ikey,key in enumerate(self.keys()):
             if ikey == 0:
                 out = self[key].Clone(self.name)
@@ -1894,9 +3292,117 @@ class HistGroup(Group):
         '''
         if lazy == False and not isinstance(self.items[key],ROOT.TH1):
             self._ptrs[key] = self.items[key]
-            self.items[key] = self._ptrs[key].GetValue()
+            with WatchLoops(self.loops,'HistGroup[%s]'%key,[self._ptrs[key]]):
+                self.items[key] = self._ptrs[key].GetValue()
         return self.items[key]
 
+    def Materialize(self):
+        '''Turn all of the histogram pointers in the group into histograms at once
+        so that the histograms booked on the same analyzer are filled in one event loop.
+        Called automatically by Do() and Merge(). See MaterializeGroups() to do the same
+        for several groups (possibly from different analyzers) together.
+
+        Returns:
+            dict: Timing statistics (see MaterializeGroups()).
+        '''
+        return MaterializeGroups([self])
+
+class MultiHistPtr(object):
+    '''Pointer to one of the histograms filled by a MultiHist action (see analyzer.MakeTemplateHistos())
+    which can be used like the RResultPtr of a single histogram (ex. in a HistGroup).'''
+    def __init__(self,result,index):
+        '''Constructor
+
+        @param result (RResultPtr): Pointer to the vector of histograms.
+        @param index (int): Index of the histogram in the vector.
+        '''
+        ## @var result
+        # RResultPtr
+        #
+        # Pointer to the vector of histograms filled by the action (shared by all of its histograms).
+        ## @var index
+        # int
+        #
+        # Index of the histogram in the vector.
+        self.result = result
+        self.index = index
+
+    def IsReady(self):
+        '''Whether the event loop filling the histograms has already run.
+
+        Returns:
+            bool
+        '''
+        return self.result.IsReady()
+
+    def GetValue(self):
+        '''Get the histogram (runs the event loop if needed). It is owned by #result
+        so keep this object around as long as the histogram is used.
+
+        Returns:
+            TH1: Histogram.
+        '''
+        return self.result.GetValue()[self.index]
+
+def _resultPtrs(ptrs):
+    '''Replace MultiHistPtrs by the RResultPtrs they point to (without duplicates)
+    so that the list can be given to ROOT.RDF.RunGraphs.
+
+    @param ptrs (list): RResultPtrs and MultiHistPtrs.
+
+    Returns:
+        list(RResultPtr)
+    '''
+    out = []
+    for p in ptrs:
+        if isinstance(p,MultiHistPtr): p = p.result
+        if not any([p is o for o in out]): out.append(p)
+    return out
+
+def MaterializeGroups(groups):
+    '''Turn all of the histogram pointers in a list of HistGroups into histograms
+    in one pass. Histograms booked on the same analyzer are filled in a single event loop
+    and those from different analyzers are run together with
+    [ROOT.RDF.RunGraphs](https://root.cern/doc/master/namespaceROOT_1_1RDF.html) (ROOT >= 6.24).
+    With older ROOT versions, the loops of different analyzers are run one after the other.
+
+    @param groups ([HistGroup]): Groups to materialize.
+
+    Returns:
+        dict: Timing statistics with keys "nHists" (number of histograms that were pointers),
+            "nLoops" (number of event loops run, None if not known), and "time" (seconds).
+    '''
+    start = time.time()
+    pending = []
+    for g in groups:
+        for key,item in g.items.items():
+            if not isinstance(item,ROOT.TH1):
+                pending.append((g,key,item))
+
+    # One token per distinct loop monitor so that each analyzer's loop is accounted for
+    monitors = []
+    for g,key,ptr in pending:
+        if g.loops != None and g.loops not in monitors:
+            monitors.append(g.loops)
+    tokens = [m.Start('MaterializeGroups',[ptr for g,key,ptr in pending if g.loops is m]) for m in monitors]
+    nBefore = sum([len(m.loops) for m in monitors])
+
+    ptrs = _resultPtrs([ptr for g,key,ptr in pending if not ptr.IsReady()])
+    if len(ptrs) > 0:
+        if hasattr(ROOT.RDF,'RunGraphs'):
+            ROOT.RDF.RunGraphs(ptrs)
+        else:
+            for ptr in ptrs:
+                ptr.GetValue()
+    for g,key,ptr in pending:
+        g._ptrs[key] = ptr
+        g.items[key] = ptr.GetValue()
+
+    for m,token in zip(monitors,tokens):
+        m.Stop(token)
+    nLoops = sum([len(m.loops) for m in monitors])-nBefore if len(monitors) > 0 else None
+    return {'nHists':len(pending),'nLoops':nLoops,'time':time.time()-start}
+
 ###########################
 # Module handling classes #
 ###########################
@@ -1990,6 +3496,36 @@ class ModuleWorker(object):
         return outname
 
     def _getFuncInfo(self,funcname):
+        '''Gets the function information including name, namespace, and argument names (see _parseFuncInfo()).
+        The result is cached on disk (see GetCacheDir()) keyed by a hash of the contents of the script
+        and the local headers it includes, the clang arguments, and the function name
+        so that clang only parses the script again if one of these changes.
+
+        @param funcname (str): C++ class method name to search for in script.
+
+        Returns:
+            OrderedDict: Dictionary organized as `myreturn[methodname][argname] = argtype`.
+        '''
+        cachefile = GetCacheDir('funcinfo')+ContentHash([self._script,funcname,' '.join(cpp_args)]+ReadSourceFiles(self._script))+'.json'
+        if os.path.exists(cachefile):
+            try:
+                cached = OpenJSON(cachefile)
+                funcs = OrderedDict()
+                for methodname,args in cached['funcs']:
+                    funcs[str(methodname)] = OrderedDict([(str(a), None if d == None else str(d)) for a,d in args])
+                self._script = str(cached['script'])
+                return funcs
+            except (IOError, ValueError, KeyError):
+                pass
+
+        funcs = self._parseFuncInfo(funcname)
+        try:
+            WriteJSON({'script':self._script,'funcs':[[m,list(funcs[m].items())] for m in funcs]},cachefile)
+        except (IOError, OSError):
+            pass
+        return funcs
+
+    def _parseFuncInfo(self,funcname):
         '''Parses script with clang to get the function information including name, namespace, and argument names.
 
         @param funcname (str): C++ class method name to search for in script.
@@ -2054,7 +3590,7 @@ class ModuleWorker(object):
         if len(list(funcs.keys())) == 0:
             if ('TIMBER/Framework/src' in self._script):
                 self._script = self._script.replace('TIMBER/Framework/src','TIMBER/Framework/include').replace('.cc','.h')
-                funcs = self._getFuncInfo(funcname)
+                funcs = self._parseFuncInfo(funcname)
             else:
                 raise ValueError('Could not find `%s` in file %s'%(funcname,self._script))
 
@@ -2095,7 +3631,7 @@ class ModuleWorker(object):
             line = line[:-1] + ';'
 
         print ('Instantiating... '+line)
-        ROOT.gInterpreter.Declare(line)
+        CompileCpp(line)
 
     def MakeCall(self,inArgs = {},toCheck=None):
         '''Makes the call (stored in class instance) to the method with the branch/column names deduced or added from input.
@@ -2328,4 +3864,4 @@ class Calibration(Correction):
                 not duplicate compile the same script if two functions are needed in one C++ script.
         '''
 
-        super(Calibration,self).__init__(name,script,constructor,mainFunc,columnList,isClone)
+        super(Calibration,self).__init__(name,script,constructor,mainFunc,corrtype=corrtype,columnList=columnList,isClone=isClone)
@@ -1,4 +1,4 @@
-from TIMBER.Tools.Common import CompileCpp
+from TIMBER.Tools.Common import CompileCpp, ContentHash, DeclareHeadersFor, GetCompiledSources, HeaderReport, ReadSourceFiles
 import re
 
 class CollectionOrganizer:
@@ -7,15 +7,28 @@ class CollectionOrganizer:
     on startup and any new branch will be added accordingly. Collection names
     are deduced from the branch name by being the string before the first underscore
     (if there is an underscore).
+
+    The C++ structs of the collections hold (references to) all of the attributes unless
+    #pruneAttributes is set to True in which case they only hold the ones used by the
+    code known when they are built (see BuildCppCollection()).
     '''
     def __init__(self, rdf):
         '''Constructor
 
         @param rdf (RDataFrame): RDataFrame from which to organize.
         '''
+        ## @var pruneAttributes
+        # bool
+        #
+        # Only include the attributes that are used in the collection structs. Defaults to False since
+        # C++ compiled after a struct is built (ex. a Correction or a header that is only declared later)
+        # cannot use attributes left out of it (see KeepAttributes()).
         self._baseBranches = [str(b) for b in rdf.GetColumnNames()]
         self._generateFromRDF(rdf)
         self._builtCollections = []
+        self._builtAttributes = {}
+        self._keepAttributes = {}
+        self.pruneAttributes = False
 
     def _generateFromRDF(self, rdf):
         '''Generate the collection from the RDataFrame.
@@ -89,39 +102,53 @@ class CollectionOrganizer:
         in which case, the attribute will be added to the tracked collection.
 
         @param b (str): Branch name
-        @param btype (str, optional): Type of branch. Defaults to '' but should only be left
+        @param btype (str, function, optional): Type of branch or a function returning it.
+            A function is only called once the type is needed (when a struct of the collection is built)
+            so that the type of a new column does not have to be looked up right away. Defaults to '' but should only be left
             this way in rare cases.
         '''
         collname = b.split('_')[0]
         varname = '_'.join(b.split('_')[1:])
-        typeStr, isVect = self._parsetype(btype)
+        if callable(btype):
+            typeStr, isVect = None, None
+        else:
+            typeStr, isVect = self._parsetype(btype)
+        info = {
+            'type': typeStr,
+            'isVect': isVect,
+            'alias': False
+        }
+        if callable(btype): info['typeFunc'] = btype
         
         if typeStr == False or varname == '' or 'n'+collname not in self._baseBranches:
             matches = [m for m in self._otherBranches.keys() if (m.startswith(collname) and '_'.join(m.split('_')[1:]) != '')]
             if len(matches) == 0:
-                self._otherBranches[b] = {
-                    'type': typeStr,
-                    'isVect': isVect,
-                    'alias': False
-                }
+                self._otherBranches[b] = info
             else:
                 if varname != '':
                     self.AddCollection(collname)
-                    self._collectionDict[collname][varname] = {
-                        'type': typeStr,
-                        'isVect': isVect,
-                        'alias': False
-                    }
+                    self._collectionDict[collname][varname] = info
                     for match in matches:
                         self._collectionDict[collname]['_'.join(match.split('_')[1:])] = self._otherBranches[match]
                         del self._otherBranches[match]
         elif varname != '':
             self.AddCollection(collname)
-            self._collectionDict[collname][varname] = {
-                'type': typeStr,
-                'isVect': isVect,
-                'alias': False
-            }
+            self._collectionDict[collname][varname] = info
+
+    def _attribute(self, collection, attribute):
+        '''Get the information on a collection attribute (looking up its type
+        if that was deferred by AddBranch()).
+
+        @param collection (str): Collection name.
+        @param attribute (str): Attribute name.
+
+        Returns:
+            dict: Dictionary with keys "type", "isVect", and "alias".
+        '''
+        info = self._collectionDict[collection][attribute]
+        if 'typeFunc' in info:
+            info['type'], info['isVect'] = self._parsetype(info.pop('typeFunc')())
+        return info
 
     def Alias(self, alias, name):
         '''Add an alias for a solo branch, collection, or collection attribute.
@@ -149,13 +176,65 @@ class CollectionOrganizer:
             else:
                 raise ValueError('Cannot add alias `%s` because collection `%s` does not exist'%(alias,collname))
 
-    def BuildCppCollection(self,collection,node,silent=True):
+    def KeepAttributes(self, collection, attributes=None):
+        '''Always include attributes in the struct of a collection (ex. if they are only
+        used by C++ that is compiled after the struct is built).
+
+        @param collection (str): Collection name.
+        @param attributes ([str], optional): Attribute names. Defaults to None in which case
+            all attributes are kept for this collection.
+        '''
+        if attributes == None:
+            self._keepAttributes[collection] = None
+        elif self._keepAttributes.get(collection,[]) != None:
+            self._keepAttributes[collection] = self._keepAttributes.get(collection,[])+list(attributes)
+
+    def GetBuiltAttributes(self, collection):
+        '''Get the attributes included in the struct of a collection that was built.
+
+        @param collection (str): Collection name.
+
+        Returns:
+            list(str): Attribute names (None if not built).
+        '''
+        return self._builtAttributes.get(collection,None)
+
+    def _usedAttributes(self, collection, action_str):
+        '''Find the vector attributes of a collection that are accessed as members (`.attr` or `->attr`)
+        in the action or in any of the C++ compiled or declared so far (where the modules
+        using the collection live). This can include attributes only used for other collections with
+        attributes of the same name but never misses one that is used by the code known at this point.
+
+        @param collection (str): Collection name.
+        @param action_str (str): Action that needs the collection.
+
+        Returns:
+            list(str): Attribute names (all of them if pruning is off or none are found).
+        '''
+        attributes = [a for a in self.GetCollectionAttributes(collection) if self._attribute(collection,a)['isVect']]
+        keep = self._keepAttributes.get(collection,[])
+        if not self.pruneAttributes or keep == None:
+            return attributes
+
+        DeclareHeadersFor(action_str) # so the headers the action needs are searched too
+        sources = [action_str]+GetCompiledSources()
+        for header in HeaderReport()['declared']:
+            sources.extend(ReadSourceFiles(header))
+        members = set(re.findall(r'(?:\.|->)\s*([A-Za-z_]\w*)','\n'.join(sources)))
+        used = [a for a in attributes if a in members or a in keep]
+        return used if len(used) > 0 else attributes
+
+    def BuildCppCollection(self,collection,node,silent=True,action_str=''):
         '''Build the collection as a struct in C++ so that it's accessible
-        to the RDataFrame loop.
+        to the RDataFrame loop. The struct members are references to the elements
+        of the attribute RVecs so no data is copied. If #pruneAttributes is True,
+        only the attributes used by `action_str` and the C++ known so far are included
+        (see KeepAttributes() to add others) so that the other branches of the collection are not read.
 
         @param collection (str): Collection name.
         @param node (Node): Node on which to act.
         @param silent (bool, optional): Whether output should be silenced. Defaults to True.
+        @param action_str (str, optional): Action that needs the collection. Defaults to ''.
 
         Raises:
             RuntimeError: Collection already built.
@@ -164,15 +243,22 @@ class CollectionOrganizer:
             Node: Manipulated node with the collection struct now defined.
         '''
         newNode = node
+        allAttributes = [a for a in self.GetCollectionAttributes(collection) if self._attribute(collection,a)['isVect']]
+        used = self._usedAttributes(collection,action_str)
         attributes = []
-        for aname in self.GetCollectionAttributes(collection):
-            if self._collectionDict[collection][aname]['isVect']:
-                attributes.append('%s %s'%(self._collectionDict[collection][aname]['type'], aname))
+        for aname in used:
+            attributes.append('%s %s'%(self._attribute(collection,aname)['type'], aname))
+        # Structs with a subset of the attributes get their own name so different subsets
+        # (ex. from several analyzers in one process) do not clash
+        structName = collection+'Struct' if used == allAttributes else '%s_%sStruct'%(collection,ContentHash(attributes,8))
 
         if collection+'s' not in self._builtCollections:
             self._builtCollections.append(collection+'s')
-            CompileCpp(StructDef(collection,attributes))
-            newNode = newNode.Define(collection+'s', StructObj(collection,attributes),silent=silent)
+            self._builtAttributes[collection] = used
+            if not silent and used != allAttributes:
+                print ('Struct for %ss uses %s of %s attributes: %s'%(collection,len(used),len(allAttributes),', '.join(used)))
+            CompileCpp(StructDef(collection,attributes,structName))
+            newNode = newNode.Define(collection+'s', StructObj(collection,attributes,structName),silent=silent)
         else:
             raise RuntimeError('Collections `%s` already built.'%(collection+'s'))
 
@@ -193,22 +279,23 @@ class CollectionOrganizer:
         for c in self._collectionDict.keys():
             if re.search(r"\b" + re.escape(c+'s') + r"\b", action_str) and (c+'s' not in self._builtCollections):
                 print ('MAKING %ss for %s'%(c,action_str))
-                newNode = self.BuildCppCollection(c,newNode,silent=True)
+                newNode = self.BuildCppCollection(c,newNode,silent=True,action_str=action_str)
         return newNode
 
-def StructDef(collectionName, varList):
+def StructDef(collectionName, varList, structName=None):
     '''Defines the struct in C++/Cling memory.
 
     @param collectionName (str): Name of the collection to define.
     @param varList (str): List of attributes of the collection to include.
+    @param structName (str, optional): Name of the struct. Defaults to None in which case `<collectionName>Struct` is used.
 
     Returns:
         str: C++ string defining the struct.
     '''
     out_str = '''
-struct {0}Struct {{
+struct {0} {{
         {1}
-        {0}Struct({2}) :
+        {0}({2}) :
         {3} {{
         }};
 }};
@@ -221,20 +308,22 @@ struct {0}Struct {{
         ctor_args.append('%s'%v)
         ctor_assign.append('%s(%s)'%(v.split(' ')[-1], v.split(' ')[-1]))
 
-    out_str = out_str.format(collectionName, '\t'.join(definitions), ','.join(ctor_args),','.join(ctor_assign))
+    structName = collectionName+'Struct' if structName == None else structName
+    out_str = out_str.format(structName, '\t'.join(definitions), ','.join(ctor_args),','.join(ctor_assign))
     return out_str
 
-def StructObj(collectionName, varList):
+def StructObj(collectionName, varList, structName=None):
     '''Initializes an instance of the C++ struct for the collection in C++/Cling memory.
 
     @param collectionName (str): Name of the collection to define.
     @param varList (str): List of attributes of the collection to include.
+    @param structName (str, optional): Name of the struct. Defaults to None in which case `<collectionName>Struct` is used.
 
     Returns:
         str: C++ string defining the struct instance.
     '''
     out_str = '''
-std::vector<{0}Struct> {0}s;
+std::vector<{2}> {0}s;
 {0}s.reserve(n{0});
 for (size_t i = 0; i < n{0}; i++) {{
     {0}s.emplace_back({1});
@@ -245,5 +334,6 @@ return {0}s;
     for i,v in enumerate(varList):
         varname = v.split(' ')[-1]
         attr_assignment_str += '{0}_{1}[i],'.format(collectionName, varname)
-    out_str = out_str.format(collectionName,attr_assignment_str[:-1])
+    structName = collectionName+'Struct' if structName == None else structName
+    out_str = out_str.format(collectionName,attr_assignment_str[:-1],structName)
     return out_str
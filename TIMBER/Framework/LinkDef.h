@@ -0,0 +1,50 @@
+// LinkDef for the optional dictionary (and C++ module) of the TIMBER/Framework headers.
+// Built with `make dict`. Once built, CompileCpp() loads bin/libtimber/libtimber_dict.so
+// so that the headers do not need to be parsed from source in every process.
+#ifdef __CLING__
+#pragma link off all globals;
+#pragma link off all classes;
+#pragma link off all functions;
+#pragma link C++ nestedclasses;
+
+// common.h
+#pragma link C++ namespace hardware;
+#pragma link C++ namespace Pythonic;
+#pragma link C++ class TempDir+;
+#pragma link C++ function ReadTarFile;
+// GenMatching.h
+#pragma link C++ namespace GenMatching;
+#pragma link C++ class Particle+;
+#pragma link C++ class GenParticleTree+;
+// Modules
+#pragma link C++ struct Collection+;
+#pragma link C++ class DeepAK8_helper+;
+#pragma link C++ class EffLoader+;
+#pragma link C++ class HEM_drop+;
+#pragma link C++ class HistLoader+;
+#pragma link C++ class LumiFilter+;
+#pragma link C++ class PDFweight_uncert+;
+#pragma link C++ class Pileup_weight+;
+#pragma link C++ class Prefire_weight+;
+#pragma link C++ class SJBtag_SF+;
+#pragma link C++ class TopPt_weight+;
+#pragma link C++ class TopTagDAK8_SF+;
+#pragma link C++ class TopTag_SF+;
+#pragma link C++ class Trigger_weight+;
+#pragma link C++ class Wtag_SF+;
+
+// JME modules (require CMSSW)
+#ifdef TIMBER_JME
+#pragma link C++ class JMEpaths+;
+#pragma link C++ class JESpaths+;
+#pragma link C++ class JERpaths+;
+#pragma link C++ class JetRecalibrator+;
+#pragma link C++ class GenJetMatcher+;
+#pragma link C++ class JetSmearer+;
+#pragma link C++ class JES_weight+;
+#pragma link C++ class JER_weight+;
+#pragma link C++ class JMS_weight+;
+#pragma link C++ class JMR_weight+;
+#endif
+
+#endif
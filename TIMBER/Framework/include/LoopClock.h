@@ -0,0 +1,78 @@
+#ifndef _TIMBER_LOOPCLOCK
+#define _TIMBER_LOOPCLOCK
+#include <chrono>
+#include <memory>
+#include <string>
+#include <vector>
+#include <ROOT/RDataFrame.hxx>
+
+/**
+ * @class LoopClock
+ * @brief C++ class. RDataFrame action (booked with `Book()`, see BookLoopClock()) which records
+ * when an event loop starts processing (once RDataFrame has just-in-time compiled the graph), when
+ * it processes its first event, and when it finishes, along with the number of events processed.
+ * The times are in seconds since the epoch (like python's `time.time()`) so they can be compared
+ * to a time taken before the loop was started. No clock is read per event.
+ */
+class LoopClock : public ROOT::Detail::RDF::RActionImpl<LoopClock> {
+    public:
+        typedef std::vector<double> Result_t; //!< Start, first event, and end times then the number of events
+    private:
+        std::shared_ptr<Result_t> result;
+        std::vector<double> slotFirst;
+        std::vector<ULong64_t> slotEntries;
+        static double Now() {
+            return std::chrono::duration<double>(std::chrono::system_clock::now().time_since_epoch()).count();
+        };
+
+    public:
+        /**
+         * @brief Construct a new LoopClock object
+         *
+         * @param nSlots Number of processing slots of the RDataFrame (`GetNSlots()`).
+         */
+        LoopClock(unsigned int nSlots) : result(std::make_shared<Result_t>(4,0.)), slotFirst(nSlots,0.), slotEntries(nSlots,0) {};
+        LoopClock(LoopClock&&) = default;
+        LoopClock(const LoopClock&) = delete;
+        /**
+         * @brief Times and number of events (filled once the event loop has run).
+         *
+         * @return std::shared_ptr<Result_t>
+         */
+        std::shared_ptr<Result_t> GetResultPtr() const { return result; };
+        void Initialize() { (*result)[0] = Now(); };
+        void InitTask(TTreeReader*, unsigned int) {};
+        /**
+         * @brief Count the event (and record the time if it is the first one of the slot).
+         *
+         * @param slot Processing slot.
+         */
+        void Exec(unsigned int slot) {
+            if (slotEntries[slot]++ == 0) slotFirst[slot] = Now();
+        };
+        /**
+         * @brief Record the end of the loop and combine the slots.
+         */
+        void Finalize() {
+            Result_t& r = *result;
+            r[2] = Now();
+            r[1] = r[2];
+            r[3] = 0;
+            for (std::size_t slot = 0; slot < slotEntries.size(); slot++) {
+                if (slotEntries[slot] > 0 && slotFirst[slot] < r[1]) r[1] = slotFirst[slot];
+                r[3] += slotEntries[slot];
+            }
+        };
+        std::string GetActionName() { return "LoopClock"; };
+};
+
+/**
+ * @brief Book a LoopClock on an RDataFrame.
+ *
+ * @param df RDataFrame (as an RNode).
+ * @return ROOT::RDF::RResultPtr<LoopClock::Result_t>
+ */
+inline ROOT::RDF::RResultPtr<LoopClock::Result_t> BookLoopClock(ROOT::RDF::RNode df) {
+    return df.Book<>(LoopClock(df.GetNSlots()), {});
+}
+#endif
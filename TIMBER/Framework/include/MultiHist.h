@@ -0,0 +1,131 @@
+#ifndef _TIMBER_MULTIHIST
+#define _TIMBER_MULTIHIST
+#include <array>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include <ROOT/RDataFrame.hxx>
+#include <ROOT/RVec.hxx>
+#include <TH1D.h>
+#include <TH2D.h>
+#include <TH3D.h>
+
+/**
+ * @class MultiHist
+ * @brief C++ class. RDataFrame action (booked with `Book()`) which fills several histograms
+ * with the same binning and the same 1, 2, or 3 variables but each with its own weight
+ * (ex. the systematic variations of a template). The bin is found once per event and every
+ * histogram is then filled with its weight. The statistics (entries, sums of weights, and moments)
+ * are kept the same way as `TH1::Fill()` so the histograms match those from `Histo1D/2D/3D()`.
+ *
+ * @tparam H Histogram type (TH1D, TH2D, or TH3D).
+ * @tparam X Types of the variables (one per dimension, in x, y, z order).
+ */
+template <class H, class... X>
+class MultiHist : public ROOT::Detail::RDF::RActionImpl<MultiHist<H,X...>> {
+    public:
+        typedef std::vector<H> Result_t; //!< One histogram per weight
+    private:
+        static const std::size_t nStats = sizeof...(X) == 1 ? 4 : (sizeof...(X) == 2 ? 7 : 11);
+        std::vector<std::shared_ptr<Result_t>> slotHists; // slot 0 is the result
+        std::vector<std::vector<double>> slotStats; // nStats sums (see TH1::GetStats()) per histogram
+        std::vector<ULong64_t> slotEntries;
+
+    public:
+        /**
+         * @brief Construct a new MultiHist object
+         *
+         * @param model Histogram to copy the binning from.
+         * @param names Name of each histogram (one per weight).
+         * @param titles Title of each histogram (one per weight).
+         * @param nSlots Number of processing slots of the RDataFrame (`GetNSlots()`).
+         */
+        MultiHist(const H& model, const std::vector<std::string>& names, const std::vector<std::string>& titles, unsigned int nSlots) {
+            if (names.size() != titles.size()) {
+                throw std::invalid_argument("MultiHist: Number of names and titles do not match.");
+            }
+            for (unsigned int slot = 0; slot < nSlots; slot++) {
+                std::shared_ptr<Result_t> hists = std::make_shared<Result_t>();
+                hists->reserve(names.size());
+                for (std::size_t i = 0; i < names.size(); i++) {
+                    hists->emplace_back(model);
+                    H& h = hists->back();
+                    h.SetDirectory(nullptr);
+                    h.SetName(names[i].c_str());
+                    h.SetTitle(titles[i].c_str());
+                    h.Reset();
+                    if (h.GetSumw2N() == 0) h.Sumw2();
+                }
+                slotHists.push_back(hists);
+                slotStats.emplace_back(names.size()*nStats,0.);
+                slotEntries.push_back(0);
+            }
+        };
+        MultiHist(MultiHist&&) = default;
+        MultiHist(const MultiHist&) = delete;
+        /**
+         * @brief Histograms (filled once the event loop has run).
+         *
+         * @return std::shared_ptr<Result_t>
+         */
+        std::shared_ptr<Result_t> GetResultPtr() const { return slotHists[0]; };
+        void Initialize() {};
+        void InitTask(TTreeReader*, unsigned int) {};
+        /**
+         * @brief Fill every histogram for one event.
+         *
+         * @param slot Processing slot.
+         * @param x Variables (one per dimension).
+         * @param weights Weight of each histogram.
+         */
+        void Exec(unsigned int slot, const X&... x, const ROOT::VecOps::RVec<double>& weights) {
+            Result_t& hists = *slotHists[slot];
+            if (weights.size() != hists.size()) {
+                throw std::length_error("MultiHist: Number of weights does not match the number of histograms.");
+            }
+            slotEntries[slot]++;
+            const int bin = hists[0].FindBin(double(x)...);
+            if (bin < 0) return;
+            // Like TH1::Fill(), the statistics only include the events in range (unless TH1::StatOverflows())
+            int bx, by, bz;
+            hists[0].GetBinXYZ(bin,bx,by,bz);
+            const bool inRange = (bx > 0 && bx <= hists[0].GetNbinsX()) &&
+                                 (sizeof...(X) < 2 || (by > 0 && by <= hists[0].GetNbinsY())) &&
+                                 (sizeof...(X) < 3 || (bz > 0 && bz <= hists[0].GetNbinsZ()));
+            const bool stats = inRange || TH1::GetStatOverflows();
+            const std::array<double,3> c = {{double(x)...}};
+            // Everything except the sum of squared weights (index 1) is multiplied by the weight
+            const double m[11] = {1., 0., c[0], c[0]*c[0], c[1], c[1]*c[1], c[0]*c[1], c[2], c[2]*c[2], c[0]*c[2], c[1]*c[2]};
+            double* s = slotStats[slot].data();
+            for (std::size_t i = 0; i < hists.size(); i++) {
+                const double w = weights[i];
+                hists[i].AddBinContent(bin,w);
+                hists[i].GetSumw2()->fArray[bin] += w*w;
+                if (stats) {
+                    for (std::size_t k = 0; k < nStats; k++) s[i*nStats+k] += w*m[k];
+                    s[i*nStats+1] += w*w;
+                }
+            }
+        };
+        /**
+         * @brief Set the statistics of the histograms of each slot and add them together.
+         */
+        void Finalize() {
+            for (std::size_t slot = 0; slot < slotHists.size(); slot++) {
+                Result_t& hists = *slotHists[slot];
+                for (std::size_t i = 0; i < hists.size(); i++) {
+                    hists[i].PutStats(&slotStats[slot][i*nStats]);
+                    hists[i].SetEntries(slotEntries[slot]);
+                }
+            }
+            Result_t& result = *slotHists[0];
+            for (std::size_t slot = 1; slot < slotHists.size(); slot++) {
+                for (std::size_t i = 0; i < result.size(); i++) {
+                    result[i].Add(&(*slotHists[slot])[i]);
+                }
+            }
+        };
+        std::string GetActionName() { return "MultiHist"; };
+};
+#endif
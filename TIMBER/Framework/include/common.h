@@ -17,6 +17,8 @@
 #include <TMath.h>
 #include <TFile.h>
 #include <TH1.h>
+#include <TTree.h>
+#include <TLeaf.h>
 #include <Math/GenVector/LorentzVector.h>
 #include <Math/GenVector/PtEtaPhiM4D.h>
 #include <Math/Vector4Dfwd.h>
@@ -47,6 +49,54 @@ namespace hardware {
      * @return TH1* 
      */
     TH1 *LoadHist(std::string filename, std::string histname, bool inTIMBER = true);
+    /**
+     * @brief Sum several branches of a TTree over all of its entries in one pass.
+     * Only the requested branches are read from disk. Meant for the
+     * scalar `genEventSumw*` and `genEventCount*` branches of the NanoAOD Runs TTree.
+     * 
+     * @param tree 
+     * @param branches Names of the branches to sum.
+     * @return std::vector<double> Sum of each branch (in the order of `branches`).
+     */
+    std::vector<double> SumBranches(TTree *tree, std::vector<std::string> branches);
+    /**
+     * @brief View of an RVec which points to its memory instead of copying it.
+     * The view is only valid as long as the original is. Used for the columns
+     * of a SubCollection which are members of one sliced struct.
+     * 
+     * @param v 
+     * @return RVec<T> 
+     */
+    template<class T>
+    RVec<T> View(const RVec<T>& v) {
+        return RVec<T>(const_cast<T*>(v.data()), v.size());
+    }
+    /**
+     * @brief RVec<bool> may not provide contiguous memory (std::vector<bool>)
+     * so it is copied instead.
+     * 
+     * @param v 
+     * @return RVec<bool> 
+     */
+    inline RVec<bool> View(const RVec<bool>& v) {
+        return v;
+    }
+    /**
+     * @brief Take the element at the same position of each sub-vector (`out[i] = v[i][j]`).
+     * Same as `Transpose(v)[j]` (but empty if v is empty) without building the full transpose.
+     * 
+     * @param v 
+     * @param j Position in the sub-vectors.
+     * @return RVec<T> 
+     */
+    template<class T>
+    RVec<T> Column(const RVec<RVec<T>>& v, std::size_t j) {
+        RVec<T> out(v.size());
+        for (std::size_t i = 0; i < v.size(); i++) {
+            out[i] = v[i][j];
+        }
+        return out;
+    }
     /**
      * @brief Hadamard product of two vectors (`v3[i] = v1[i]*v2[i]`)
      * 
@@ -18,6 +18,30 @@ TH1 *hardware::LoadHist(std::string filename, std::string histname, bool inTIMBE
     return hist;
 }
 
+std::vector<double> hardware::SumBranches(TTree *tree, std::vector<std::string> branches){
+    std::vector<double> sums (branches.size(), 0.0);
+    std::vector<TLeaf*> leaves;
+    tree->SetBranchStatus("*",0);
+    for (size_t b = 0; b < branches.size(); b++) {
+        tree->SetBranchStatus(branches[b].c_str(),1);
+        TLeaf *leaf = tree->GetLeaf(branches[b].c_str());
+        if (leaf == nullptr) {
+            tree->SetBranchStatus("*",1);
+            throw std::runtime_error("Branch "+branches[b]+" not found in TTree "+tree->GetName());
+        }
+        leaves.push_back(leaf);
+    }
+    Long64_t nentries = tree->GetEntries();
+    for (Long64_t i = 0; i < nentries; i++) {
+        tree->GetEntry(i);
+        for (size_t b = 0; b < leaves.size(); b++) {
+            sums[b] += leaves[b]->GetValue();
+        }
+    }
+    tree->SetBranchStatus("*",1);
+    return sums;
+}
+
 RVec<float> hardware::HadamardProduct(RVec<float> v1, RVec<float> v2) {
     RVec<float> out;
     out.reserve(v1.size());
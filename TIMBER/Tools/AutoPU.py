@@ -1,6 +1,6 @@
 import ROOT
 from TIMBER.Analyzer import TIMBERPATH, Correction
-from TIMBER.Tools.Common import GetPUfile
+from TIMBER.Tools.Common import GetPUfile, WatchLoops
 
 def AutoPU(a, year, ULflag=True):
     '''Automatically perform the standard pileup calculation on the analyzer object.
@@ -15,7 +15,8 @@ def AutoPU(a, year, ULflag=True):
     autoPU = MakePU(a, year, ULflag)
     print ('AutoPU: Extracting Pileup_nTrueInt distribution')
     ROOT.gROOT.cd()
-    ROOT.gDirectory.Add(autoPU.GetValue())
+    with WatchLoops(a.Loops,'AutoPU',[autoPU]):
+        ROOT.gDirectory.Add(autoPU.GetValue())
     data_files = GetPUfilesStr(year,ULflag=ULflag)
     c_PU = Correction('Pileup','TIMBER/Framework/src/Pileup_weight.cc',[data_files], corrtype="weight")
     a.AddCorrection(c_PU)
@@ -42,7 +43,8 @@ def MakePU(a, year, ULflag=True, filename=''):
     if filename != '':
         fout = ROOT.TFile.Open(filename,'RECREATE')
         fout.cd()
-        autoPU.Write()
+        with WatchLoops(a.Loops,'MakePU',[autoPU]):
+            autoPU.Write()
         fout.Close()
     return autoPU
 
@@ -3,7 +3,7 @@ Commonly used functions available for use that can be generic or TIMBER specific
 @{
 '''
 
-import json, os, subprocess, sys, ROOT, random, string, pandas
+import json, math, os, re, shutil, subprocess, sys, time, traceback, ROOT, random, string, pandas, hashlib, atexit
 from contextlib import contextmanager
 from collections import OrderedDict
 #-----------------#
@@ -11,6 +11,8 @@ from collections import OrderedDict
 #-----------------#
 def CutflowDict(node,initial=None):
     '''Turns the RDataFrame cutflow report into an OrderedDict.
+    This runs the event loop immediately. Use Cutflow (or analyzer.BookCutflow())
+    to book a cutflow, optionally weighted, that is filled with the other results.
 
     @param node (Node): Input Node from which to get the cutflow.
     @param initial (int): Initial number events. Defaults to None
@@ -23,12 +25,14 @@ def CutflowDict(node,initial=None):
     filters = node.DataFrame.GetFilterNames()
     rdf_report = node.DataFrame.Report()
     cutflow = OrderedDict()
-    if initial == None: 
-        cutflow['Initial'] = int(node.GetBaseNode().DataFrame.Count().GetValue())
-    else:
-        cutflow['Initial'] = initial
-    for filtername in filters: 
-        cutflow[str(filtername)] = int(rdf_report.At(filtername).GetPass())
+    monitor = getattr(node.GetBaseNode(),'loops',None)
+    with WatchLoops(monitor,'CutflowDict',[rdf_report] if initial != None else None):
+        if initial == None: 
+            cutflow['Initial'] = int(node.GetBaseNode().DataFrame.Count().GetValue())
+        else:
+            cutflow['Initial'] = initial
+        for filtername in filters: 
+            cutflow[str(filtername)] = int(rdf_report.At(filtername).GetPass())
 
     return cutflow
 
@@ -81,6 +85,469 @@ def CutflowTxt(name,node,efficiency=False):
             out.write('%s %s\n'%(filtername,cut))
     out.close()
 
+def _bookCutflowStep(node,weight,w2col):
+    '''Book the number of events (and the sum of the weight column and of its square) on a Node.
+    The weight is only summed if the column exists on the Node (ex. weights made by
+    analyzer.MakeWeightCols() after the cuts do not exist before them).
+
+    @param node (Node): Node of the step.
+    @param weight (str): Weight column (or None).
+    @param w2col (str): Name to use for the column of the squared weight.
+
+    Returns:
+        dict: Pointers with keys "count", "sumw", and "sumw2" (None if not summed).
+    '''
+    ptrs = {'count':node.DataFrame.Count(),'sumw':None,'sumw2':None}
+    if weight != None and weight in [str(c) for c in node.DataFrame.GetColumnNames()]:
+        ptrs['sumw'] = node.DataFrame.Sum(weight)
+        ptrs['sumw2'] = node.DataFrame.Define(w2col,'double(%s)*double(%s)'%(weight,weight)).Sum(w2col)
+    return ptrs
+
+def _checkCutflowWeight(weight,ptrs):
+    '''Check that a weight column was found on at least one step of a cutflow.
+
+    @param weight (str): Weight column (or None).
+    @param ptrs (OrderedDict): Booked pointers of each step (see _bookCutflowStep()).
+
+    Raises:
+        ValueError: If the weight column was not found on any step.
+    '''
+    if weight != None and len(ptrs) > 0 and all([p['sumw'] == None for p in ptrs.values()]):
+        raise ValueError('The weight column `%s` does not exist on any step of the cutflow.'%weight)
+
+class Cutflow(object):
+    '''Cutflow booked lazily on the cuts leading to a Node so that it is filled
+    in the same event loop as the other results (unlike CutflowDict() which runs the loop
+    immediately). The number of events (and the sum of a weight column and of its square, if given)
+    is booked before the first cut ("Initial") and for every Node made with a cut on the way to the input Node.
+    The weight is only summed on the steps where the column exists (ex. `weight__nominal` is usually
+    made after the cuts) and the yield of the steps before it is the number of events.
+
+    Cutflows can be added together (ex. over shards or jobs) with `+` and saved to/loaded from
+    JSON so that the outputs of separate jobs can be combined without reading the data again.
+
+    Ex.
+    ```
+    cf = a.BookCutflow('weight__nominal') # or Cutflow(a.GetActiveNode(),'genWeight')
+    ...
+    cf.Save('cutflow_job1.json')
+    total = Cutflow.Load('cutflow_job1.json') + Cutflow.Load('cutflow_job2.json')
+    ```
+    '''
+    def __init__(self,node=None,weight=None,name='cutflow'):
+        '''Constructor
+
+        @param node (Node, optional): Node to book the cutflow for. Defaults to None in which case
+            the cutflow is empty (ex. to be filled with FromDict()).
+        @param weight (str, optional): Weight column to sum for each cut. Only summed on the steps where
+            the column exists. Defaults to None.
+        @param name (str, optional): Name of the cutflow. Defaults to 'cutflow'.
+        '''
+        ## @var name
+        # str
+        #
+        # Name of the cutflow.
+        ## @var weight
+        # str
+        #
+        # Weight column summed for each cut (None if unweighted).
+        ## @var steps
+        # OrderedDict
+        #
+        # For each cut (in order), a dictionary with keys "count", "sumw", and "sumw2". Values are None before Materialize()
+        # ("sumw" and "sumw2" stay None on steps before the weight column exists).
+        ## @var loops
+        # LoopMonitor
+        #
+        # Monitor of the event loops of the analyzer the cutflow is booked on (can be None).
+        self.name = name
+        self.weight = weight
+        self.steps = OrderedDict()
+        self.loops = None
+        self._ptrs = OrderedDict()
+        if node != None:
+            self._book(node)
+
+    def _book(self,node):
+        '''Book the counts (and sums of weights) on each cut leading to the node.
+
+        @param node (Node): Last Node of the cutflow.
+
+        Raises:
+            ValueError: If the weight column does not exist on any step.
+        '''
+        chain = []
+        while node != None:
+            chain.insert(0,node)
+            node = node.parent
+        self.loops = getattr(chain[0],'loops',None)
+
+        # Defines do not change the number of events so "Initial" is taken just before the
+        # first cut where as many columns (ex. the weight) as possible are available
+        cuts = [i for i,n in enumerate(chain) if n.op == 'Filter' and i > 0]
+        initial = cuts[0]-1 if len(cuts) > 0 else len(chain)-1
+        w2col = '__cutflow_w2_'+GenerateHash()
+        for i,n in enumerate(chain):
+            if i == initial: stepname = 'Initial'
+            elif i in cuts: stepname = n.name
+            else: continue
+            self._ptrs[stepname] = _bookCutflowStep(n,self.weight,w2col)
+            self.steps[stepname] = {'count':None,'sumw':None,'sumw2':None}
+        _checkCutflowWeight(self.weight,self._ptrs)
+
+    def GetPointers(self):
+        '''Get the booked results that have not been filled yet (ex. to give to ROOT.RDF.RunGraphs).
+
+        Returns:
+            list(RResultPtr): Booked results.
+        '''
+        return [p for ptrs in self._ptrs.values() for p in ptrs.values() if p is not None and not p.IsReady()]
+
+    def Materialize(self):
+        '''Fill the cutflow from the booked results (runs the event loop only if needed).
+
+        Returns:
+            Cutflow: Itself.
+        '''
+        if len(self._ptrs) > 0:
+            with WatchLoops(self.loops,'Cutflow %s'%self.name,[p for ptrs in self._ptrs.values() for p in ptrs.values() if p is not None]):
+                for stepname,ptrs in self._ptrs.items():
+                    self.steps[stepname]['count'] = int(ptrs['count'].GetValue())
+                    if ptrs['sumw'] != None:
+                        self.steps[stepname]['sumw'] = float(ptrs['sumw'].GetValue())
+                        self.steps[stepname]['sumw2'] = float(ptrs['sumw2'].GetValue())
+            self._ptrs = OrderedDict()
+        return self
+
+    def keys(self):
+        '''Names of the cuts (in order, starting with "Initial").
+
+        Returns:
+            list(str): Cut names.
+        '''
+        return list(self.steps.keys())
+
+    def __getitem__(self,key):
+        '''Yield after a cut, weighted if a weight was given (and exists at that cut).
+
+        @param key (str): Cut name.
+
+        Returns:
+            float or int: Sum of weights or number of events.
+        '''
+        self.Materialize()
+        return self.steps[key]['sumw'] if self.steps[key]['sumw'] != None else self.steps[key]['count']
+
+    def AsDict(self):
+        '''Same format as CutflowDict().
+
+        Returns:
+            OrderedDict: Cut names as keys and yields (weighted if a weight was given) as values.
+        '''
+        return OrderedDict([(k,self[k]) for k in self.keys()])
+
+    def GetHist(self,name=None,efficiency=False):
+        '''Draw the cutflow as a histogram (errors from the sum of squared weights if weighted).
+
+        @param name (str, optional): Name of the histogram. Defaults to None in which case #name is used.
+        @param efficiency (bool, optional): Reports an efficiency instead of yields
+            (relative to the initial yield). Defaults to False.
+
+        Returns:
+            TH1: Histogram with each bin showing the yield (or efficiency) for progressive cuts.
+        '''
+        self.Materialize()
+        name = self.name if name == None else name
+        h = ROOT.TH1F(name,name,len(self.steps),0,len(self.steps))
+        norm = float(self['Initial']) if efficiency and self['Initial'] != 0 else 1.0
+        for i,stepname in enumerate(self.keys()):
+            h.GetXaxis().SetBinLabel(i+1,stepname)
+            h.SetBinContent(i+1,self[stepname]/norm)
+            if self.steps[stepname]['sumw2'] != None:
+                h.SetBinError(i+1,math.sqrt(self.steps[stepname]['sumw2'])/norm)
+            else:
+                h.SetBinError(i+1,math.sqrt(self.steps[stepname]['count'])/norm)
+        return h
+
+    def __add__(self,other):
+        '''Add two cutflows with the same cuts and weight (ex. from two jobs).
+
+        @param other (Cutflow): Cutflow to add.
+
+        Raises:
+            ValueError: If the cuts or weights do not match.
+
+        Returns:
+            Cutflow: New summed cutflow.
+        '''
+        self.Materialize()
+        other.Materialize()
+        if self.keys() != other.keys() or self.weight != other.weight:
+            raise ValueError('Cannot add cutflows with different cuts or weights (%s with %s vs %s with %s).'%(
+                self.keys(),self.weight,other.keys(),other.weight))
+        out = Cutflow(weight=self.weight,name=self.name)
+        for stepname in self.keys():
+            out.steps[stepname] = dict([(k,self.steps[stepname][k]+other.steps[stepname][k] if self.steps[stepname][k] != None else None)
+                                        for k in ['count','sumw','sumw2']])
+        return out
+
+    def __radd__(self,other):
+        '''Allows `sum()` over a list of cutflows.'''
+        if other == 0:
+            return self.Materialize()
+        return self.__add__(other)
+
+    def ToDict(self):
+        '''Serializable description of the cutflow.
+
+        Returns:
+            dict: With keys "name", "weight", and "steps" (list of [cut name, count, sumw, sumw2]).
+        '''
+        self.Materialize()
+        return {'name':self.name,'weight':self.weight,
+                'steps':[[k,v['count'],v['sumw'],v['sumw2']] for k,v in self.steps.items()]}
+
+    @staticmethod
+    def FromDict(d):
+        '''Make a cutflow from ToDict() output.
+
+        @param d (dict): Output of ToDict().
+
+        Returns:
+            Cutflow: New cutflow.
+        '''
+        out = Cutflow(weight=None if d['weight'] == None else str(d['weight']),name=str(d['name']))
+        for stepname,count,sumw,sumw2 in d['steps']:
+            out.steps[str(stepname)] = {'count':count,'sumw':sumw,'sumw2':sumw2}
+        return out
+
+    def Save(self,filename):
+        '''Write the cutflow to a JSON file.
+
+        @param filename (str): Output JSON file name.
+        '''
+        WriteJSON(self.ToDict(),filename)
+
+    @staticmethod
+    def Load(filename):
+        '''Read a cutflow written by Save().
+
+        @param filename (str): JSON file name.
+
+        Returns:
+            Cutflow: New cutflow.
+        '''
+        return Cutflow.FromDict(OpenJSON(filename))
+
+def _nodePathKey(parentKey,node):
+    '''Key of a Node made from a parent with key `parentKey` (see NodePathKey()).
+
+    @param parentKey (str): Key of the parent ('' for the base Node).
+    @param node (Node): Node.
+
+    Returns:
+        str: Key.
+    '''
+    return ContentHash([parentKey,node.op,node.name,node.type,node.action])
+
+def NodePathKey(node):
+    '''Key identifying a Node by the operations, names, types, and actions of the Nodes
+    leading to it from the base Node (which is left out). Unlike `Node.hash`, it does not depend on the
+    (random) hash of the base Node so the same graph built by another analyzer (ex. on another part of the input
+    or in another process) has the same keys.
+
+    @param node (Node): Node.
+
+    Returns:
+        str: Key.
+    '''
+    chain = []
+    while node.parent != None:
+        chain.insert(0,node)
+        node = node.parent
+    key = ''
+    for n in chain:
+        key = _nodePathKey(key,n)
+    return key
+
+class CutflowTree(object):
+    '''Cutflows for several Nodes (ex. the leaves of the processing tree after
+    a Discriminate() or for N-1 selections) booked lazily and all filled in one event loop.
+    Cuts shared by several Nodes are only counted once. Each step and leaf of the tree is stored
+    by a key derived from the operations, names, types, and actions of the Nodes leading to it from the base Node
+    (see _nodePathKey()) so that the same graph built by another analyzer (ex. in another process) has the same keys
+    and the results can be merged. The tree can be drawn with analyzer.PrintNodeTree().
+    '''
+    def __init__(self,nodes,weight=None,name='cutflow_tree'):
+        '''Constructor
+
+        @param nodes ([Node]): Last Nodes (leaves) of the cutflows.
+        @param weight (str, optional): Weight column to sum for each cut. Only summed on the steps where
+            the column exists (see Cutflow). Defaults to None in which case only the number of events is counted.
+        @param name (str, optional): Name of the tree. Defaults to 'cutflow_tree'.
+        '''
+        ## @var name
+        # str
+        #
+        # Name of the tree.
+        ## @var weight
+        # str
+        #
+        # Weight column summed for each cut (None if unweighted).
+        ## @var steps
+        # OrderedDict
+        #
+        # For each step (keyed by the path key of its Node), a dictionary with keys "name", "parent" (key of the previous step or None),
+        # "count", "sumw", and "sumw2". Values are None before Materialize().
+        ## @var leaves
+        # OrderedDict
+        #
+        # For each input Node (keyed by its path key since several leaves can have the same name),
+        # a dictionary with keys "name" (Node name, used as a label) and "step" (key of its last step).
+        ## @var loops
+        # LoopMonitor
+        #
+        # Monitor of the event loops of the analyzer the tree is booked on (can be None).
+        self.name = name
+        self.weight = weight
+        self.steps = OrderedDict()
+        self.leaves = OrderedDict()
+        self.loops = None
+        self._ptrs = OrderedDict()
+        self._leafNodes = list(nodes)
+        self._nodeHashes = {} # step key -> Node hash (to label the Nodes in analyzer.PrintNodeTree())
+
+        chains = []
+        for node in nodes:
+            chain = []
+            while node != None:
+                chain.insert(0,node)
+                node = node.parent
+            chains.append(chain)
+        self.loops = getattr(chains[0][0],'loops',None)
+
+        # "Initial" is the last Node shared by all chains before any cut (see Cutflow)
+        initial = 0
+        while len(chains[0]) > initial+1 and all(len(c) > initial+1 and c[initial+1].hash == chains[0][initial+1].hash and c[initial+1].op != 'Filter' for c in chains):
+            initial += 1
+
+        w2col = '__cutflow_w2_'+GenerateHash()
+        for node,chain in zip(nodes,chains):
+            previous, key = None, ''
+            for i,n in enumerate(chain):
+                if i > 0: key = _nodePathKey(key,n)
+                if i == initial: stepname = 'Initial'
+                elif i > initial and n.op == 'Filter': stepname = n.name
+                else: continue
+                if key not in self.steps:
+                    self._ptrs[key] = _bookCutflowStep(n,self.weight,w2col)
+                    self.steps[key] = {'name':stepname,'parent':previous,'count':None,'sumw':None,'sumw2':None}
+                    self._nodeHashes[key] = n.hash
+                previous = key
+            self.leaves[key] = {'name':node.name,'step':previous}
+        _checkCutflowWeight(self.weight,self._ptrs)
+
+    def GetPointers(self):
+        '''Get the booked results that have not been filled yet (ex. to give to ROOT.RDF.RunGraphs).
+
+        Returns:
+            list(RResultPtr): Booked results.
+        '''
+        return [p for ptrs in self._ptrs.values() for p in ptrs.values() if p is not None and not p.IsReady()]
+
+    def GetNodes(self):
+        '''Get the leaf Nodes the tree was booked for.
+
+        Returns:
+            list(Node): Leaf Nodes.
+        '''
+        return list(self._leafNodes)
+
+    def Materialize(self):
+        '''Fill all of the steps from the booked results (runs the event loop only if needed).
+
+        Returns:
+            CutflowTree: Itself.
+        '''
+        if len(self._ptrs) > 0:
+            with WatchLoops(self.loops,'CutflowTree %s'%self.name,[p for ptrs in self._ptrs.values() for p in ptrs.values() if p is not None]):
+                for h,ptrs in self._ptrs.items():
+                    self.steps[h]['count'] = int(ptrs['count'].GetValue())
+                    if ptrs['sumw'] != None:
+                        self.steps[h]['sumw'] = float(ptrs['sumw'].GetValue())
+                        self.steps[h]['sumw2'] = float(ptrs['sumw2'].GetValue())
+            self._ptrs = OrderedDict()
+        return self
+
+    def Yield(self,h):
+        '''Yield of a step, weighted if a weight was given (and exists at that step).
+
+        @param h (str): Key of the step (see #steps).
+
+        Returns:
+            float or int: Sum of weights or number of events.
+        '''
+        self.Materialize()
+        return self.steps[h]['sumw'] if self.steps[h]['sumw'] != None else self.steps[h]['count']
+
+    def GetCutflow(self,leaf):
+        '''Get the cutflow from the start to one of the leaves.
+
+        @param leaf (str, Node): Key of the input Node (see #leaves) or the Node itself.
+
+        Returns:
+            Cutflow: Cutflow of the path (named after the Node).
+        '''
+        if not isinstance(leaf,str): leaf = NodePathKey(leaf)
+        self.Materialize()
+        path, h = [], self.leaves[leaf]['step']
+        while h != None:
+            step = self.steps[h]
+            path.insert(0,[step['name'],step['count'],step['sumw'],step['sumw2']])
+            h = step['parent']
+        return Cutflow.FromDict({'name':self.leaves[leaf]['name'],'weight':self.weight,'steps':path})
+
+    def AsDict(self):
+        '''Cutflow of every leaf in the same format as CutflowDict().
+
+        Returns:
+            OrderedDict: Leaf keys (see #leaves for the names) and cutflow dictionaries as values.
+        '''
+        return OrderedDict([(leaf,self.GetCutflow(leaf).AsDict()) for leaf in self.leaves])
+
+    def GetAnnotations(self,byNode=False):
+        '''Labels for each step with the yield and the efficiency relative to the previous step.
+
+        @param byNode (bool, optional): Key the labels by the hash of the Node of each step
+            (as used by analyzer.PrintNodeTree()) instead of the step key. Defaults to False.
+
+        Returns:
+            dict: Step keys (or Node hashes) as keys and labels as values.
+        '''
+        self.Materialize()
+        labels = {}
+        for h,step in self.steps.items():
+            y = self.Yield(h)
+            label = ('%.6g'%y) if self.weight != None else str(y)
+            if step['parent'] != None and self.Yield(step['parent']) != 0:
+                label += ' (%.1f%%)'%(100.*y/self.Yield(step['parent']))
+            labels[self._nodeHashes[h] if byNode else h] = label
+        return labels
+
+    def Print(self):
+        '''Print the tree with the yield and efficiency of each step.
+
+        Returns:
+            None
+        '''
+        labels = self.GetAnnotations()
+        def _print(h,depth):
+            print ('%s%s: %s'%('    '*depth,self.steps[h]['name'],labels[h]))
+            for c,step in self.steps.items():
+                if step['parent'] == h: _print(c,depth+1)
+        for h,step in self.steps.items():
+            if step['parent'] == None: _print(h,0)
+
 def StitchQCD(QCDdict,normDict=None):
     '''Stitches together histograms in QCD hist groups.
 
@@ -224,18 +691,185 @@ def _year_to_thousands_str(year):
 
     return out
 
+# Hashes of the code blocks and libraries already given to the interpreter in this process
+_compiledCode = set()
+# The same code blocks and libraries in the order they were given
+_compiledLog = []
+
+class LoopMonitor(object):
+    '''Counts, times, and attributes (to the python call site) the event loops
+    run on a dataset. Code that may trigger an event loop is wrapped with Watch()
+    (or WatchLoops()). Loops triggered elsewhere (ex. by calling `GetValue()` directly)
+    are found the next time Watch() is used but cannot be attributed.
+
+    A LoopClock (see LoopClock.h) is booked on the dataset before a watched loop so that the time
+    taken to start it (mostly RDataFrame compiling the C++ of the graph) and the times of its first and
+    last events are recorded as well (ROOT >= 6.22).
+
+    If #strict is True, Watch() raises an error before a second loop starts.
+    '''
+    def __init__(self,dataframe,strict=False):
+        '''Constructor
+
+        @param dataframe (RDataFrame): Base RDataFrame of the dataset.
+        @param strict (bool, optional): Raise an error before a second loop starts. Defaults to False.
+        '''
+        ## @var strict
+        # bool
+        #
+        # Raise an error before a second event loop starts.
+        ## @var loops
+        # list(dict)
+        #
+        # Information on each loop with keys "what", "site", and "time" (seconds). Watched loops timed by
+        # a LoopClock also have the keys "jit", "first", and "last" (seconds from the start of the watched code
+        # until the loop started processing, processed its first event, and finished) and "nEvents".
+        self._df = dataframe
+        self.strict = strict
+        self.loops = []
+
+    def _nRuns(self):
+        '''Number of event loops run so far according to RDataFrame (ROOT >= 6.22).
+
+        Returns:
+            int: Number of loops or None if not available.
+        '''
+        return int(self._df.GetNRuns()) if hasattr(self._df,'GetNRuns') else None
+
+    def _callSite(self):
+        '''Find the call site outside of TIMBER that led to the current call.
+
+        Returns:
+            str: "<file>:<line> (<function>)"
+        '''
+        timberdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for filename,line,func,text in reversed(traceback.extract_stack()):
+            if not os.path.abspath(filename).startswith(timberdir) and 'contextlib' not in filename:
+                return '%s:%s (%s)'%(filename,line,func)
+        return 'unknown'
+
+    def _bookClock(self):
+        '''Book a LoopClock on the dataset to time the next event loop.
+
+        Returns:
+            RResultPtr: Times and number of events (see LoopClock.h) or None if `ROOT.RDF.AsRNode` is not available.
+        '''
+        if not hasattr(ROOT.RDF,'AsRNode'):
+            return None
+        DeclareHeader(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/LoopClock.h')
+        return ROOT.BookLoopClock(ROOT.RDF.AsRNode(self._df))
+
+    def _findUntracked(self):
+        '''Add entries for loops that ran outside of Watch().'''
+        nRuns = self._nRuns()
+        if nRuns != None:
+            for i in range(nRuns-len(self.loops)):
+                self.loops.append({'what':'untracked','site':'unknown','time':None})
+
+    @contextmanager
+    def Watch(self,what,ptrs=None):
+        '''Context to wrap code that may run an event loop.
+
+        @param what (str): Description of the action (ex. "HistGroup.__getitem__").
+        @param ptrs ([RResultPtr], optional): The results that will be accessed. If all are
+            ready, no loop is expected. Defaults to None in which case a loop is expected.
+
+        Raises:
+            RuntimeError: If in strict mode and a second loop is about to start.
+        '''
+        token = self.Start(what,ptrs)
+        try:
+            yield
+        finally:
+            self.Stop(token)
+
+    def Start(self,what,ptrs=None):
+        '''Start watching for an event loop. Use Watch() unless the start and stop
+        cannot be wrapped in one context (ex. when several datasets run together).
+
+        @param what (str): Description of the action.
+        @param ptrs ([RResultPtr], optional): The results that will be accessed. Defaults to None.
+
+        Raises:
+            RuntimeError: If in strict mode and a second loop is about to start.
+
+        Returns:
+            dict: Token to give to Stop().
+        '''
+        self._findUntracked()
+        willRun = ptrs == None or any([not p.IsReady() for p in ptrs])
+        site = self._callSite()
+        if self.strict and willRun and len(self.loops) > 0:
+            raise RuntimeError('Event loop #%s was about to start (%s at %s). Previous loops:\n%s'%(
+                len(self.loops)+1,what,site,'\n'.join(['\t%s at %s'%(l['what'],l['site']) for l in self.loops])))
+        clock = self._bookClock() if willRun else None
+        return {'what':what,'site':site,'willRun':willRun,'before':self._nRuns(),'clock':clock,'start':time.time()}
+
+    def Stop(self,token):
+        '''Stop watching for an event loop and record any that ran.
+
+        @param token (dict): Token from Start().
+        '''
+        elapsed = time.time()-token['start']
+        nNew = self._nRuns()-token['before'] if token['before'] != None else int(token['willRun'])
+        for i in range(nNew):
+            self.loops.append({'what':token['what'],'site':token['site'],'time':elapsed/nNew})
+            # The clock is filled by the first of the loops (if not, it is filled by a later one)
+            if i == 0 and token['clock'] != None and token['clock'].IsReady():
+                clock = token['clock'].GetValue()
+                self.loops[-1].update({'jit':clock[0]-token['start'],'first':clock[1]-token['start'],
+                                       'last':clock[2]-token['start'],'nEvents':int(clock[3])})
+
+    def Report(self):
+        '''Print the number of loops along with the time and call site of each.
+
+        Returns:
+            None
+        '''
+        self._findUntracked()
+        print ('%s event loop(s)%s'%(len(self.loops),' (strict mode)' if self.strict else ''))
+        print ('{:>4s} {:>10s} {:>10s}  {}'.format('','time','start','action'))
+        for i,l in enumerate(self.loops):
+            print ('{:>4d} {:>10s} {:>10s}  {} at {}'.format(i+1,'%.2f s'%l['time'] if l['time'] != None else '?',
+                    '%.2f s'%l['jit'] if 'jit' in l else '?',l['what'],l['site']))
+
+@contextmanager
+def WatchLoops(monitor,what,ptrs=None):
+    '''Same as LoopMonitor.Watch() but does nothing if `monitor` is None.
+
+    @param monitor (LoopMonitor): Monitor to use (or None).
+    @param what (str): Description of the action.
+    @param ptrs ([RResultPtr], optional): The results that will be accessed. Defaults to None.
+    '''
+    if monitor == None:
+        yield
+    else:
+        token = monitor.Start(what,ptrs)
+        try:
+            yield
+        finally:
+            monitor.Stop(token)
+
 def CompileCpp(blockcode,library=False):
     '''Compiles C++ code via the gInterpreter.
 
     A python string (the actual code) can be passed or a file name 
-    (the file will be opened and read). If a file is passed,
-    the C++ code can be compiled
-    as a library and if in the future the C++ script is older than the library,
-    then the library will be loaded instead.
+    (the file will be opened and read). The same code is only ever
+    declared once per process so it is safe to call this repeatedly with the same input.
+
+    If a file is passed, the C++ code can be compiled as a library (with ACLiC).
+    Libraries are stored in the TIMBER cache (see GetCacheDir()) under a hash of the contents
+    of the file (and the local headers it includes), the ROOT version, and the compiler flags.
+    So a library is only ever compiled once for the same code and can be shared by
+    all jobs using the same cache directory. The library is built (under a lock) from a copy of the
+    file kept next to it so that the paths recorded in its dictionary stay valid.
 
     @param blockcode (str): Either a block of C++ code or a file name to open.
     @param library (bool, optional): Compiles a library which can be later loaded
             to avoid compilation time. Defaults to False.
+
+    Returns:
+        bool: False if the interpreter failed to declare the code (True otherwise).
     '''
     if '-I"'+os.environ["TIMBERPATH"]+'"' not in ROOT.gSystem.GetIncludePath():
         ROOT.gInterpreter.AddIncludePath(os.environ["TIMBERPATH"])
@@ -248,37 +882,398 @@ def CompileCpp(blockcode,library=False):
     if not ROOT.gInterpreter.IsLibraryLoaded(os.environ["TIMBERPATH"]+'bin/libtimber/libtimber.so'):
         ROOT.gSystem.Load(os.environ["TIMBERPATH"]+'bin/libarchive/lib/libarchive.so')
         ROOT.gSystem.Load(os.environ["TIMBERPATH"]+'bin/libtimber/libtimber.so')
+        LoadFrameworkDictionary()
 
     if not library:
         if '\n' in blockcode or ';' in blockcode: # must be multiline string\
-            ROOT.gInterpreter.Declare(blockcode)
+            blockcode_str = blockcode
         else: # must be file name to compile
             if ('TIMBER/Framework/' in blockcode) and (os.environ['TIMBERPATH'] not in blockcode):
                 path = os.environ['TIMBERPATH']
             else:
                 path = ''
             blockcode_str = open(path+blockcode,'r').read()
-            ROOT.gInterpreter.Declare(blockcode_str)
+
+        codehash = ContentHash([blockcode_str])
+        if codehash in _compiledCode:
+            return True
+        DeclareHeadersFor(blockcode_str)
+        if not ROOT.gInterpreter.Declare(blockcode_str):
+            return False
+        _compiledCode.add(codehash)
+        _compiledLog.append({'code':blockcode_str})
     else:
-        if '.so' not in blockcode:
-            extension = blockcode.split('.')[-1]
-            lib_path = blockcode.replace('.'+extension,'_'+extension)+'.so'
-        else: 
-            lib_path = blockcode
-        
-        loaded = False
-        if os.path.exists(lib_path): # If library exists and is older than the cc file, just load
-            mod_time_lib = os.path.getmtime(lib_path)
-            mod_time_cc = os.path.getmtime(blockcode)
-            if mod_time_lib > mod_time_cc:
+        if '.so' in blockcode:
+            ROOT.gSystem.Load(blockcode)
+            _compiledLog.append({'library':os.path.abspath(blockcode)})
+            return True
+
+        # The include directories themselves are not hashed (they depend on the working directory and
+        # on what was compiled before), only the contents of the local headers found through them
+        includeDirs = [os.getcwd(),os.path.dirname(os.path.abspath(blockcode))]
+        codehash = ContentHash([ROOT.gROOT.GetVersion(),ROOT.gSystem.GetFlagsOpt(),blockcode.split('/')[-1]]+
+                               ReadSourceFiles(blockcode,includeDirs=includeDirs+[os.environ['TIMBERPATH']]))
+        if codehash in _compiledCode:
+            return True
+        src_name = blockcode.split('/')[-1]
+        extension = src_name.split('.')[-1]
+        lib_name = src_name.replace('.'+extension,'_'+extension)+'.so'
+        lib_dir = GetCacheDir('libs')+codehash+'/'
+
+        with CacheLock(lib_dir[:-1]): # other jobs wait until the library is built
+            if os.path.exists(lib_dir+lib_name+'.done'):
                 print ('Loading library...')
-                ROOT.gSystem.Load(lib_path)
-                loaded = True
-        
-        if not loaded: # Else compile a new lib
-            ROOT.gSystem.AddIncludePath(" -I%s "%os.getcwd())
-            print ('Compiling library...')
-            ROOT.gROOT.ProcessLine(".L "+blockcode+"+")
+            else:
+                print ('Compiling library...')
+                if not os.path.isdir(lib_dir): os.makedirs(lib_dir)
+                with open(lib_dir+src_name,'w') as f:
+                    f.write(open(blockcode,'r').read())
+                for d in includeDirs:
+                    if d not in ROOT.gSystem.GetIncludePath():
+                        ROOT.gSystem.AddIncludePath(" -I%s "%d)
+                if not ROOT.gSystem.CompileMacro(lib_dir+src_name,'kc-','',lib_dir):
+                    raise RuntimeError('Failed to compile %s'%blockcode)
+                open(lib_dir+lib_name+'.done','w').close()
+
+        ROOT.gSystem.Load(lib_dir+lib_name)
+        _compiledCode.add(codehash)
+        _compiledLog.append({'library':os.path.abspath(blockcode)})
+    return True
+
+def GetCompiledCode():
+    '''Get the C++ code blocks (and libraries) given to CompileCpp() in this process, in order.
+
+    Returns:
+        list(dict): Each entry is either `{"code": <C++ code>}` or `{"library": <path to source or .so file>}`.
+    '''
+    return [dict(c) for c in _compiledLog]
+
+def GetCompiledCodeFor(code):
+    '''Get the entries of GetCompiledCode() needed by some C++ (ex. the Define and Cut strings
+    of an analysis graph). An entry is needed if it defines a namespace, class, struct, or function
+    used by the code or by another needed entry. Precompiled libraries (`.so`) cannot be inspected
+    and are always included. Blocks that only include headers are left out since those headers
+    are declared again when needed (see DeclareHeadersFor()).
+
+    Paths inside TIMBERPATH (included headers and library sources) are made relative to it so that
+    the entries can be compiled again on another machine or installation.
+
+    @param code ([str]): C++ code (ex. Define and Cut strings).
+
+    Returns:
+        list(dict): Needed entries, in the order they were compiled.
+    '''
+    timberpath = os.environ['TIMBERPATH']
+    out = []
+    for c,text in _neededCompiled(code):
+        if 'library' in c:
+            lib = c['library']
+            out.append({'library':lib[len(timberpath):] if lib.startswith(timberpath) else lib})
+        else:
+            out.append({'code':c['code'].replace('"'+timberpath,'"')})
+    return out
+
+def _neededCompiled(code):
+    '''Find the entries of the compilation log needed by some C++ (see GetCompiledCodeFor()).
+
+    @param code ([str]): C++ code.
+
+    Returns:
+        list(tuple(dict,str)): Needed entries and their code (None for `.so` libraries), in the order they were compiled.
+    '''
+    entries = []
+    for c in _compiledLog:
+        if 'library' in c:
+            text = '\n'.join(ReadSourceFiles(c['library'])) if not c['library'].endswith('.so') else None
+        else:
+            text = c['code']
+        entries.append((c,text))
+
+    tokens = set(re.findall(r'[A-Za-z_]\w*','\n'.join(code)))
+    needed = [text == None for c,text in entries]
+    symbols = [_codeSymbols(text) if text != None else set() for c,text in entries]
+    changed = True
+    while changed:
+        changed = False
+        for i,(c,text) in enumerate(entries):
+            if not needed[i] and len(symbols[i] & tokens) > 0:
+                needed[i] = True
+                tokens.update(re.findall(r'[A-Za-z_]\w*',text))
+                changed = True
+    return [entries[i] for i in range(len(entries)) if needed[i]]
+
+def GetSourcesFor(code,scripts=[]):
+    '''Get the C++ that some code (ex. the Define and Cut strings of an analysis graph) depends on:
+    the blocks given to CompileCpp() that it needs (see GetCompiledCodeFor()) along with the local files
+    they include, the Framework headers it needs (the ones DeclareHeadersFor() would declare for it,
+    whether or not they are declared yet), and some extra files (ex. the scripts of Corrections).
+    Unlike GetCompiledSources(), code compiled in the process for other purposes is not included.
+
+    @param code ([str]): C++ code.
+    @param scripts ([str], optional): Paths to other C++ files the code depends on. Defaults to [].
+
+    Returns:
+        [str]: Code blocks and file contents, in order.
+    '''
+    sources, seen = [], []
+    for c,text in _neededCompiled(code):
+        if 'library' in c:
+            sources.append(c['library'])
+            sources.extend(ReadSourceFiles(c['library'],seen))
+        else:
+            sources.append(c['code'])
+            code = code+[c['code']]
+            for inc in re.findall(r'^\s*#include\s*"([^"]+)"',c['code'],re.M):
+                path = inc if os.path.isfile(inc) else os.environ['TIMBERPATH']+inc
+                sources.extend(ReadSourceFiles(path,seen))
+    for header in HeadersFor(code):
+        sources.extend(ReadSourceFiles(header,seen))
+    for script in scripts:
+        sources.extend(ReadSourceFiles(script,seen))
+    return sources
+
+def GetCompiledSources():
+    '''Get the C++ given to CompileCpp() in this process along with the contents
+    of the local files it includes (and the sources of the libraries).
+
+    Returns:
+        [str]: Code blocks and file contents, in order.
+    '''
+    sources = []
+    for c in _compiledLog:
+        if 'library' in c:
+            sources.append(c['library'])
+            sources.extend(ReadSourceFiles(c['library']))
+        else:
+            sources.append(c['code'])
+            for inc in re.findall(r'^\s*#include\s*"([^"]+)"',c['code'],re.M):
+                path = inc if os.path.isfile(inc) else os.environ['TIMBERPATH']+inc
+                sources.extend(ReadSourceFiles(path))
+    return sources
+
+def ReadSourceFiles(script,seen=None,includeDirs=[]):
+    '''Reads a C++ file and (recursively) the local headers it includes with `#include "..."`.
+    Useful to hash everything that a piece of C++ depends on.
+
+    @param script (str): Path to the file.
+    @param seen ([str], optional): For internal use. Files already read. Defaults to None.
+    @param includeDirs ([str], optional): Other directories to look for the headers in
+        (after the directory of the including file). Defaults to [].
+
+    Returns:
+        [str]: Contents of each file.
+    '''
+    if seen == None: seen = []
+    if script in seen or not os.path.isfile(script):
+        return []
+    seen.append(script)
+    contents = [open(script,'r').read()]
+    for inc in re.findall(r'^\s*#include\s*"([^"]+)"',contents[0],re.M):
+        for d in [os.path.dirname(script)]+list(includeDirs):
+            path = os.path.normpath(os.path.join(d,inc))
+            if os.path.isfile(path):
+                contents.extend(ReadSourceFiles(path,seen,includeDirs))
+                break
+    return contents
+
+_frameworkDictionaryMode = None # set once the dictionary is loaded
+
+def LoadFrameworkDictionary():
+    '''Load the dictionary of the `TIMBER/Framework` headers made by the optional `make dict`.
+    Called by CompileCpp() when libtimber is first loaded.
+
+    The headers are still declared with `#include` (see DeclareHeader()) so what is saved depends on
+    how ROOT was built (see GetFrameworkDictionaryMode()). If ROOT supports C++ modules
+    (`root-config --has-cxxmodules`), the dictionary is a module and cling imports the pre-parsed headers instead
+    of parsing them from source in every process. Otherwise, it only provides the class information
+    and autoloading of the dictionary and each header is still parsed from source when it is declared.
+
+    Not used if the environment variable `TIMBER_NO_DICT` is set (to anything but 0)
+    or if any header is newer than the dictionary (in which case `make dict` should be run again).
+
+    Returns:
+        bool: True if the dictionary was loaded.
+    '''
+    global _frameworkDictionaryMode
+    if os.environ.get('TIMBER_NO_DICT','0') not in ['','0']:
+        return False
+    libdir = os.environ["TIMBERPATH"]+'bin/libtimber/'
+    lib = libdir+'libtimber_dict.so'
+    if not os.path.exists(lib):
+        return False
+    if ROOT.gInterpreter.IsLibraryLoaded(lib):
+        return True
+
+    lib_time = os.path.getmtime(lib)
+    for h in os.listdir(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/'):
+        if os.path.getmtime(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/'+h) > lib_time:
+            print ('WARNING: %s is newer than %s. Parsing the headers from source instead. Run `make dict` to update.'%(h,lib))
+            return False
+
+    ROOT.gInterpreter.AddIncludePath(libdir)
+    ROOT.gSystem.AddDynamicPath(libdir)
+    if ROOT.gSystem.Load(lib) < 0:
+        return False
+    # rootcling only writes the module (named in the modulemap) when ROOT supports them
+    _frameworkDictionaryMode = 'module' if os.path.exists(libdir+'timber_dict.pcm') else 'dictionary'
+    return True
+
+def GetFrameworkDictionaryMode():
+    '''Get how the dictionary of the Framework headers was loaded (see LoadFrameworkDictionary()).
+
+    Returns:
+        str: "module" if the headers are imported pre-parsed, "dictionary" if only the class information
+            is loaded (the headers are parsed from source), or None if no dictionary was loaded.
+    '''
+    return _frameworkDictionaryMode
+
+# Framework headers waiting to be declared (path -> symbols) and those already declared (path -> seconds)
+_pendingHeaders = OrderedDict()
+_declaredHeaders = OrderedDict()
+_headerInfo = {} # path -> symbols and includes of every registered header
+_headerTimings = {} # not yet saved to the cache
+
+def _codeSymbols(code):
+    '''Find the namespaces, classes, structs, and top-level functions defined in some C++.
+
+    @param code (str): C++ code.
+
+    Returns:
+        set(str): Symbol names.
+    '''
+    symbols = set(re.findall(r'^\s*(?:namespace|class|struct)\s+(\w+)\s*(?:[:{]|$)',code,re.M))
+    symbols.update(re.findall(r'^(?:[\w:<>,]+[ \t\*&]+)+(\w+)\s*\(',code,re.M))
+    symbols.difference_update(['return','if','else','for','while','switch','new','delete'])
+    return symbols
+
+def _headerSymbols(header):
+    '''Find the namespaces, classes, structs, and top-level functions
+    defined in a C++ header along with the local headers it includes.
+
+    @param header (str): Path to the header.
+
+    Returns:
+        tuple(set(str),[str]): Symbol names and base names of the included headers.
+    '''
+    code = open(header,'r').read()
+    symbols = _codeSymbols(code)
+    includes = [i.split('/')[-1] for i in re.findall(r'^\s*#include\s*"([^"]+)"',code,re.M)]
+    return symbols, includes
+
+def RegisterLazyHeaders(headers):
+    '''Register C++ headers to be declared to the interpreter only once
+    code that uses them is compiled (see DeclareHeadersFor()). A header is needed
+    if the code references one of its namespaces, classes, structs, or top-level functions.
+
+    @param headers ([str]): Paths to the headers.
+    '''
+    for h in headers:
+        if h in _declaredHeaders or h in _pendingHeaders: continue
+        symbols, includes = _headerSymbols(h)
+        _pendingHeaders[h] = {'symbols':symbols,'includes':includes}
+        _headerInfo[h] = _pendingHeaders[h]
+
+def DeclareHeader(header):
+    '''Declare a C++ header to the interpreter (if not done already) and
+    record how long it took. The timings are also saved to the TIMBER cache (once, when the process exits)
+    so that the time saved by not declaring a header can be estimated in later runs.
+
+    @param header (str): Path to the header.
+    '''
+    if header in _declaredHeaders: return
+    info = _pendingHeaders.pop(header,{'includes':[]})
+    _declaredHeaders[header] = None
+    _markIncluded(info['includes'])
+    start = time.time()
+    CompileCpp('#include "%s"\n'%header)
+    _declaredHeaders[header] = time.time()-start
+    _headerTimings[header.split('/')[-1]] = _declaredHeaders[header]
+
+def _saveHeaderTimings():
+    '''Merge the header declaration times of this process into the ones saved
+    in the TIMBER cache (see DeclareHeader()). Called when the process exits.
+    '''
+    if len(_headerTimings) == 0: return
+    try:
+        timingfile = GetCacheDir('headers')+'declare_times.json'
+        with CacheLock(timingfile):
+            timing = OpenJSON(timingfile) if os.path.exists(timingfile) else {}
+            timing.update(_headerTimings)
+            WriteJSON(timing,timingfile)
+        _headerTimings.clear()
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+atexit.register(_saveHeaderTimings)
+
+def _markIncluded(basenames):
+    '''Mark pending headers that are pulled in by an `#include` as declared.
+
+    @param basenames ([str]): Base names of the included headers.
+    '''
+    for h in list(_pendingHeaders.keys()):
+        if h not in _pendingHeaders: continue # removed by a recursive call
+        if h.split('/')[-1] in basenames:
+            info = _pendingHeaders.pop(h)
+            _declaredHeaders[h] = None
+            _markIncluded(info['includes'])
+
+def DeclareHeadersFor(code):
+    '''Declare any headers registered with RegisterLazyHeaders() that are
+    needed by a block of C++ code (ex. a Define or Cut string) before it is compiled.
+
+    @param code (str): C++ code.
+    '''
+    if len(_pendingHeaders) == 0: return
+    _markIncluded([i.split('/')[-1] for i in re.findall(r'^\s*#include\s*[<"]([^>"]+)[>"]',code,re.M)])
+    tokens = set(re.findall(r'[A-Za-z_]\w*',re.sub(r'(?m)^\s*#.*$','',code)))
+    for h in list(_pendingHeaders.keys()):
+        if h in _pendingHeaders and len(_pendingHeaders[h]['symbols'] & tokens) > 0:
+            DeclareHeader(h)
+
+def HeadersFor(code):
+    '''Find the headers registered with RegisterLazyHeaders() that some C++ needs, using
+    the same rules as DeclareHeadersFor() but regardless of whether they are declared yet.
+
+    @param code ([str]): C++ code.
+
+    Returns:
+        [str]: Paths to the headers.
+    '''
+    code = '\n'.join(code)
+    included = [i.split('/')[-1] for i in re.findall(r'^\s*#include\s*[<"]([^>"]+)[>"]',code,re.M)]
+    tokens = set(re.findall(r'[A-Za-z_]\w*',re.sub(r'(?m)^\s*#.*$','',code)))
+    headers = []
+    for h in _headerInfo:
+        if h.split('/')[-1] in included or len(_headerInfo[h]['symbols'] & tokens) > 0:
+            headers.append(h)
+    # Headers included by the needed ones
+    i = 0
+    while i < len(headers):
+        for h in _headerInfo:
+            if h not in headers and h.split('/')[-1] in _headerInfo[headers[i]]['includes']:
+                headers.append(h)
+        i += 1
+    return headers
+
+def HeaderReport():
+    '''Summarize which registered headers have been declared and how long
+    they took along with which are still deferred and an estimate of the time saved
+    by not declaring them (based on timings from previous runs).
+
+    Returns:
+        dict: Dictionary with keys "declared" (OrderedDict of path to seconds, None if declared via an `#include`),
+            "deferred" (list of paths), and "saved" (estimated seconds, None if no timing is known).
+    '''
+    timingfile = GetCacheDir('headers')+'declare_times.json'
+    try:
+        timing = OpenJSON(timingfile) if os.path.exists(timingfile) else {}
+    except (IOError, OSError, ValueError):
+        timing = {}
+    known = [timing[h.split('/')[-1]] for h in _pendingHeaders if h.split('/')[-1] in timing]
+    return {'declared':OrderedDict(_declaredHeaders),
+            'deferred':list(_pendingHeaders.keys()),
+            'saved':sum(known) if len(known) > 0 else None}
 
 def OpenJSON(filename):
     '''Opens JSON file as a dictionary (accounting for unicode encoding)
@@ -646,4 +1641,72 @@ def GenerateHash(length=8):
     '''
     return ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for i in range(length))
 
+def ContentHash(parts,length=16):
+    '''Generate a deterministic hash from the contents of a list of strings.
+    Used internally to key information that is cached on disk.
+
+    @param parts ([str]): Strings to hash (order matters).
+    @param length (int, optional): Length of hash. Defaults to 16.
+
+    Returns:
+        str: Hash
+    '''
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(str(p).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:length]
+
+def GetCacheDir(subdir=''):
+    '''Get the directory where TIMBER caches information between runs, creating it if needed.
+    The location can be set with the `TIMBERCACHE` environment variable and
+    otherwise defaults to `$TIMBERPATH/.cache/`.
+
+    @param subdir (str, optional): Sub-directory of the cache to return. Defaults to ''.
+
+    Returns:
+        str: Path to the directory (with trailing slash).
+    '''
+    base = os.environ.get('TIMBERCACHE', os.environ["TIMBERPATH"]+'.cache/')
+    path = os.path.join(base,subdir,'')
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError: # could have been made by another process in the meantime
+            if not os.path.isdir(path): raise
+    return path
+
+@contextmanager
+def CacheLock(filename):
+    '''Context holding an exclusive lock on `<filename>.lock` so that processes sharing
+    the cache directory do not update the same file (or build the same library) at the same time.
+    Does nothing on systems without `fcntl`.
+
+    @param filename (str): File to lock.
+    '''
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(filename+'.lock','a') as f:
+        fcntl.flock(f.fileno(),fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(),fcntl.LOCK_UN)
+
+def WriteJSON(obj,filename):
+    '''Write an object to a JSON file. The file is written to a temporary
+    location first and then moved into place so that other processes reading
+    the same file never see it half-written.
+
+    @param obj (dict): Object to write.
+    @param filename (str): Output JSON file name.
+    '''
+    tmpname = '%s.%s.tmp'%(filename,GenerateHash())
+    with open(tmpname,'w') as f:
+        json.dump(obj,f)
+    os.rename(tmpname,filename)
+
 ## @}
\ No newline at end of file
@@ -0,0 +1,330 @@
+'''@addtogroup Parallel Parallel Tools (Parallel.py)
+Run the same analysis over shards of the input (groups of files or ranges of entries)
+in separate processes and merge the results. Each process is single threaded (implicit
+multi-threading is turned off in the workers even if it is on in the parent) so
+this does not rely on the Framework modules being thread-safe.
+@{
+'''
+import ROOT, multiprocessing, numbers, os, time
+from collections import OrderedDict
+from TIMBER.Analyzer import analyzer, HistGroup
+from TIMBER.Tools.Common import ExecuteCmd, Cutflow, CutflowTree, LoopMonitor
+
+class SnapshotRequest(object):
+    '''Stand-in for a snapshot to return from the build function given to ShardExecutor.Run().
+    Each shard writes its own file and the files are concatenated (in shard order) with hadd
+    into `outfilename` once all shards finish.
+    '''
+    def __init__(self,node,columns,outfilename,treename='Events'):
+        '''Constructor
+
+        @param node (Node): Node to snapshot.
+        @param columns ([str] or str): Columns to keep (see Node.Snapshot()).
+        @param outfilename (str): Name of the final, merged, output file.
+        @param treename (str, optional): Name of the output TTree. Defaults to 'Events'.
+        '''
+        self.node = node
+        self.columns = columns
+        self.outfilename = outfilename
+        self.treename = treename
+
+class ShardExecutor(object):
+    '''Split the input of an analysis into shards, run the same analysis over each
+    shard in a pool of processes, and merge the results so they match a single process run.
+
+    The analysis is described by a function (which must be defined at the top level of a module so
+    it can be sent to the other processes) that takes an analyzer, builds the graph of nodes,
+    and returns a dictionary of results. The supported results and how they are merged are:
+    - HistGroup or histogram (TH1 or a pointer to one): summed with `TH1::Add`,
+    - Cutflow (ex. from analyzer.BookCutflow()): added together,
+    - CutflowTree (ex. from analyzer.BookCutflowTree()): cutflow of each leaf added together (returned as a dict of Cutflows keyed by the key of the leaf, see NodePathKey()),
+    - dictionaries of numbers (ex. from CutflowDict()): summed per key,
+    - numbers (or pointers to them like from `Count()` or `Sum()`): summed,
+    - SnapshotRequest: per-shard files concatenated with hadd.
+
+    Results should be booked lazily by the function so that each shard only loops over its events once.
+
+    The worker processes are started fresh (not forked) so they do not inherit the threads and
+    interpreter state of the parent. As with any `spawn` multiprocessing, a script using ShardExecutor
+    must therefore call Run() under `if __name__ == '__main__':`.
+
+    Instead of a function, a graph description from analyzer.SaveGraph() (or the JSON file it was saved to)
+    can be given. The graph is then replayed in each shard and the booked HistGroups and snapshots are the results.
+
+    Ex.
+    ```
+    def build(a):
+        a.Cut('nJet','nJet > 1')
+        return {'hists': a.MakeHistsWithBinning({'Jet_pt0':('Jet_pt[0]','',50,0,500)}),
+                'cutflow': a.DataFrame.Count()}
+
+    results = ShardExecutor(['f1.root','f2.root'],nProcs=64).Run(build)
+    ```
+    '''
+    def __init__(self,fileName,nProcs=None,nShards=None,analyzerArgs={}):
+        '''Constructor
+
+        @param fileName (str, list(str)): Input as would be given to the analyzer.
+        @param nProcs (int, optional): Number of processes to use. Defaults to None in which case the number of CPUs is used.
+        @param nShards (int, optional): Number of shards. If less than or equal to the number of files, each shard is a
+                group of consecutive files. If more, the files are split into ranges of entries as well. Defaults to None
+                in which case the number of processes is used.
+        @param analyzerArgs (dict, optional): Extra keyword arguments for the analyzer of each shard. Defaults to {}.
+        '''
+        ## @var nProcs
+        # int
+        #
+        # Number of processes in the pool.
+        ## @var shards
+        # list(tuple)
+        #
+        # List of (files, entry range) for each shard. The entry range is None if the whole files are used.
+        ## @var genEventSumw
+        # float
+        #
+        # Sum of generated event weights over all shards (after Run()).
+        ## @var genEventCount
+        # int
+        #
+        # Number of generated events over all shards (after Run()).
+        ## @var shardTimes
+        # list(float)
+        #
+        # Time in seconds spent on each shard (after Run()).
+        self.nProcs = multiprocessing.cpu_count() if nProcs == None else nProcs
+        self._analyzerArgs = analyzerArgs
+        self._files = self._expandFiles(fileName)
+        self.shards = self._makeShards(self.nProcs if nShards == None else nShards)
+        self.genEventSumw = 0.0
+        self.genEventCount = 0
+        self.shardTimes = []
+
+    def _expandFiles(self,fileName):
+        '''Expand the input into a list of ROOT files in the same way as the analyzer.
+
+        @param fileName (str, list(str)): Input file, txt file, or list of either.
+
+        Returns:
+            list(str): ROOT file names.
+        '''
+        if isinstance(fileName,list):
+            files = []
+            for f in fileName:
+                files.extend(self._expandFiles(f))
+            return files
+        elif fileName.endswith('.txt'):
+            return self._expandFiles([l.strip() for l in open(fileName,'r').readlines() if l.strip() != ''])
+        else:
+            return [fileName]
+
+    def _makeShards(self,nShards):
+        '''Split the input into shards.
+
+        @param nShards (int): Number of shards.
+
+        Returns:
+            list(tuple): List of (files, entry range) per shard.
+        '''
+        nFiles = len(self._files)
+        if nShards <= nFiles:
+            shards = []
+            for i in range(nShards):
+                files = self._files[i*nFiles//nShards:(i+1)*nFiles//nShards]
+                shards.append((files,None))
+            return shards
+
+        # More shards than files so split each file into ranges of entries
+        eventsTreeName = self._analyzerArgs.get('eventsTreeName','Events')
+        nEntries = []
+        for f in self._files:
+            tempF = ROOT.TFile.Open(f,'READ')
+            nEntries.append(int(tempF.Get(eventsTreeName).GetEntries()))
+            tempF.Close()
+        total = sum(nEntries)
+        shards = []
+        for f,n in zip(self._files,nEntries):
+            nSplit = max(1,int(round(float(n)/total*nShards))) if total > 0 else 1
+            for i in range(nSplit):
+                shards.append(([f],(i*n//nSplit,(i+1)*n//nSplit)))
+        return shards
+
+    def Run(self,buildFunc):
+        '''Run the analysis described by `buildFunc` over all shards and merge the results.
+
+        @param buildFunc (function, dict, str): Top-level function taking an analyzer and returning a dict of results
+                or a graph description from analyzer.SaveGraph() (or the JSON file it was saved to).
+
+        Returns:
+            OrderedDict: Merged results with the same keys as those returned by `buildFunc`.
+        '''
+        start = time.time()
+        args = [(i,shard,buildFunc,self._analyzerArgs) for i,shard in enumerate(self.shards)]
+        # One shard per process so that no interpreter state is shared between shards.
+        # Forking would copy the ROOT thread pool (if any) which can deadlock, so spawn where possible.
+        context = multiprocessing.get_context('spawn') if hasattr(multiprocessing,'get_context') else multiprocessing
+        pool = context.Pool(min(self.nProcs,len(self.shards)),initializer=_initShard,maxtasksperchild=1)
+        try:
+            outs = pool.map(_runShard,args,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.genEventSumw = sum([o['genEventSumw'] for o in outs])
+        self.genEventCount = sum([o['genEventCount'] for o in outs])
+        self.shardTimes = [o['time'] for o in outs]
+
+        merged = OrderedDict()
+        for key in outs[0]['results']:
+            merged[key] = MergeResults(key,[o['results'][key] for o in outs])
+        print ('Ran %s shards with %s processes in %.2f s'%(len(self.shards),self.nProcs,time.time()-start))
+        return merged
+
+def _initShard():
+    '''Turn off implicit multi-threading in a worker process (before any analyzer is built)
+    so that each shard is single threaded and entry ranges (`Range()`) can be used.
+    '''
+    ROOT.ROOT.DisableImplicitMT()
+
+def _runShard(args):
+    '''Build and run the analysis for one shard (in its own process).
+
+    @param args (tuple): Shard index, (files, entry range), build function (or graph description), and analyzer arguments.
+
+    Raises:
+        TypeError: If a result of the build function is not supported.
+
+    Returns:
+        dict: Results (tagged with their type) along with genEventSumw, genEventCount, and the time taken.
+    '''
+    start = time.time()
+    idx, (files, entries), buildFunc, analyzerArgs = args
+    a = analyzer(files,**analyzerArgs)
+    out = {'genEventSumw':a.genEventSumw,'genEventCount':a.genEventCount}
+    if entries != None:
+        # Only count the generator information once per file
+        if entries[0] != 0:
+            out['genEventSumw'], out['genEventCount'] = 0.0, 0
+        rangeNode = a.BaseNode.Range(entries[0],entries[1])
+        rangeNode.parent = None # so that cutflows and base counts are for this shard only
+        # Watch the loops from the range so that the loop clock (see LoopMonitor) does not read past it
+        a.Loops = LoopMonitor(rangeNode.DataFrame,a.Loops.strict)
+        rangeNode.loops = a.Loops
+        a.BaseNode = rangeNode
+        a.AllNodes = [rangeNode]
+        a.SetActiveNode(rangeNode)
+
+    if callable(buildFunc):
+        results = buildFunc(a)
+    else:
+        results = a.ReplayGraph(buildFunc,bookSnapshots=False)
+        for key,r in results.items():
+            if isinstance(r,dict):
+                results[key] = SnapshotRequest(r['node'],r['columns'],r['outfilename'],r['treename'])
+    # Book all snapshots before any loop runs
+    for key,r in results.items():
+        if isinstance(r,SnapshotRequest):
+            shardfile = r.outfilename.replace('.root','_shard%s.root'%idx)
+            r.node.Snapshot(r.columns,shardfile,r.treename,lazy=True)
+            r.shardfile = shardfile
+
+    out['results'] = OrderedDict()
+    for key,r in results.items():
+        if isinstance(r,SnapshotRequest):
+            out['results'][key] = ('snapshot',r.shardfile,r.outfilename)
+        else:
+            out['results'][key] = TagResult(key,r)
+    # Make sure snapshots ran even if nothing else triggered the loop
+    for key,r in results.items():
+        if isinstance(r,SnapshotRequest) and not os.path.exists(r.shardfile):
+            a.BaseNode.DataFrame.Count().GetValue()
+    out['time'] = time.time()-start
+    return out
+
+def TagResult(key,r):
+    '''Materialize a result and convert it to a tuple tagged with its type
+    that can be sent between processes (or saved) and merged with MergeResults().
+
+    @param key (str): Key of the result (for error messages).
+    @param r: HistGroup, Cutflow, CutflowTree, histogram (or pointer to one), number (or pointer to one), or dict of numbers.
+
+    Raises:
+        TypeError: If the result type is not supported.
+
+    Returns:
+        tuple: Type ("histgroup", "cutflow", "cutflowtree", "dict", "hist", or "number") followed by the content.
+    '''
+    if isinstance(r,HistGroup):
+        hists, meta = OrderedDict(), {}
+        for name in r.keys():
+            h = r[name]
+            h.SetDirectory(0)
+            hists[name] = h
+            if name in r.item_meta: meta[name] = r.item_meta[name]
+        return ('histgroup',hists,meta)
+    elif isinstance(r,Cutflow):
+        return ('cutflow',r.ToDict())
+    elif isinstance(r,CutflowTree):
+        return ('cutflowtree',OrderedDict([(leaf,r.GetCutflow(leaf).ToDict()) for leaf in r.leaves]))
+    elif isinstance(r,dict):
+        return ('dict',OrderedDict([(k,v.GetValue() if hasattr(v,'GetValue') else v) for k,v in r.items()]))
+    val = r.GetValue() if hasattr(r,'GetValue') else r
+    if isinstance(val,ROOT.TH1):
+        val.SetDirectory(0)
+        return ('hist',val)
+    elif isinstance(val,numbers.Number):
+        return ('number',val)
+    raise TypeError('Result `%s` of type %s cannot be merged.'%(key,type(r)))
+
+def MergeResults(key,results):
+    '''Merge the tagged results (see TagResult()) of one key from several parts of the input.
+
+    @param key (str): Key of the result.
+    @param results (list): Tagged results from each part (in order).
+
+    Raises:
+        TypeError: If the results type is not supported.
+
+    Returns:
+        Merged result. None if there are no results (ex. no input was processed).
+    '''
+    if len(results) == 0:
+        return None
+    kind = results[0][0]
+    if kind == 'hist':
+        out = results[0][1].Clone()
+        out.SetDirectory(0)
+        for r in results[1:]:
+            out.Add(r[1])
+    elif kind == 'histgroup':
+        out = HistGroup(key)
+        for name in results[0][1]:
+            h = results[0][1][name].Clone()
+            h.SetDirectory(0)
+            for r in results[1:]:
+                h.Add(r[1][name])
+            out.Add(name,h,results[0][2][name] if name in results[0][2] else {})
+    elif kind == 'cutflow':
+        out = sum([Cutflow.FromDict(r[1]) for r in results])
+    elif kind == 'cutflowtree':
+        # Leaves are keyed by NodePathKey() so the same leaf has the same key in every part
+        out = OrderedDict()
+        for r in results:
+            for leaf in r[1]:
+                out[leaf] = out[leaf]+Cutflow.FromDict(r[1][leaf]) if leaf in out else Cutflow.FromDict(r[1][leaf])
+    elif kind == 'dict':
+        out = OrderedDict()
+        for r in results:
+            for k in r[1]:
+                out[k] = out[k]+r[1][k] if k in out else r[1][k]
+    elif kind == 'number':
+        out = sum([r[1] for r in results])
+    elif kind == 'snapshot':
+        outfilename = results[0][2]
+        ExecuteCmd('hadd -f %s %s'%(outfilename,' '.join([r[1] for r in results])))
+        ExecuteCmd('rm %s'%(' '.join([r[1] for r in results])))
+        out = outfilename
+    else:
+        raise TypeError('Result `%s` of type %s cannot be merged.'%(key,kind))
+    return out
+
+## @}
@@ -0,0 +1,470 @@
+'''@addtogroup ResultCache Result Cache (ResultCache.py)
+Store booked results (histograms, cutflows, and sums) on disk so that running an
+unchanged graph over unchanged inputs again returns them without running the event loop.
+Results are keyed by the content of the Nodes leading to them, the C++ those Nodes use
+(code given to CompileCpp(), Framework headers, and Correction scripts), and the size, modification time, and UUID of every input file.
+Use `python TIMBER/Utilities/CacheInspector.py` to inspect the cache from the command line.
+
+The cache can also process a growing dataset incrementally (see ResultCache.RunIncremental()).
+@{
+'''
+import ROOT, json, os, re, time
+from collections import OrderedDict
+from TIMBER.Analyzer import analyzer, HistGroup, MaterializeGroups, MultiHistPtr
+from TIMBER.Tools.Parallel import TagResult, MergeResults
+from TIMBER.Tools.Common import ContentHash, GetCacheDir, GetSourcesFor, OpenJSON, WriteJSON, Cutflow, GenerateHash
+
+class CachedValue(object):
+    '''Value read from the cache that stands in for the RResultPtr that would have been booked.'''
+    def __init__(self,value):
+        '''Constructor
+
+        @param value (float): Cached value.
+        '''
+        self._value = value
+
+    def GetValue(self):
+        '''Same as `RResultPtr::GetValue()`.
+
+        Returns:
+            float: Cached value.
+        '''
+        return self._value
+
+    def IsReady(self):
+        '''Same as `RResultPtr::IsReady()`.
+
+        Returns:
+            bool: Always True.
+        '''
+        return True
+
+class ResultCache(object):
+    '''On-disk cache of booked results with a least-recently-used eviction policy.
+
+    Results are booked through the cache instead of the analyzer. If an identical result
+    is in the cache, it is returned immediately (and no loop is needed for it). Otherwise, it is booked on the
+    analyzer as usual and written to the cache when Commit() is called (which runs the event loop if it has
+    not already run). Results that are not in the cache are all filled in one loop per analyzer.
+
+    Ex.
+    ```
+    cache = ResultCache()
+    a = analyzer('file.root')
+    a.Cut('nJet','nJet > 1')
+    hists = cache.MakeHistsWithBinning(a,{'Jet_pt0':('Jet_pt[0]','',50,0,500)})
+    cutflow = cache.BookCutflow(a)
+    cache.Commit()
+    ```
+    '''
+    def __init__(self,cachedir=None,maxSize=2000):
+        '''Constructor
+
+        @param cachedir (str, optional): Directory of the cache. Defaults to None in which case
+            `GetCacheDir('results')` is used.
+        @param maxSize (float, optional): Maximum size of the cache in MB. The least recently used
+            entries are removed when Commit() would make the cache larger. Defaults to 2000.
+        '''
+        ## @var cachedir
+        # str
+        #
+        # Directory of the cache.
+        ## @var maxSize
+        # float
+        #
+        # Maximum size of the cache in MB.
+        ## @var hits
+        # int
+        #
+        # Number of results returned from the cache.
+        ## @var misses
+        # int
+        #
+        # Number of results that had to be booked.
+        self.cachedir = GetCacheDir('results') if cachedir == None else os.path.join(cachedir,'')
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+
+    def _metaName(self,key):
+        return self.cachedir+key+'.json'
+
+    def _dataName(self,key):
+        return self.cachedir+key+'.root'
+
+    def GraphKey(self,a,node=None):
+        '''Key describing everything that the results on a Node depend on.
+
+        @param a (analyzer): Analyzer of the Node.
+        @param node (Node, optional): Node to describe. Defaults to None and the #ActiveNode is used.
+
+        Returns:
+            str: Key.
+        '''
+        node = a.ActiveNode if node == None else node
+        chain = []
+        while node != None:
+            chain.insert(0,node)
+            node = node.parent
+        # The base Node is identified by the inputs and not its (random) hash
+        inputs = [a._eventsTreeName]
+        for info in a._fileInfo:
+            inputs.extend([info['name'],info['size'],info['mtime'],info['uuid']])
+        key = ContentHash(inputs+[_codeFingerprint(a,[n.action for n in chain[1:] if n.op in ['Define','Filter']])])
+        for n in chain[1:]:
+            key = ContentHash([key,n.op,n.name,n.type,n.action])
+        return key
+
+    def _readMeta(self,key):
+        '''Get the description of a cached entry and mark it as used.
+
+        @param key (str): Key of the entry.
+
+        Returns:
+            dict: Description or None if not cached.
+        '''
+        metaname = self._metaName(key)
+        if not os.path.exists(metaname): return None
+        try:
+            meta = OpenJSON(metaname)
+        except ValueError: # corrupted - will be overwritten
+            return None
+        if meta['kind'] in ['hists','batch'] and not os.path.exists(self._dataName(key)):
+            return None
+        os.utime(metaname,None) # for LRU
+        return meta
+
+    def _lookup(self,key):
+        '''Same as _readMeta() but counted as a hit if found.
+
+        @param key (str): Key of the entry.
+
+        Returns:
+            dict: Description or None if not cached.
+        '''
+        meta = self._readMeta(key)
+        if meta != None: self.hits += 1
+        return meta
+
+    def MakeHistsWithBinning(self,a,histDict,name='',weight=None):
+        '''Same as analyzer.MakeHistsWithBinning() but cached.
+
+        @param a (analyzer): Analyzer to book on.
+        @param histDict ({str:tuple}): See analyzer.MakeHistsWithBinning().
+        @param name (str, optional): See analyzer.MakeHistsWithBinning(). Defaults to ''.
+        @param weight (str, optional): See analyzer.MakeHistsWithBinning(). Defaults to None.
+
+        Returns:
+            HistGroup: Histograms (already filled if they were cached).
+        '''
+        spec = sorted([(str(k),[str(x) for x in v]) for k,v in histDict.items()])
+        key = ContentHash([self.GraphKey(a),'hists',spec,name,weight])
+        meta = self._lookup(key)
+        if meta != None:
+            out = HistGroup(str(meta['name']))
+            out.loops = a.Loops
+            f = ROOT.TFile.Open(self._dataName(key))
+            for histkey in meta['keys']:
+                h = f.Get(str(histkey))
+                h.SetDirectory(0)
+                out.Add(str(histkey),h,meta['item_meta'][histkey])
+            f.Close()
+            return out
+
+        self.misses += 1
+        out = a.MakeHistsWithBinning(histDict,name,weight)
+        self._pending.append({'key':key,'kind':'hists','result':out,'desc':'%s: %s'%(out.name,', '.join(out.keys()))})
+        return out
+
+    def BookCutflow(self,a,weight=None,node=None,name='cutflow'):
+        '''Same as analyzer.BookCutflow() but cached.
+
+        @param a (analyzer): Analyzer to book on.
+        @param weight (str, optional): See analyzer.BookCutflow(). Defaults to None.
+        @param node (Node, optional): See analyzer.BookCutflow(). Defaults to None.
+        @param name (str, optional): See analyzer.BookCutflow(). Defaults to 'cutflow'.
+
+        Returns:
+            Cutflow: Cutflow (already filled if it was cached).
+        '''
+        key = ContentHash([self.GraphKey(a,node),'cutflow',weight,name])
+        meta = self._lookup(key)
+        if meta != None:
+            return Cutflow.FromDict(meta['result'])
+
+        self.misses += 1
+        out = a.BookCutflow(weight,node,name)
+        self._pending.append({'key':key,'kind':'cutflow','result':out,'desc':'%s (%s)'%(name,weight)})
+        return out
+
+    def Sum(self,a,column,node=None):
+        '''Sum of a column (ex. to count events or sum weights) but cached.
+
+        @param a (analyzer): Analyzer to book on.
+        @param column (str): Column to sum.
+        @param node (Node, optional): Node to sum on. Defaults to None and the #ActiveNode is used.
+
+        Returns:
+            RResultPtr or CachedValue: Use `GetValue()` to get the sum.
+        '''
+        node = a.ActiveNode if node == None else node
+        key = ContentHash([self.GraphKey(a,node),'sum',column])
+        meta = self._lookup(key)
+        if meta != None:
+            return CachedValue(meta['result'])
+
+        self.misses += 1
+        out = node.DataFrame.Sum(column)
+        self._pending.append({'key':key,'kind':'sum','result':out,'desc':'Sum(%s) on %s'%(column,node.name)})
+        return out
+
+    def Commit(self):
+        '''Fill the results that were not cached (running the event loops together
+        if needed) and write them to the cache. Then evict the least recently used entries
+        if the cache is larger than #maxSize.
+
+        Returns:
+            None
+        '''
+        ptrs = []
+        for p in self._pending:
+            if p['kind'] == 'hists':
+                for h in p['result'].items.values():
+                    if isinstance(h,ROOT.TH1) or h.IsReady(): continue
+                    if isinstance(h,MultiHistPtr): h = h.result # shared by several histograms
+                    if not any([h is q for q in ptrs]): ptrs.append(h)
+            elif p['kind'] == 'cutflow':
+                ptrs.extend(p['result'].GetPointers())
+            elif not p['result'].IsReady():
+                ptrs.append(p['result'])
+        if len(ptrs) > 0 and hasattr(ROOT.RDF,'RunGraphs'):
+            ROOT.RDF.RunGraphs(ptrs)
+        MaterializeGroups([p['result'] for p in self._pending if p['kind'] == 'hists'])
+
+        for p in self._pending:
+            meta = {'kind':p['kind'],'key':p['key'],'desc':p['desc'],'created':time.time()}
+            if p['kind'] == 'hists':
+                group = p['result']
+                tmpname = '%s.%s.tmp'%(self._dataName(p['key']),GenerateHash())
+                f = ROOT.TFile.Open(tmpname,'RECREATE')
+                f.cd()
+                for histkey in group.keys():
+                    group[histkey].Write(histkey)
+                f.Close()
+                os.rename(tmpname,self._dataName(p['key']))
+                meta.update({'name':group.name,'keys':group.keys(),
+                             'item_meta':dict([(k,group.item_meta.get(k,{})) for k in group.keys()])})
+            elif p['kind'] == 'cutflow':
+                meta['result'] = p['result'].ToDict()
+            else:
+                meta['result'] = p['result'].GetValue()
+            # Description is written last so that an entry is only found once complete
+            WriteJSON(meta,self._metaName(p['key']))
+        self._pending = []
+        self.Evict()
+
+    def RunIncremental(self,fileName,buildFunc,name,analyzerArgs={}):
+        '''Run an analysis over a dataset that grows over time (ex. a .txt list of files that is
+        appended to every week) while only processing the files that are new since the last time.
+
+        The results of each batch of files processed together are stored in the cache along with
+        the files (their name, size, modification time, and UUID) that contributed to them. When run again, the batches
+        whose files are all still part of the input (and unchanged) are reused, the files not covered
+        by them are processed in one new batch, and the results of all of the batches are merged.
+        A batch containing a file that was removed or changed is dropped and its other files are processed again.
+        If the analysis itself changes (the graph or the C++), everything is processed again.
+
+        Like for ShardExecutor.Run(), `buildFunc` takes an analyzer, books the results lazily, and returns them as a dictionary.
+        The supported results are those of TagResult() (HistGroups, Cutflows, CutflowTrees, histograms, numbers, and dictionaries of numbers).
+
+        @param fileName (str, list(str)): Input as would be given to the analyzer.
+        @param buildFunc (function): Function taking an analyzer and returning a dict of results.
+        @param name (str): Name of the analysis (to tell apart analyses with the same graph on different datasets in the cache).
+        @param analyzerArgs (dict, optional): Extra keyword arguments for the analyzer. Defaults to {}.
+
+        Returns:
+            OrderedDict: Merged results with the same keys as those returned by `buildFunc`.
+        '''
+        # Build the graph over the full input (no loop is run) to describe the analysis and the files
+        a = analyzer(fileName,**analyzerArgs)
+        results = buildFunc(a)
+        graph = a.SaveGraph()
+        actions = [n['action'] for n in graph['nodes'] if n['op'] in ['Define','Filter']]
+        graphKey = ContentHash([name,json.dumps(graph,sort_keys=True),_codeFingerprint(a,actions)]+list(results.keys()))
+        files = OrderedDict()
+        for info in a._fileInfo:
+            files[ContentHash([a._eventsTreeName,info['name'],info['size'],info['mtime'],info['uuid']])] = info['name']
+
+        ledgerKey = ContentHash(['incremental',graphKey])
+        ledger = self._readMeta(ledgerKey)
+        batches, covered = [], set()
+        for batchKey in (ledger['batches'] if ledger != None else []):
+            meta = self._readMeta(batchKey)
+            if meta != None and all([fp in files for fp in meta['files']]):
+                batches.append((batchKey,meta))
+                covered.update(meta['files'])
+        new = [fp for fp in files if fp not in covered]
+        print ('RunIncremental: %s files already processed in %s batches, %s new or changed files'%(len(covered),len(batches),len(new)))
+        self.hits += len(batches)
+
+        tagged = []
+        for batchKey,meta in batches:
+            tagged.append(self._readBatch(batchKey,meta))
+        if len(new) > 0:
+            self.misses += 1
+            b = analyzer([files[fp] for fp in new],**analyzerArgs)
+            newResults = buildFunc(b)
+            batch = OrderedDict([(k,TagResult(k,r)) for k,r in newResults.items()])
+            batchKey = ContentHash([graphKey]+new)
+            self._writeBatch(batchKey,batch,new,'%s (%s files)'%(name,len(new)))
+            batches.append((batchKey,None))
+            tagged.append(batch)
+
+        WriteJSON({'kind':'ledger','key':ledgerKey,'desc':'%s (%s batches, %s files)'%(name,len(batches),len(files)),
+                   'created':time.time(),'batches':[k for k,m in batches]},self._metaName(ledgerKey))
+        self.Evict()
+        return OrderedDict([(k,MergeResults(k,[t[k] for t in tagged])) for k in results.keys()])
+
+    def _writeBatch(self,key,tagged,files,desc):
+        '''Write the results of a batch of files to the cache.
+
+        @param key (str): Key of the batch.
+        @param tagged (OrderedDict): Results from TagResult().
+        @param files ([str]): Keys of the files of the batch.
+        @param desc (str): Description.
+        '''
+        tmpname = '%s.%s.tmp'%(self._dataName(key),GenerateHash())
+        f = ROOT.TFile.Open(tmpname,'RECREATE')
+        f.cd()
+        results, iobj = OrderedDict(), 0
+        for k,t in tagged.items():
+            if t[0] == 'hist':
+                t[1].Write('h%s'%iobj)
+                results[k] = ['hist','h%s'%iobj]
+                iobj += 1
+            elif t[0] == 'histgroup':
+                objs = []
+                for histkey,h in t[1].items():
+                    h.Write('h%s'%iobj)
+                    objs.append([histkey,'h%s'%iobj])
+                    iobj += 1
+                results[k] = ['histgroup',objs,t[2]]
+            else:
+                results[k] = list(t)
+        f.Close()
+        os.rename(tmpname,self._dataName(key))
+        WriteJSON({'kind':'batch','key':key,'desc':desc,'created':time.time(),'files':files,'results':results},self._metaName(key))
+
+    def _readBatch(self,key,meta):
+        '''Read the results of a batch of files written by _writeBatch().
+
+        @param key (str): Key of the batch.
+        @param meta (dict): Description of the batch.
+
+        Returns:
+            OrderedDict: Results in the format of TagResult().
+        '''
+        out = OrderedDict()
+        f = ROOT.TFile.Open(self._dataName(key))
+        for k,r in meta['results'].items():
+            if r[0] == 'hist':
+                h = f.Get(str(r[1]))
+                h.SetDirectory(0)
+                out[k] = ('hist',h)
+            elif r[0] == 'histgroup':
+                hists = OrderedDict()
+                for histkey,objname in r[1]:
+                    hists[str(histkey)] = f.Get(str(objname))
+                    hists[str(histkey)].SetDirectory(0)
+                out[k] = ('histgroup',hists,r[2])
+            else:
+                out[k] = tuple(r)
+        f.Close()
+        return out
+
+    def Entries(self):
+        '''List the cached entries, most recently used first.
+
+        Returns:
+            list(dict): Description of each entry with keys "key", "kind", "desc", "created", "used" (time), and "size" (bytes).
+        '''
+        entries = []
+        for fname in os.listdir(self.cachedir):
+            if not fname.endswith('.json'): continue
+            key = fname[:-len('.json')]
+            try:
+                meta = OpenJSON(self._metaName(key))
+            except ValueError:
+                continue
+            size = os.path.getsize(self._metaName(key))
+            if os.path.exists(self._dataName(key)):
+                size += os.path.getsize(self._dataName(key))
+            entries.append({'key':key,'kind':meta['kind'],'desc':meta['desc'],'created':meta['created'],
+                            'used':os.path.getmtime(self._metaName(key)),'size':size})
+        return sorted(entries,key=lambda e: e['used'],reverse=True)
+
+    def Size(self):
+        '''Total size of the cache.
+
+        Returns:
+            float: Size in MB.
+        '''
+        return sum([e['size'] for e in self.Entries()])/1e6
+
+    def Remove(self,key):
+        '''Remove an entry from the cache.
+
+        @param key (str): Key of the entry.
+        '''
+        for fname in [self._metaName(key),self._dataName(key)]:
+            if os.path.exists(fname): os.remove(fname)
+
+    def Evict(self,maxSize=None):
+        '''Remove the least recently used entries until the cache is smaller than `maxSize`.
+
+        @param maxSize (float, optional): Size in MB. Defaults to None and #maxSize is used.
+
+        Returns:
+            int: Number of entries removed.
+        '''
+        maxSize = self.maxSize if maxSize == None else maxSize
+        entries = self.Entries()
+        total = sum([e['size'] for e in entries])
+        nRemoved = 0
+        while total > maxSize*1e6 and len(entries) > 0:
+            e = entries.pop()
+            self.Remove(e['key'])
+            total -= e['size']
+            nRemoved += 1
+        return nRemoved
+
+    def Clear(self):
+        '''Remove all entries from the cache.
+
+        Returns:
+            int: Number of entries removed.
+        '''
+        return self.Evict(0)
+
+def _codeFingerprint(a,actions):
+    '''Hash of the C++ that some Define and Cut strings depend on (see GetSourcesFor()),
+    including the scripts of the Corrections of the analyzer they call.
+    Code compiled in the process for anything else does not change the hash.
+
+    @param a (analyzer): Analyzer the strings belong to.
+    @param actions ([str]): Define and Cut strings.
+
+    Returns:
+        str: Hash.
+    '''
+    tokens = set(re.findall(r'[A-Za-z_]\w*','\n'.join(actions)))
+    scripts = []
+    for c in a.Corrections.values():
+        if not c.existing and c._objectName in tokens:
+            scripts.append(c._script)
+    return ContentHash(GetSourcesFor(actions,scripts))
+
+## @}
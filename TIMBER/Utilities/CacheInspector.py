@@ -0,0 +1,56 @@
+#####################################################################################################
+# Name: CacheInspector.py                                                                           #
+# Description: Lists, evicts, and clears the entries of the TIMBER result cache                      #
+#     (see TIMBER/Tools/ResultCache.py). Entries are listed most recently used first.               #
+#####################################################################################################
+
+import time
+from optparse import OptionParser
+from TIMBER.Tools.ResultCache import ResultCache
+from TIMBER.Tools.Common import OpenJSON
+
+parser = OptionParser(usage="usage: %prog [options]")
+
+parser.add_option('-d', '--dir', metavar='DIR', type='string', action='store',
+                default   =   None,
+                dest      =   'dir',
+                help      =   'Cache directory. Defaults to the "results" directory of the TIMBER cache.')
+parser.add_option('--show', metavar='KEY', type='string', action='store',
+                default   =   '',
+                dest      =   'show',
+                help      =   'Print the full description of one entry.')
+parser.add_option('--remove', metavar='KEY', type='string', action='store',
+                default   =   '',
+                dest      =   'remove',
+                help      =   'Remove one entry.')
+parser.add_option('--evict', metavar='MB', type='float', action='store',
+                default   =   None,
+                dest      =   'evict',
+                help      =   'Remove the least recently used entries until the cache is smaller than this size (in MB).')
+parser.add_option('--clear', action='store_true',
+                default   =   False,
+                dest      =   'clear',
+                help      =   'Remove all entries.')
+
+(options, args) = parser.parse_args()
+
+cache = ResultCache(options.dir)
+
+if options.show != '':
+    meta = OpenJSON(cache.cachedir+options.show+'.json')
+    for k in sorted(meta.keys()):
+        print ('%s: %s'%(k,meta[k]))
+elif options.remove != '':
+    cache.Remove(options.remove)
+    print ('Removed %s'%options.remove)
+elif options.clear:
+    print ('Removed %s entries'%cache.Clear())
+elif options.evict != None:
+    print ('Removed %s entries'%cache.Evict(options.evict))
+else:
+    entries = cache.Entries()
+    print ('%s entries (%.2f MB) in %s'%(len(entries),sum([e['size'] for e in entries])/1e6,cache.cachedir))
+    print ('{:16s} {:8s} {:>10s} {:>20s}  {}'.format('key','kind','size [kB]','last used','description'))
+    for e in entries:
+        print ('{:16s} {:8s} {:>10.1f} {:>20s}  {}'.format(e['key'],e['kind'],e['size']/1e3,
+               time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(e['used'])),e['desc']))
@@ -0,0 +1,78 @@
+'''Per-event time and heap allocations of CalibrateVars() with one Define per calibrated
+column (`fused=False`, MultiHadamardProduct/HadamardProduct) and with the generated kernel
+which fills all of them in one loop (`fused=True`). The input is a synthetic NanoAOD-like file
+with a `Jet` collection and the calibrations are made from `test/test_calib.cc`.
+
+Each measurement is a fresh python process. The event loop is run once to compile everything
+and then again (with already compiled actions) to measure. Allocations are counted by preloading
+a small library which wraps malloc/realloc (skipped if it cannot be compiled with `cc`).'''
+import os, subprocess, sys
+
+nEvents = 200000
+nCalibs = 3
+infile = '/tmp/timber_calibration_bench.root'
+counter = '/tmp/timber_bench_mallocs.so'
+
+if not os.path.exists(infile):
+    import ROOT
+    df = ROOT.RDataFrame(nEvents).Define('nJet','int(gRandom->Poisson(6))')
+    for attr in ['pt','eta','mass']:
+        df = df.Define('Jet_'+attr,'ROOT::VecOps::RVec<float> v(nJet); for (auto& x : v) x = gRandom->Exp(100.); return v;')
+    df.Snapshot('Events',infile,['nJet','Jet_pt','Jet_eta','Jet_mass'])
+
+counterCode = '''
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stddef.h>
+static unsigned long long nAllocs = 0;
+void* malloc(size_t size) {
+    static void* (*real)(size_t) = 0;
+    if (!real) real = (void* (*)(size_t))dlsym(RTLD_NEXT,"malloc");
+    __sync_fetch_and_add(&nAllocs,1);
+    return real(size);
+}
+void* realloc(void* p, size_t size) {
+    static void* (*real)(void*,size_t) = 0;
+    if (!real) real = (void* (*)(void*,size_t))dlsym(RTLD_NEXT,"realloc");
+    __sync_fetch_and_add(&nAllocs,1);
+    return real(p,size);
+}
+unsigned long long timber_bench_mallocs() { return nAllocs; }
+'''
+if not os.path.exists(counter):
+    with open(counter.replace('.so','.c'),'w') as f:
+        f.write(counterCode)
+    if subprocess.call(['cc','-shared','-fPIC','-O2','-o',counter,counter.replace('.so','.c'),'-ldl']) != 0:
+        print ('Could not compile the allocation counter. Allocations will not be counted.')
+        counter = None
+
+script = '''
+import time, ROOT
+from TIMBER.Analyzer import analyzer, Calibration
+counting = %s
+if counting: ROOT.gInterpreter.Declare('extern "C" unsigned long long timber_bench_mallocs();')
+a = analyzer('%s')
+calibs = [Calibration('benchCalib%%s'%%i,'test/test_calib.cc',[1.0+0.01*i,0.02],corrtype='weight') for i in range(%s)]
+a.CalibrateVars({'Jet_pt':calibs,'Jet_mass':calibs},dict([(c,{'pt':'Jet_pt'}) for c in calibs]),'CalibratedJets',fused=%s)
+cols = [c for c in a.GetColumnNames() if c.startswith('Jet_pt_') or c.startswith('Jet_mass_')]
+[a.DataFrame.Sum(c) for c in cols][0].GetValue() # compile and warm up
+sums = [a.DataFrame.Sum['ROOT::VecOps::RVec<float>'](c) for c in cols]
+allocs = ROOT.timber_bench_mallocs() if counting else 0
+start = time.time()
+sums[0].GetValue()
+seconds = time.time()-start
+allocs = ROOT.timber_bench_mallocs()-allocs if counting else -1
+print ('%%s %%s %%s'%%(len(cols),seconds,allocs))
+'''
+
+for label,fused in [('one Define per column','False'),('fused kernel','True')]:
+    env = dict(os.environ)
+    if counter != None: env['LD_PRELOAD'] = counter
+    times, allocs = [], []
+    for i in range(3):
+        out = subprocess.check_output([sys.executable,'-c',script%(counter != None,infile,nCalibs,fused)],env=env)
+        nCols, seconds, nAllocs = out.decode('utf-8').strip().split('\n')[-1].split()
+        times.append(float(seconds))
+        allocs.append(int(nAllocs))
+    print ('%s (%s columns): %.0f ns/event, %s allocations/event'%(label,nCols,1e9*min(times)/nEvents,
+            '%.1f'%(float(min(allocs))/nEvents) if counter != None else 'n/a'))
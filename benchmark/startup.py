@@ -0,0 +1,32 @@
+'''Cold start-up time of the interpreter with and without the dictionary
+of the TIMBER/Framework headers (built with `make dict`). Each measurement
+is a fresh python process that declares all of the Framework headers.
+The headers are only imported pre-parsed if ROOT supports C++ modules so the mode
+of the dictionary that was loaded is reported with each measurement
+(see LoadFrameworkDictionary()).'''
+import os, subprocess, sys, time
+
+nRepeat = 5
+script = '''
+import time
+start = time.time()
+from TIMBER.Analyzer import analyzer
+from TIMBER.Tools.Common import GetFrameworkDictionaryMode
+a = analyzer('examples/GluGluToHToTauTau.root',lazyHeaders=False)
+print ('%s %s'%(time.time() - start, GetFrameworkDictionaryMode()))
+'''
+
+if not os.path.exists(os.environ['TIMBERPATH']+'bin/libtimber/libtimber_dict.so'):
+    print ('No dictionary found. Run `make dict` first.')
+    sys.exit(1)
+
+for label,nodict in [('source headers','1'),('dictionary','0')]:
+    env = dict(os.environ)
+    env['TIMBER_NO_DICT'] = nodict
+    times, modes = [], set()
+    for i in range(nRepeat):
+        out = subprocess.check_output([sys.executable,'-c',script],env=env)
+        t, mode = out.decode('utf-8').strip().split('\n')[-1].split()
+        times.append(float(t))
+        modes.add(mode)
+    print ('%s (loaded: %s): %s secs (min %s secs over %s processes)'%(label,', '.join(sorted(modes)),sum(times)/len(times),min(times),nRepeat))
@@ -0,0 +1,60 @@
+'''Per-event time of SubCollection() and ReorderCollection() with one Define per
+attribute (`fused=False`) and with the generated kernel which slices all of the
+attributes in one loop (`fused=True`). The input is a synthetic NanoAOD-like file with
+`Jet` and `FatJet` collections. Each measurement is a fresh python process
+which sums either every attribute of the new collections (so all of them are evaluated)
+or only a few of them (where the fused kernel still reads and copies all of the attributes).'''
+import os, subprocess, sys
+
+nEvents = 200000
+nRepeat = 3
+infile = '/tmp/timber_subcollection_bench.root'
+
+attributes = {
+    'Jet': (6,['pt','eta','phi','mass','btagDeepB','btagDeepFlavB','chEmEF','chHEF','neEmEF','neHEF','qgl','rawFactor'],['jetId','puId']),
+    'FatJet': (3,['pt','eta','phi','mass','msoftdrop','tau1','tau2','tau3','tau4','n2b1','n3b1','btagHbb','deepTag_TvsQCD','deepTag_WvsQCD','rawFactor'],['jetId','subJetIdx1'])
+}
+
+if not os.path.exists(infile):
+    import ROOT
+    df = ROOT.RDataFrame(nEvents)
+    columns = []
+    for coll in attributes:
+        mean, floats, ints = attributes[coll]
+        df = df.Define('n'+coll,'int(gRandom->Poisson(%s))'%mean)
+        columns.append('n'+coll)
+        for attr in floats:
+            df = df.Define(coll+'_'+attr,'ROOT::VecOps::RVec<float> v(n%s); for (auto& x : v) x = gRandom->Exp(100.); return v;'%coll)
+            columns.append(coll+'_'+attr)
+        for attr in ints:
+            df = df.Define(coll+'_'+attr,'ROOT::VecOps::RVec<int> v(n%s); for (auto& x : v) x = gRandom->Integer(8); return v;'%coll)
+            columns.append(coll+'_'+attr)
+    df.Snapshot('Events',infile,columns)
+
+script = '''
+import time
+from TIMBER.Analyzer import analyzer
+a = analyzer('%s')
+start = time.time()
+a.SubCollection('GoodJets','Jet','Jet_pt > 30 && Jet_jetId > 1',fused=%s)
+a.Define('FatJet_order','ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(FatJet_msoftdrop))')
+a.ReorderCollection('SortedFatJets','FatJet','FatJet_order',fused=%s)
+sums = [a.DataFrame.Define('sum%%s'%%i,'Sum(%%s)'%%c).Sum('sum%%s'%%i) for i,c in enumerate(%s)]
+booked = time.time()
+sums[0].GetValue()
+print ('%%s %%s'%%(booked-start,time.time()-booked))
+'''
+
+used = [('all attributes used',"[c for c in a.GetColumnNames() if c.startswith('GoodJets_') or c.startswith('SortedFatJets_')]"),
+        ('few attributes used',"['GoodJets_pt','GoodJets_eta','SortedFatJets_msoftdrop']")]
+
+for usedLabel,columns in used:
+    for label,fused in [('one Define per attribute','False'),('fused kernel','True')]:
+        book, loop = [], []
+        for i in range(nRepeat):
+            out = subprocess.check_output([sys.executable,'-c',script%(infile,fused,fused,columns)])
+            b, l = [float(t) for t in out.decode('utf-8').strip().split('\n')[-1].split()]
+            book.append(b)
+            loop.append(l)
+        print ('%s, %s: booking %.2f secs, event loop (incl. JIT) %.2f secs = %.2f us/event (min over %s processes)'%(
+                usedLabel,label,min(book),min(loop),1e6*min(loop)/nEvents,nRepeat))
@@ -1,7 +1,7 @@
-import ROOT, os
+import ROOT, os, pytest
 ROOT.gROOT.SetBatch(True)
 from TIMBER.Analyzer import *
-from TIMBER.Tools.Common import CompileCpp
+from TIMBER.Tools.Common import CompileCpp, HeaderReport, NodePathKey
 
 class TestAnalyzer():
     @classmethod
@@ -63,6 +63,12 @@ class TestAnalyzer():
         assert self.a.GetWeightName(c,'up','') == 'weight__test_weight_up'
         self.a.DrawTemplates(hgroup, './')
 
+    def test_FuncInfoCache(self):
+        c1 = Correction('test_weight_cache1','test/test_weight.cc')
+        c2 = Correction('test_weight_cache2','test/test_weight.cc')
+        assert c1._funcInfo == c2._funcInfo
+        assert c1._script == c2._script
+
     def test_CommonVars(self):
         assert sorted(self.a.CommonVars(["Muon","Tau"])) == sorted(['phi', 'pt', 'charge', 'eta', 'mass', 'genPartIdx', 'jetIdx'])
         pass
@@ -115,6 +121,426 @@ def test_Groups():
     rep = a.DataFrame.Report()
     rep.Print()
 
+def test_ParallelOpen():
+    single = analyzer('examples/GluGluToHToTauTau.root',openThreads=1)
+    double = analyzer(['examples/GluGluToHToTauTau.root','examples/GluGluToHToTauTau.root'],openThreads=2)
+    assert double.DataFrame.Count().GetValue() == 2*single.DataFrame.Count().GetValue()
+    double.PrintFileReport()
+
+def test_MetadataCache():
+    first = analyzer('examples/GluGluToHToTauTau.root')
+    second = analyzer('examples/GluGluToHToTauTau.root')
+    assert second._fileInfo[0]['cached']
+    assert second._fileInfo[0]['nEvents'] == first._fileInfo[0]['nEvents']
+    assert second.genEventSumw == first.genEventSumw
+    uncached = analyzer('examples/GluGluToHToTauTau.root',cacheMetadata=False)
+    assert not uncached._fileInfo[0]['cached']
+
+def test_SumBranches():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    assert a.GetRunsSums() == {}
+    assert a.GetMultiSampleSums() == {}
+    f = ROOT.TFile.Open('examples/GluGluToHToTauTau.root')
+    t = f.Get('Events')
+    branches = ROOT.std.vector('std::string')()
+    branches.push_back('nJet')
+    branches.push_back('run')
+    sums = ROOT.hardware.SumBranches(t,branches)
+    assert sums[0] == a.DataFrame.Sum('nJet').GetValue()
+    assert sums[1] == a.DataFrame.Sum('run').GetValue()
+    f.Close()
+
+def test_LazyHeaders():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    assert os.environ['TIMBERPATH']+'TIMBER/Framework/include/common.h' in HeaderReport()['declared']
+    CompileCpp('LumiFilter *test_lumifilter_ptr = nullptr;')
+    lumi = os.environ['TIMBERPATH']+'TIMBER/Framework/include/LumiFilter.h'
+    assert lumi in HeaderReport()['declared']
+    assert lumi not in HeaderReport()['deferred']
+    a.PrintHeaderReport()
+
+def _shard_build(a):
+    a.Cut('test_cut','nJet > 0')
+    return {'count':a.DataFrame.Count(),
+            'hists':a.MakeHistsWithBinning({'Jet_pt':('Jet_pt','',50,0,500)})}
+
+def test_ShardExecutor():
+    from TIMBER.Tools.Parallel import ShardExecutor
+    single = _shard_build(analyzer('examples/GluGluToHToTauTau.root'))
+    merged = ShardExecutor(['examples/GluGluToHToTauTau.root']*2,nProcs=2).Run(_shard_build)
+    assert merged['count'] == 2*single['count'].GetValue()
+    assert merged['hists']['Jet_pt'].GetEntries() == 2*single['hists']['Jet_pt'].GetEntries()
+    split = ShardExecutor('examples/GluGluToHToTauTau.root',nProcs=2,nShards=4).Run(_shard_build)
+    assert split['count'] == single['count'].GetValue()
+
+def test_ShardExecutorCutflowTree():
+    from TIMBER.Tools.Parallel import ShardExecutor
+    single = _tree_build(analyzer('examples/GluGluToHToTauTau.root'))['tree']
+    merged = ShardExecutor(['examples/GluGluToHToTauTau.root']*2,nProcs=2).Run(_tree_build)['tree']
+    assert list(merged.keys()) == list(single.leaves.keys())
+    for leaf in single.leaves:
+        name = single.leaves[leaf]['name']
+        assert merged[leaf][name] == 2*single.GetCutflow(leaf)[name]
+
+def test_ShardExecutorImplicitMT():
+    from TIMBER.Tools.Parallel import ShardExecutor
+    single = _shard_build(analyzer('examples/GluGluToHToTauTau.root'))
+    single = (single['count'].GetValue(), single['hists']['Jet_pt'].GetEntries())
+    ROOT.ROOT.EnableImplicitMT(2)
+    try:
+        split = ShardExecutor('examples/GluGluToHToTauTau.root',nProcs=2,nShards=4).Run(_shard_build)
+    finally:
+        ROOT.ROOT.DisableImplicitMT()
+    assert (split['count'], split['hists']['Jet_pt'].GetEntries()) == single
+
+def test_SaveReplayGraph():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Cut('graph_cut','nJet > 1')
+    a.Define('graph_pt0','Jet_pt[0]')
+    hists = a.MakeHistsWithBinning({'graph_pt0':('graph_pt0','',50,0,500)},name='graph_hists')
+    graph = a.SaveGraph('test_graph.json')
+    assert not any(os.environ['TIMBERPATH'] in code for code in graph['cpp'])
+
+    b = analyzer('examples/GluGluToHToTauTau.root')
+    out = b.ReplayGraph('test_graph.json')
+    assert b.GetTrackedNodeNames() == a.GetTrackedNodeNames()
+    assert b.ActiveNode.name == 'graph_pt0'
+    assert out['graph_hists']['graph_pt0_graph_hists'].GetEntries() == hists['graph_pt0_graph_hists'].GetEntries()
+
+def test_RunAll():
+    analyzers, groups = [], []
+    for i in range(2):
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Cut('runall_cut','nJet > 0')
+        groups.append(a.MakeHistsWithBinning({'Jet_pt':('Jet_pt','',50,0,500)}))
+        analyzers.append(a)
+    report = RunAll(analyzers)
+    assert len(report) == 2
+    for a,g in zip(analyzers,groups):
+        assert g['Jet_pt_runall_cut'].GetEntries() > 0
+        assert a.DataFrame.GetNRuns() == 1 # histograms were filled by RunAll
+    for r in report:
+        assert 0 <= r['first'] <= r['time'] # from the start of the loops (including the JIT)
+    assert report[0]['nEvents'] == analyzers[0].BaseNode.DataFrame.Count().GetValue()
+
+def test_LoopAccounting():
+    a = analyzer('examples/GluGluToHToTauTau.root',strictLoops=True)
+    a.Cut('loops_cut','nJet > 0')
+    hists = a.MakeHistsWithBinning({'Jet_pt':('Jet_pt','',50,0,500),'Jet_eta':('Jet_eta','',50,-3,3)})
+    hists['Jet_pt_loops_cut']
+    hists['Jet_eta_loops_cut'] # filled in the same loop so no error
+    assert len(a.Loops.loops) == 1
+    assert 'test_Analyzer.py' in a.Loops.loops[0]['site']
+    loop = a.Loops.loops[0] # timed from the start of the watched code, including the JIT at loop start
+    assert 0 <= loop['jit'] <= loop['first'] <= loop['last'] <= loop['time']
+    assert loop['nEvents'] > 0
+
+    late = a.MakeHistsWithBinning({'nJet':('nJet','',10,0,10)})
+    with pytest.raises(RuntimeError):
+        late['nJet_loops_cut']
+    assert len(a.Loops.loops) == 1
+
+def test_NoInputFiles():
+    with pytest.raises(ValueError):
+        analyzer([])
+
+def test_MaterializeGroups():
+    analyzers, groups = [], []
+    for i in range(2):
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        groups.append(a.MakeHistsWithBinning({'Jet_pt':('Jet_pt','',50,0,500),'nJet':('nJet','',10,0,10)}))
+        analyzers.append(a)
+    stats = MaterializeGroups(groups)
+    assert stats['nHists'] == 4
+    assert stats['nLoops'] == 2
+    for a,g in zip(analyzers,groups):
+        assert a.DataFrame.GetNRuns() == 1
+        assert all([isinstance(g[k],ROOT.TH1) for k in g.keys()])
+    assert groups[0].Materialize()['nHists'] == 0
+
+def test_HistGroupDoTitles():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    group = HistGroup('titles')
+    group.Add('titles_pt',a.DataFrame.Histo1D(('titles_pt','',50,0,500),'Jet_pt'),{'xtitle':'Jet p_{T}','ytitle':'Jets'})
+    group.Add('titles_n',a.DataFrame.Histo1D(('titles_n','',10,0,10),'nJet'))
+    assert group.Do('Scale',(0.5,)) == None
+    assert group['titles_pt'].GetXaxis().GetTitle() == 'Jet p_{T}'
+    assert group['titles_pt'].GetYaxis().GetTitle() == 'Jets'
+    assert group['titles_n'].GetXaxis().GetTitle() == ''
+
+def test_CutflowTree():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Cut('tree_cut','nJet > 0')
+    nodes = a.Discriminate('tree_disc','nJet > 1')
+    a.SetActiveNode(nodes['fail'])
+    a.Cut('tree_fail_cut','Jet_pt[0] > 30')
+    tree = a.BookCutflowTree()
+    assert a.DataFrame.GetNRuns() == 0
+    cutflows = tree.AsDict()
+    assert a.DataFrame.GetNRuns() == 1
+    assert len(cutflows) == 2
+    byname = dict([(tree.leaves[h]['name'],cutflows[h]) for h in tree.leaves])
+    assert byname['tree_disc_pass']['tree_disc_pass']+byname['tree_fail_cut']['tree_disc_fail'] == byname['tree_fail_cut']['tree_cut']
+    a.PrintNodeTree('test_cutflow_tree.dot',cutflow=tree)
+
+def test_CutflowTreeSameNames():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    nodes = a.Discriminate('same_disc','nJet > 1')
+    leaves = [a.Cut('same_cut','nJet > 0 && Jet_pt[0] > 30',node=nodes[k]) for k in ['pass','fail']]
+    tree = a.BookCutflowTree(nodes=leaves)
+    cutflows = tree.AsDict()
+    assert len(cutflows) == 2 and [tree.leaves[h]['name'] for h in tree.leaves] == ['same_cut','same_cut']
+    assert tree.GetCutflow(leaves[0])['same_disc_pass'] == cutflows[NodePathKey(leaves[0])]['same_disc_pass']
+    assert sum([cutflows[NodePathKey(n)]['same_cut'] for n in leaves]) == a.BaseNode.DataFrame.Filter('nJet > 0 && Jet_pt[0] > 30').Count().GetValue()
+
+def _tree_build(a):
+    a.Cut('tree_merge_cut','nJet > 0')
+    a.Discriminate('tree_merge_disc','nJet > 1')
+    return {'tree':a.BookCutflowTree()}
+
+def test_CutflowTreeMerge():
+    from TIMBER.Tools.Parallel import TagResult, MergeResults
+    trees = [_tree_build(analyzer('examples/GluGluToHToTauTau.root'))['tree'] for i in range(2)]
+    assert list(trees[0].leaves.keys()) == list(trees[1].leaves.keys()) # same graph, same keys
+    merged = MergeResults('tree',[TagResult('tree',t) for t in trees])
+    for leaf in trees[0].leaves:
+        name = trees[0].leaves[leaf]['name']
+        assert merged[leaf][name] == 2*trees[0].GetCutflow(leaf)[name]
+
+def test_CutflowTreeShortLeaf():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    short = a.Define('short_leaf_n','nJet')
+    deep = a.Cut('short_leaf_cut','short_leaf_n > 0')
+    tree = a.BookCutflowTree(nodes=[short,deep]) # first chain is the shortest
+    assert tree.GetCutflow(deep)['short_leaf_cut'] <= tree.GetCutflow(short)['Initial']
+
+def test_NodeReuse():
+    from TIMBER.Analyzer import _nodeHash
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    first = a.Define('reuse_var','nJet*2')
+    nTracked = len(a.AllNodes)
+    second = a.Define('reuse_var','nJet*2',node=a.BaseNode)
+    assert first is second
+    assert len(a.AllNodes) == nTracked
+    cut = a.Cut('reuse_cut','reuse_var > 2')
+    assert a.Cut('reuse_cut','reuse_var > 2',node=first) is cut
+    assert a.Cut('reuse_cut2','reuse_var > 4',node=first) is not cut
+
+    b = analyzer('examples/GluGluToHToTauTau.root')
+    other = b.Define('reuse_var','nJet*2')
+    assert other.hash != first.hash # different base Nodes
+    assert other.hash == _nodeHash(b.BaseNode,'Define','reuse_var','Define','nJet*2')
+
+def test_ResultCache(tmpdir):
+    from TIMBER.Tools.ResultCache import ResultCache
+    cache = ResultCache(str(tmpdir))
+    results = []
+    for i in range(2):
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Cut('cache_cut','nJet > 0')
+        hists = cache.MakeHistsWithBinning(a,{'Jet_pt':('Jet_pt','',50,0,500)})
+        cutflow = cache.BookCutflow(a)
+        nJet = cache.Sum(a,'nJet')
+        cache.Commit()
+        results.append((hists.Merge().GetEntries(),cutflow['cache_cut'],nJet.GetValue()))
+    assert a.DataFrame.GetNRuns() == 0 # second time everything came from the cache
+    assert (cache.hits, cache.misses) == (3, 3)
+    assert results[0] == results[1]
+    assert len(cache.Entries()) == 3
+    assert cache.Clear() == 3
+
+def test_GraphKeyLocalCode(tmpdir):
+    from TIMBER.Tools.ResultCache import ResultCache
+    cache = ResultCache(str(tmpdir))
+    CompileCpp('int graphKeyHelper(int n) { return 2*n; }')
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Define('graph_key_var','graphKeyHelper(nJet)')
+    key = cache.GraphKey(a)
+    CompileCpp('int graphKeyUnrelated(int n) { return 3*n; }')
+    assert cache.GraphKey(a) == key # code the graph does not use is ignored
+    CompileCpp('int graphKeyHelper(float n) { return 4*n; }')
+    assert cache.GraphKey(a) != key # a new overload of a function it calls is not
+
+def _incremental_build(a):
+    a.Cut('incremental_cut','nJet > 0')
+    return {'hists':a.MakeHistsWithBinning({'nJet':('nJet','',10,0,10)}),
+            'cutflow':a.BookCutflow(),
+            'tree':a.BookCutflowTree()}
+
+def test_RunIncremental(tmpdir):
+    from TIMBER.Tools.ResultCache import ResultCache
+    cache = ResultCache(str(tmpdir))
+    first = cache.RunIncremental(['examples/GluGluToHToTauTau.root'],_incremental_build,'test')
+    assert cache.misses == 1
+    # The same file under another name stands in for a file added to the dataset
+    both = cache.RunIncremental(['examples/GluGluToHToTauTau.root','./examples/GluGluToHToTauTau.root'],_incremental_build,'test')
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert both['cutflow']['Initial'] == 2*first['cutflow']['Initial']
+    # A cached tree and a new one (from another analyzer) are merged on the same leaf keys
+    assert list(both['tree'].keys()) == list(first['tree'].keys())
+    for leaf in first['tree']:
+        assert both['tree'][leaf]['Initial'] == 2*first['tree'][leaf]['Initial']
+    # Removing the first file drops its batch but keeps the other
+    second = cache.RunIncremental(['./examples/GluGluToHToTauTau.root'],_incremental_build,'test')
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert second['cutflow'].AsDict() == first['cutflow'].AsDict()
+
+def test_MergeNoResults():
+    from TIMBER.Tools.Parallel import MergeResults
+    assert MergeResults('nothing',[]) == None
+
+def test_PruneBranches():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Cut('prune_cut','nJet > 0 && Jets[0].pt > 30') # the struct reads every Jet branch
+    a.Define('prune_lead_pt','Jets[0].pt')
+    hists = a.MakeHistsWithBinning({'Jet_eta':('Jet_eta','',50,-3,3)})
+    report = a.PruneBranches(narrowSnapshots=True)
+    assert set(report['used']) == set(['nJet','Jet_pt','Jet_eta'])
+    assert set(report['read']) > set(report['used'])
+    assert report['after'] < report['before']
+    assert hists['Jet_eta_prune_cut'].GetEntries() > 0
+    a.Snapshot('all','test_prune.root','Events',lazy=False)
+    f = ROOT.TFile.Open('test_prune.root')
+    assert set([b.GetName() for b in f.Get('Events').GetListOfBranches()]) == set(['nJet','Jet_pt','Jet_eta','prune_lead_pt'])
+    f.Close()
+
+def test_PrunedCollectionStruct():
+    a = analyzer('examples/GluGluToHToTauTau.root',pruneCollections=True)
+    a.Cut('pruned_struct_cut','Jets.size() > 0 && Jets[0].pt > 0')
+    built = a._collectionOrg.GetBuiltAttributes('Jet')
+    assert 'pt' in built
+    assert len(built) < len(a._collectionOrg.GetCollectionAttributes('Jet'))
+
+    b = analyzer('examples/GluGluToHToTauTau.root')
+    b.KeepCollectionAttributes('Jet')
+    b.Cut('full_struct_cut','Jets[0].pt > 0')
+    assert len(b._collectionOrg.GetBuiltAttributes('Jet')) > len(built)
+    assert a.DataFrame.Count().GetValue() == b.DataFrame.Count().GetValue()
+
+def test_CollectionStructLaterCorrection():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Cut('later_corr_cut','Jets.size() > 0 && Jets[0].pt > 0')
+    # Compiled after the struct was built and uses another attribute
+    c = Correction('later_corr_weight','test/test_weight.cc')
+    a.AddCorrection(c,{'pt':'Jets[0].eta'})
+    a.MakeWeightCols()
+    assert set(a._collectionOrg.GetBuiltAttributes('Jet')) == set(a._collectionOrg.GetCollectionAttributes('Jet'))
+    assert a.DataFrame.Sum('weight__nominal').GetValue() > 0
+
+def test_FusedSubCollection():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.SubCollection('FusedJets','Jet','Jet_pt > 20',fused=True)
+    a.SubCollection('SplitJets','Jet','Jet_pt > 20')
+    a.Define('Jet_etaOrder','ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(Jet_eta))')
+    a.ReorderCollection('FusedEtaJets','Jet','Jet_etaOrder',fused=True)
+    a.ReorderCollection('SplitEtaJets','Jet','Jet_etaOrder')
+    assert '__FusedJets_slice' in [str(c) for c in a.DataFrame.GetColumnNames()]
+    differ = a.Cut('fused_differ','nFusedJets != nSplitJets || Any(FusedJets_pt != SplitJets_pt) || Any(FusedJets_eta != SplitJets_eta) || Any(FusedEtaJets_eta != SplitEtaJets_eta) || Any(FusedEtaJets_eta != Take(Jet_eta,Jet_etaOrder))')
+    assert differ.DataFrame.Count().GetValue() == 0
+
+def test_ReorderCollection():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Define('Jet_etaOrder','ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(Jet_eta))')
+    a.ReorderCollection('SortedJets','Jet','Jet_etaOrder',skip=['btag'])
+    columns = [str(c) for c in a.DataFrame.GetColumnNames()]
+    assert 'SortedJets_pt' in columns
+    assert not any([c.startswith('SortedJets_btag') for c in columns])
+    # The order is applied with Take (not as a mask) so every jet is kept, reordered
+    differ = a.Cut('reorder_differ','nSortedJets != nJet || Any(SortedJets_eta != Take(Jet_eta,Jet_etaOrder)) || Any(SortedJets_pt != Take(Jet_pt,Jet_etaOrder))')
+    assert differ.DataFrame.Count().GetValue() == 0
+
+def test_FusedMergeCollections():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.MergeCollections('FusedLepton',['Muon','Tau'],originTag=True)
+    a.MergeCollections('SplitLepton',['Muon','Tau'],fused=False)
+    with pytest.raises(ValueError):
+        a.MergeCollections('TagLepton',['Muon','Tau'],fused=False,originTag=True)
+    differ = a.Cut('merge_differ','nFusedLepton != nSplitLepton || Any(FusedLepton_pt != SplitLepton_pt) || Any(FusedLepton_charge != SplitLepton_charge)'+
+                   ' || Sum(FusedLepton_origin == 0) != nMuon || (nTau > 0 && FusedLepton_collIdx[nMuon+nTau-1] != nTau-1)')
+    assert differ.DataFrame.Count().GetValue() == 0
+
+def test_BatchJit():
+    a = analyzer('examples/GluGluToHToTauTau.root',batchJit=True)
+    a.Cut('batch_cut','nJet > 1')
+    a.Define('batch_lead','Jet_pt[0]')
+    a.Define('batch_sum','batch_lead + Jet_pt[1]')
+    assert a.ActiveNode._df is None # waiting for the batch
+    batched = a.DataFrame.Sum('batch_sum').GetValue()
+    assert len(a.Jit.batches) == 1 and a.Jit.batches[0]['n'] == 3
+    assert list(a.Jit.times.keys()) == ['Cut','Define']
+    assert a.Jit.times['Define']['n'] == 2
+
+    b = analyzer('examples/GluGluToHToTauTau.root')
+    b.Cut('batch_cut','nJet > 1')
+    b.Define('batch_lead','Jet_pt[0]')
+    b.Define('batch_sum','batch_lead + Jet_pt[1]')
+    assert b.DataFrame.Sum('batch_sum').GetValue() == pytest.approx(batched)
+    assert len(b.Jit.batches) == 0 and b.Jit.times['Define']['n'] == 2
+
+def test_CalibrateVars():
+    sums = []
+    for fused in [True,False]:
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        jes = Calibration('testJES','test/test_calib.cc',[1.02,0.03],corrtype='weight')
+        jer = Calibration('testJER','test/test_calib.cc',[0.98,0.05],corrtype='weight')
+        a.CalibrateVars({'Jet_pt':[jes,jer],'Jet_mass':[jes]},{jes:{'pt':'Jet_pt'},jer:{'pt':'Jet_pt'}},'CalibratedJets',fused=fused)
+        cols = ['Jet_pt_nom','Jet_pt_testJES__up','Jet_pt_testJER__down','Jet_mass_nom','Jet_mass_testJES__down','testJES_up']
+        sums.append([a.DataFrame.Sum(c) for c in cols])
+    assert [s.GetValue() for s in sums[0]] == pytest.approx([s.GetValue() for s in sums[1]])
+
+def test_CalibrateScalar():
+    a = analyzer('examples/GluGluToHToTauTau.root')
+    a.Cut('calib_scalar_cut','nJet > 0')
+    a.Define('Jet_pt0','Jet_pt[0]')
+    calib = Calibration('scalarCalib','test/test_weight.cc',corrtype='weight')
+    assert calib.GetType() == 'weight'
+    a.CalibrateVars({'Jet_pt0':[calib]},{calib:{'pt':'Jet_pt0'}},'CalibratedJets')
+    diff = a.Cut('calib_scalar_diff','Jet_pt0_scalarCalib__up != Jet_pt0*scalarCalib__vec[1] || Jet_pt0_scalarCalib__down != Jet_pt0*scalarCalib__vec[2]')
+    assert diff.DataFrame.Count().GetValue() == 0
+
+def test_CompactWeights():
+    sums = []
+    for compact in [True,False]:
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Cut('compact_cut','nJet > 1')
+        a.Define('Jet_pt0','Jet_pt[0]')
+        a.Define('Jet_pt1','Jet_pt[1]')
+        c1 = Correction('compact_weight1','test/test_weight.cc')
+        c2 = Correction('compact_weight2','test/test_weight.cc')
+        u = Correction('compact_uncert','test/test_weight.cc',corrtype='uncert')
+        a.AddCorrection(c1,{'pt':'Jet_pt0'})
+        a.AddCorrection(c2,{'pt':'Jet_pt1'})
+        a.AddCorrection(u,{'pt':'Jet_pt1'})
+        a.MakeWeightCols('compact',correlations=[('compact_weight1','!compact_weight2')],extraNominal='2',compact=compact)
+        assert a.GetWeightName(c1,'up','compact') == 'weight_compact__compact_weight1_up'
+        cols = ['weight_compact__nominal','weight_compact__compact_weight1_up','weight_compact__compact_weight1_down',
+                'weight_compact__compact_uncert_up','weight_compact__compact_uncert_down']
+        sums.append([a.DataFrame.Sum(c) for c in cols])
+    assert [s.GetValue() for s in sums[0]] == pytest.approx([s.GetValue() for s in sums[1]])
+
+def test_FusedTemplateHistos():
+    groups = []
+    for fused in [True,False]:
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Cut('template_cut','nJet > 0')
+        a.Define('Jet_pt0','Jet_pt[0]')
+        a.Define('Jet_eta0','Jet_eta[0]')
+        c1 = Correction('template_weight1','test/test_weight.cc')
+        u = Correction('template_uncert','test/test_weight.cc',corrtype='uncert')
+        a.AddCorrection(c1,{'pt':'Jet_pt0'})
+        a.AddCorrection(u,{'pt':'Jet_pt0'})
+        a.MakeWeightCols()
+        groups.append(a.MakeTemplateHistos(ROOT.TH2F('th2','',20,0,200,10,-3,3),['Jet_pt0','Jet_eta0'],fused=fused))
+        assert len([b for b in a._bookings if b['kind'] == 'MultiHisto']) == int(fused)
+    assert groups[0].keys() == groups[1].keys() and len(groups[0].keys()) == 5
+    for k in groups[0].keys():
+        h0, h1 = groups[0][k], groups[1][k]
+        assert h0.GetName() == h1.GetName() and h0.GetEntries() == h1.GetEntries()
+        assert h0.GetMean(1) == pytest.approx(h1.GetMean(1)) and h0.GetStdDev(2) == pytest.approx(h1.GetStdDev(2))
+        for b in range(h0.GetNcells()):
+            assert h0.GetBinContent(b) == pytest.approx(h1.GetBinContent(b))
+            assert h0.GetBinError(b) == pytest.approx(h1.GetBinError(b))
+
 def test_CollectionGroup():
     a = analyzer('examples/GluGluToHToTauTau.root')
     assert ('Jet' in a.GetCollectionNames())
@@ -1,3 +1,4 @@
+import pytest, glob
 from TIMBER.Analyzer import analyzer
 from TIMBER.Tools.Common import *
 
@@ -38,4 +39,96 @@ class TestCommon():
         binning,dim = GetHistBinningTuple(h3)
         assert binning == (10,0,10,20,0,20,30,0,30)
         assert dim == 3
-        pass
\ No newline at end of file
+        pass
+
+    def test_LoadFrameworkDictionary(self):
+        os.environ['TIMBER_NO_DICT'] = '1'
+        assert LoadFrameworkDictionary() == False
+        del os.environ['TIMBER_NO_DICT']
+        assert LoadFrameworkDictionary() == (GetFrameworkDictionaryMode() != None)
+        assert GetFrameworkDictionaryMode() in [None,'module','dictionary']
+
+    def test_StaleFrameworkDictionary(self,tmpdir):
+        timberpath = os.environ['TIMBERPATH']
+        tmpdir.mkdir('bin').mkdir('libtimber').join('libtimber_dict.so').write('')
+        os.utime(str(tmpdir.join('bin','libtimber','libtimber_dict.so')),(0,0))
+        tmpdir.mkdir('TIMBER').mkdir('Framework').mkdir('include').join('stale.h').write('')
+        os.environ['TIMBERPATH'] = str(tmpdir)+'/'
+        try:
+            assert LoadFrameworkDictionary() == False # header newer than the dictionary
+        finally:
+            os.environ['TIMBERPATH'] = timberpath
+
+    def test_CompileCppOnce(self):
+        from TIMBER.Tools import Common
+        code = 'int test_compile_once = 1;'
+        CompileCpp(code)
+        CompileCpp(code) # would be a redefinition if declared again
+        assert ContentHash([code]) in Common._compiledCode
+        assert ROOT.test_compile_once == 1
+
+    def test_Cutflow(self):
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Define('cutflow_w','2.0')
+        a.Cut('cutflow_cut1','nJet > 0')
+        a.Cut('cutflow_cut2','nJet > 1')
+        cf = a.BookCutflow('cutflow_w')
+        plain = a.BookCutflow(name='plain')
+        assert a.DataFrame.GetNRuns() == 0
+        assert cf.keys() == ['Initial','cutflow_cut1','cutflow_cut2']
+        assert cf['cutflow_cut2'] == 2*plain['cutflow_cut2']
+        assert a.DataFrame.GetNRuns() == 1
+        assert plain.AsDict() == CutflowDict(a.GetActiveNode())
+
+        cf.Save('test_cutflow.json')
+        total = cf + Cutflow.Load('test_cutflow.json')
+        assert total['Initial'] == 2*cf['Initial']
+        assert total.steps['Initial']['count'] == 2*cf.steps['Initial']['count']
+
+    def test_CutflowLateWeight(self):
+        a = analyzer('examples/GluGluToHToTauTau.root')
+        a.Cut('late_cut1','nJet > 0')
+        a.Define('late_w','2.0')
+        a.Cut('late_cut2','nJet > 1')
+        cf = a.BookCutflow('late_w')
+        assert cf.steps['Initial']['sumw'] == None and cf['Initial'] == cf.steps['Initial']['count']
+        assert cf['late_cut2'] == 2*cf.steps['late_cut2']['count']
+        with pytest.raises(ValueError):
+            a.BookCutflow('not_a_column')
+
+    def test_WatchLoopsException(self):
+        df = ROOT.RDataFrame(10)
+        monitor = LoopMonitor(df)
+        with pytest.raises(ValueError):
+            with WatchLoops(monitor,'raises'):
+                df.Count().GetValue()
+                raise ValueError('inside the watched block')
+        assert [l['what'] for l in monitor.loops] == ['raises'] # not left to be found as untracked
+
+    def test_SaveHeaderTimings(self):
+        from TIMBER.Tools import Common
+        timingfile = GetCacheDir('headers')+'declare_times.json'
+        Common._headerTimings['test_fake_header.h'] = 0.5
+        Common._saveHeaderTimings()
+        timing = OpenJSON(timingfile)
+        assert timing['test_fake_header.h'] == 0.5 and len(Common._headerTimings) == 0
+        del timing['test_fake_header.h']
+        WriteJSON(timing,timingfile)
+
+    def test_CompileLibraryStableKey(self):
+        from TIMBER.Tools import Common
+        srcdir = GetCacheDir('test_library')
+        with open(srcdir+'timber_test_library.cc','w') as f:
+            f.write('int timber_test_library() { return 7; }\n')
+        cwd = os.getcwd()
+        try:
+            os.chdir(srcdir)
+            CompileCpp(srcdir+'timber_test_library.cc',library=True)
+        finally:
+            os.chdir(cwd)
+        nCompiled = len(Common._compiledCode)
+        CompileCpp(srcdir+'timber_test_library.cc',library=True) # same key from another directory and include path
+        assert len(Common._compiledCode) == nCompiled
+        libdirs = [d for d in glob.glob(GetCacheDir('libs')+'*/') if os.path.exists(d+'timber_test_library.cc')]
+        assert len(libdirs) >= 1 # source kept next to the library for the dictionary
+        assert ROOT.timber_test_library() == 7
@@ -0,0 +1,24 @@
+#include <vector>
+#include "ROOT/RVec.hxx"
+
+using namespace ROOT::VecOps;
+
+class testCalib
+{
+private:
+    float scale, uncert;
+public:
+    testCalib(float scale, float uncert);
+    RVec<RVec<float>> eval(RVec<float> pt);
+};
+
+testCalib::testCalib(float scale, float uncert) : scale(scale), uncert(uncert) {}
+
+RVec<RVec<float>> testCalib::eval(RVec<float> pt) {
+    RVec<RVec<float>> out;
+    for (size_t i = 0; i < pt.size(); i++) {
+        float nom = scale*(1+pt[i]/10000.);
+        out.push_back({nom, nom+uncert, nom-uncert});
+    }
+    return out;
+}